@@ -5,26 +5,286 @@
 """
 import os
 import sys
-from flask import Flask, render_template, request, jsonify, send_from_directory
+import json
+import zlib
+import hashlib
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, session
 from werkzeug.utils import secure_filename
 import traceback
+import numpy as np
 
 # 添加utils目录到路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'utils'))
 
-from nrrd_loader import NRRDLoader, scan_nrrd_files
+from nrrd_loader import NRRDLoader, WINDOW_PRESETS, MAX_PYRAMID_LEVEL, probe_nrrd_header
 from annotation_manager import AnnotationManager, Annotation
+from volume_cache import VolumeCache
+from volume_prefetcher import VolumePrefetcher
+from request_sequencer import RequestSequencer
+from slice_codecs import parse_codec_spec, available_codecs
+from directory_index import DirectoryIndex
+from directory_counter import DirectoryCounter
+from load_jobs import LoadJobManager, FINISHED_STATES
+from compressed_volume import available_compressors
+from workspaces import Workspace, WorkspaceManager
+from shared_volumes import SharedVolumeLoader
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'medical_annotation_tool_2026'
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
+app.config['SIDECAR_CACHE'] = False  # 是否写入/使用标准化结果缓存文件
+app.config['SIDECAR_DIR'] = None     # sidecar目录, None表示数据文件旁的 .cpr_cache
+app.config['NORMALIZATION'] = 'histogram'  # 强度标准化方式
+app.config['KEEP_RAW'] = False       # 保留原始HU数据, 用于服务端窗宽窗位渲染(约使体数据内存翻倍)
+app.config['EAGER_CPR'] = False      # 加载时预先构建X/Y视图堆叠
+app.config['SLICE_CODEC'] = 'png'    # JSON接口中切片图像的编码器(如 png、png:1、webp)
+app.config['VOLUME_COMPRESSION'] = None  # 常驻体数据的压缩方式(auto/zlib/lz4), None表示不压缩
+app.config['LOAD_WORKERS'] = 0       # 加载进程数, 0表示在服务进程内加载
+
+# 已加载体数据的LRU缓存(预算可通过 --volume-cache-mb 调整), 同时作为各会话共享的体数据池:
+# 会话正在查看的体数据按引用计数固定, 多名医生打开同一文件时只加载一份
+DEFAULT_VOLUME_CACHE_MB = 1024
+volume_cache = VolumeCache(DEFAULT_VOLUME_CACHE_MB * 1024 * 1024)
+
+# 单次批量获取Z切片的最大数量
+MAX_SLAB_SLICES = 64
+
+# 记录每个客户端最新的切片请求序号, 跳过已被取代的请求
+request_sequencer = RequestSequencer()
+
+# NRRD文件目录索引(持久化到SQLite, 切换目录时只重新列出有变化的子目录)
+DEFAULT_INDEX_DB = os.path.join(os.path.expanduser('~'), '.cache', 'cpr_annotation_tool', 'directory_index.sqlite')
+directory_index = DirectoryIndex()
+
+# 文件列表分页大小
+DEFAULT_FILE_PAGE_SIZE = 200
+MAX_FILE_PAGE_SIZE = 2000
+
+# 目录浏览器中子目录NRRD文件数: 后台按预算统计并缓存, 客户端轮询结果
+directory_counter = DirectoryCounter()
 
-# 全局变量存储当前加载的数据
-current_loader = None
-current_annotation_manager = None
-current_doctor_name = ""
-current_data_directory = ""
+# 后台加载任务: 同一会话的新任务开始时取消该会话之前的任务;
+# 切换当前文件时持有工作区锁, 保证被取消的任务不会覆盖新文件
+load_jobs = LoadJobManager()
+# 事件流无状态变化时重发当前状态的间隔(秒), 兼作保活
+LOAD_EVENT_KEEPALIVE = 15
+
+# 按体数据指纹寻址的切片URL内容不变, 浏览器和代理可长期缓存
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+# 加载进程池(--load-workers > 0 时创建): 读取和标准化在独立进程中进行, 不阻塞服务进程的请求线程,
+# 体数据通过共享内存交回, 各请求线程零拷贝读取同一份数据
+shared_volume_loader = None
+
+# 生产模式默认的请求线程数和加载进程数
+DEFAULT_SERVER_THREADS = 8
+DEFAULT_PRODUCTION_LOAD_WORKERS = 2
+
+
+def create_loader(file_path: str, progress_callback=None) -> NRRDLoader:
+    """按当前配置创建NRRDLoader"""
+    options = dict(use_sidecar=app.config['SIDECAR_CACHE'],
+                   sidecar_dir=app.config['SIDECAR_DIR'],
+                   normalization=app.config['NORMALIZATION'],
+                   keep_raw=app.config['KEEP_RAW'],
+                   eager_cpr=app.config['EAGER_CPR'],
+                   compression=app.config['VOLUME_COMPRESSION'])
+    if shared_volume_loader is not None:
+        return shared_volume_loader.load(file_path, options, progress_callback)
+    return NRRDLoader(file_path, progress_callback=progress_callback, **options)
+
+
+# 后台预取文件列表中相邻的文件
+DEFAULT_PREFETCH_RADIUS = 1
+DEFAULT_PREFETCH_WORKERS = 1
+volume_prefetcher = VolumePrefetcher(volume_cache, create_loader,
+                                     radius=DEFAULT_PREFETCH_RADIUS,
+                                     max_workers=DEFAULT_PREFETCH_WORKERS)
+
+
+# 会话工作区(按会话cookie区分), 长时间未活动的工作区释放其体数据引用
+workspaces = WorkspaceManager(volume_cache,
+                              on_expire=lambda workspace: volume_prefetcher.forget(workspace.workspace_id))
+
+
+def current_workspace() -> Workspace:
+    """获取当前请求所属会话的工作区(首次访问时分配工作区ID并写入会话cookie)"""
+    workspace_id = session.get('workspace_id')
+    if not workspace_id:
+        workspace_id = session['workspace_id'] = WorkspaceManager.new_id()
+        session.permanent = True
+    return workspaces.get(workspace_id)
+
+
+def load_volume(file_path: str, owner: str, progress_callback=None) -> NRRDLoader:
+    """
+    从共享体数据池获取体数据(引用计数加一): 依次尝试缓存、预取结果, 最后同步加载;
+    其他会话正在加载同一文件时等待并共享其结果
+
+    Args:
+        file_path: NRRD文件路径
+        owner: 会话ID(用于按会话的文件列表预取相邻文件)
+        progress_callback: 需要实际加载时传给NRRDLoader的进度回调, 等待预取或其他会话的加载时也定期调用
+            (抛出LoadCancelled时停止等待)
+
+    Returns:
+        NRRDLoader, 不再使用时需调用 volume_cache.release
+    """
+    # 预取结果已放入共享池时直接命中; 未能放入(超出预算)时由acquire固定到池中
+    prefetched = volume_prefetcher.take(file_path, progress_callback)
+    loader = volume_cache.acquire(
+        file_path, lambda path: prefetched or create_loader(path, progress_callback), progress_callback)
+
+    # 预取相邻文件
+    volume_prefetcher.prefetch_around(file_path, owner)
+    return loader
+
+
+def find_volume(volume_id: str):
+    """按体数据指纹查找已加载的体数据(当前会话的文件或共享池中的文件)"""
+    loader = current_workspace().loader
+    if loader is not None and loader.volume_id == volume_id:
+        return loader
+    return volume_cache.find_by_id(volume_id)
+
+
+def slice_axis_size(loader: NRRDLoader, axis: str) -> int:
+    """获取指定轴的切片数量"""
+    return loader.shape[{'x': 2, 'y': 1, 'z': 0}[axis]]
+
+
+def attach_headers(file_list: list) -> list:
+    """为文件列表附加文件头信息(尺寸、间距), 只读取文件头并按mtime缓存"""
+    headers = directory_index.get_headers([f['path'] for f in file_list], probe_nrrd_header)
+    for f in file_list:
+        f['header'] = headers.get(f['path'])
+    return file_list
+
+
+def clamp_slice_index(loader: NRRDLoader, axis: str, index: int) -> int:
+    """将切片索引限制在对应轴的有效范围内"""
+    if axis == 'x':
+        max_idx = loader.shape[2] - 1
+    elif axis == 'y':
+        max_idx = loader.shape[1] - 1
+    else:  # z
+        max_idx = loader.shape[0] - 1
+
+    return max(0, min(index, max_idx))
+
+
+def parse_window(data: dict):
+    """
+    从请求中解析窗宽窗位(preset 或 window + level)
+
+    Returns:
+        (窗宽, 窗位), 未指定时返回None
+    """
+    preset = data.get('preset')
+    if preset:
+        if preset not in WINDOW_PRESETS:
+            raise ValueError(f"未知的窗宽窗位预设: {preset}")
+        return WINDOW_PRESETS[preset]
+
+    if data.get('window') is None or data.get('level') is None:
+        return None
+    return float(data['window']), float(data['level'])
+
+
+def parse_pyramid_level(data) -> int:
+    """从请求中解析金字塔层级(pyramid_level, 0为原分辨率)"""
+    return max(0, min(int(data.get('pyramid_level') or 0), MAX_PYRAMID_LEVEL))
+
+
+def parse_viewport(data):
+    """
+    从请求中解析视口裁剪参数
+
+    region 为 "x0,y0,x1,y1"(或列表), 原分辨率切片像素坐标; size 为 "宽,高"(或列表)
+
+    Returns:
+        (region, width, height), 未指定region时返回None
+    """
+    region = data.get('region')
+    if not region:
+        return None
+    if isinstance(region, str):
+        region = region.split(',')
+    size = data.get('size') or ''
+    if isinstance(size, str):
+        size = size.split(',')
+    if len(region) != 4 or len(size) != 2:
+        raise ValueError('视口参数格式应为 region=x0,y0,x1,y1 和 size=宽,高')
+    return tuple(float(v) for v in region), int(size[0]), int(size[1])
+
+
+def render_slice(loader, axis: str, index: int, data, window_level) -> np.ndarray:
+    """按请求参数渲染切片: 指定视口时裁剪重采样, 否则按金字塔层级返回整张切片"""
+    viewport = parse_viewport(data)
+    if viewport is not None:
+        return loader.get_viewport_slice(axis, index, *viewport, window_level=window_level)
+    return loader.get_display_slice(axis, index, parse_pyramid_level(data), window_level)
+
+
+def slice_headers(axis: str, index: int, slice_data: np.ndarray, data) -> dict:
+    """二进制切片响应的描述头"""
+    height, width = slice_data.shape
+    headers = {
+        'X-Slice-Width': str(width),
+        'X-Slice-Height': str(height),
+        'X-Slice-Axis': axis,
+        'X-Slice-Index': str(index)
+    }
+    viewport = parse_viewport(data)
+    if viewport is not None:
+        headers['X-Slice-Region'] = ','.join(f'{v:g}' for v in viewport[0])
+    else:
+        headers['X-Slice-Level'] = str(parse_pyramid_level(data))
+    return headers
+
+
+def stale_response(ticket) -> Response:
+    """已被新请求取代的二进制请求: 不做编码, 直接返回204"""
+    return Response(status=204, headers={'X-Request-Seq': str(ticket.seq),
+                                         'Cache-Control': 'no-store'})
+
+
+def binary_response(data, headers: dict, compress: bool = False,
+                    codec: str = None) -> Response:
+    """
+    构造二进制切片响应
+
+    Args:
+        data: uint8切片(或Z切片堆叠)数组
+        headers: 描述切片的响应头
+        compress: 是否尝试deflate传输压缩(仅在浏览器支持且未指定编码器时生效)
+        codec: 编码器描述(如 'zlib'、'lz4'、'png:1'), 为空时发送原始字节
+
+    Returns:
+        Flask Response
+    """
+    headers = dict(headers)
+    headers['Cache-Control'] = 'no-store'
+
+    if codec and codec != 'raw':
+        slice_codec, level = parse_codec_spec(codec)
+        if data.ndim != 2 and slice_codec.is_image:
+            raise ValueError(f"编码器 {slice_codec.name} 只能用于单个切片")
+        headers['X-Slice-Codec'] = slice_codec.name
+        return Response(slice_codec.encode(data, level), mimetype=slice_codec.mimetype,
+                        headers=headers)
+
+    payload = np.ascontiguousarray(data, dtype=np.uint8).tobytes()
+    headers['X-Slice-Codec'] = 'raw'
+
+    # deflate(zlib格式)由浏览器自动解压
+    if compress and 'deflate' in request.headers.get('Accept-Encoding', ''):
+        payload = zlib.compress(payload, 1)
+        headers['Content-Encoding'] = 'deflate'
+
+    return Response(payload, mimetype='application/octet-stream', headers=headers)
 
 
 @app.route('/')
@@ -36,12 +296,11 @@ def index():
 @app.route('/api/set_doctor', methods=['POST'])
 def set_doctor():
     """设置医生名字"""
-    global current_doctor_name
     try:
         data = request.json
-        doctor_name = data.get('doctor_name', '').strip()
-        current_doctor_name = doctor_name
-        return jsonify({'success': True, 'doctor_name': current_doctor_name})
+        workspace = current_workspace()
+        workspace.doctor_name = data.get('doctor_name', '').strip()
+        return jsonify({'success': True, 'doctor_name': workspace.doctor_name})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -49,9 +308,9 @@ def set_doctor():
 @app.route('/api/set_directory', methods=['POST'])
 def set_directory():
     """设置数据目录并扫描NRRD文件"""
-    global current_data_directory, current_doctor_name
     try:
         data = request.json
+        workspace = current_workspace()
         directory = data.get('directory', '').strip()
 
         if not os.path.exists(directory):
@@ -60,39 +319,31 @@ def set_directory():
         if not os.path.isdir(directory):
             return jsonify({'success': False, 'error': '路径不是目录'})
 
-        current_data_directory = directory
-
-        # 扫描NRRD文件
-        nrrd_files = scan_nrrd_files(directory)
-        file_list = []
-
-        for f in nrrd_files:
-            file_name = os.path.basename(f)
-            base_name = os.path.splitext(file_name)[0]
-
-            # 检查是否存在标注文件
-            has_annotation = False
-            # 检查带医生名字的标注文件
-            if current_doctor_name:
-                annotation_file = os.path.join(os.path.dirname(f), f"{base_name}_{current_doctor_name}_label.json")
-                if os.path.exists(annotation_file):
-                    has_annotation = True
-
-            # 如果没有带医生名字的，检查通用标注文件
-            if not has_annotation:
-                annotation_file = os.path.join(os.path.dirname(f), f"{base_name}_label.json")
-                if os.path.exists(annotation_file):
-                    has_annotation = True
-
-            file_list.append({
-                'path': f,
-                'name': file_name,
-                'has_annotation': has_annotation
+        workspace.data_directory = directory
+
+        # 扫描NRRD文件(增量刷新目录索引, 标注状态按目录一次性查找)
+        directory_index.refresh(directory)
+        volume_prefetcher.set_file_list(directory_index.list_paths(directory), workspace.workspace_id)
+
+        # 指定page_size时只返回第一页, 后续页通过 /api/files 按游标获取
+        page_size = data.get('page_size')
+        if page_size:
+            file_list, next_cursor = directory_index.list_files_page(
+                directory, workspace.doctor_name, limit=min(int(page_size), MAX_FILE_PAGE_SIZE))
+            return jsonify({
+                'success': True,
+                'directory': workspace.data_directory,
+                'files': attach_headers(file_list),
+                'next_cursor': next_cursor,
+                'count': directory_index.count_files(directory)
             })
 
+        file_list = directory_index.list_files(directory, workspace.doctor_name)
+        if data.get('include_headers'):
+            attach_headers(file_list)
         return jsonify({
             'success': True,
-            'directory': current_data_directory,
+            'directory': workspace.data_directory,
             'files': file_list,
             'count': len(file_list)
         })
@@ -101,67 +352,228 @@ def set_directory():
         return jsonify({'success': False, 'error': str(e)})
 
 
+@app.route('/api/files', methods=['GET'])
+def list_files():
+    """
+    按游标分页获取当前目录的文件列表
+
+    查询参数: cursor(上一页返回的next_cursor)、limit、status(annotated/unannotated)、prefix(文件名前缀);
+    返回的next_cursor为null表示没有更多文件
+    """
+    workspace = current_workspace()
+    if not workspace.data_directory:
+        return jsonify({'success': False, 'error': '未设置数据目录'})
+
+    try:
+        args = request.args
+        limit = min(int(args.get('limit', DEFAULT_FILE_PAGE_SIZE)), MAX_FILE_PAGE_SIZE)
+        file_list, next_cursor = directory_index.list_files_page(
+            workspace.data_directory, workspace.doctor_name,
+            cursor=args.get('cursor') or None,
+            limit=limit,
+            status=args.get('status') or None,
+            prefix=args.get('prefix', ''))
+
+        result = {
+            'success': True,
+            'files': attach_headers(file_list),
+            'next_cursor': next_cursor
+        }
+        # 第一页附带总数
+        if not args.get('cursor'):
+            result['count'] = directory_index.count_files(workspace.data_directory)
+        return jsonify(result)
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@app.route('/api/probe', methods=['GET'])
+def probe_file():
+    """只读取文件头获取尺寸和间距(不加载体素), 用于在加载完成前布局视图"""
+    try:
+        file_path = request.args.get('file_path', '').strip()
+        if not os.path.exists(file_path):
+            return jsonify({'success': False, 'error': '文件不存在'})
+
+        header = directory_index.get_headers([file_path], probe_nrrd_header)[file_path]
+        if header is None:
+            return jsonify({'success': False, 'error': '无法读取文件头'})
+        return jsonify({'success': True, 'header': header})
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)})
+
+
+def build_load_result(loader: NRRDLoader, annotation_manager: AnnotationManager,
+                      include_slices: bool, codec: str) -> dict:
+    """
+    构造文件加载结果(数据信息、已有标注, 可选中心切片图像)
+
+    Args:
+        loader: 已加载的NRRDLoader
+        annotation_manager: 该文件的标注管理器
+        include_slices: 是否附带三个中心切片
+        codec: 中心切片的图像编码器
+
+    Returns:
+        结果字典
+    """
+    info = loader.get_info()
+    result = {
+        'success': True,
+        'info': info,
+        'annotations': annotation_manager.get_all_annotations()
+    }
+
+    if include_slices:
+        # 获取中心切片图像
+        result['slices'] = {
+            axis: loader.slice_to_base64(
+                loader.get_slice_with_rotation(axis, info['center'][axis]), codec
+            )
+            for axis in ('x', 'y', 'z')
+        }
+
+    return result
+
+
 @app.route('/api/load_file', methods=['POST'])
 def load_file():
-    """加载NRRD文件"""
-    global current_loader, current_annotation_manager
-
+    """加载NRRD文件(同步; 界面使用 /api/load_jobs 后台加载)"""
     try:
         data = request.json
         file_path = data.get('file_path', '').strip()
+        # 客户端使用二进制切片接口时可跳过PNG中心切片
+        include_slices = data.get('include_slices', True)
 
         if not os.path.exists(file_path):
             return jsonify({'success': False, 'error': '文件不存在'})
 
-        # 加载NRRD数据
-        current_loader = NRRDLoader(file_path)
+        # 加载NRRD数据(优先使用共享池和预取结果)
+        workspace = current_workspace()
+        loader = load_volume(file_path, workspace.workspace_id)
 
         # 初始化标注管理器
-        current_annotation_manager = AnnotationManager(file_path, current_doctor_name)
+        try:
+            annotation_manager = workspaces.annotations.acquire(file_path, workspace.doctor_name)
+        except Exception:
+            volume_cache.release(loader)
+            raise
+        workspaces.open_file(workspace, loader, annotation_manager)
 
-        # 获取数据信息
-        info = current_loader.get_info()
+        return jsonify(build_load_result(loader, annotation_manager, include_slices,
+                                         data.get('codec') or app.config['SLICE_CODEC']))
 
-        # 获取已有标注
-        annotations = current_annotation_manager.get_all_annotations()
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)})
 
-        # 获取中心切片图像
-        center_x = info['center']['x']
-        center_y = info['center']['y']
-        center_z = info['center']['z']
 
-        x_slice = current_loader.slice_to_base64(
-            current_loader.get_slice_with_rotation('x', center_x)
-        )
-        y_slice = current_loader.slice_to_base64(
-            current_loader.get_slice_with_rotation('y', center_y)
-        )
-        z_slice = current_loader.slice_to_base64(
-            current_loader.get_slice_with_rotation('z', center_z)
-        )
+def run_load_job(job, workspace: Workspace, include_slices: bool, codec: str) -> dict:
+    """后台加载任务: 加载体数据并构造加载结果, 最后在未被取消时切换为工作区的当前文件"""
+    loader = load_volume(job.file_path, workspace.workspace_id, job.report)
+    try:
+        job.report('annotations', 0.96)
+        annotation_manager = workspaces.annotations.acquire(job.file_path, workspace.doctor_name)
+        try:
+            job.report('slices', 0.98)
+            result = build_load_result(loader, annotation_manager, include_slices, codec)
+        except BaseException:
+            workspaces.annotations.release(annotation_manager)
+            raise
+    except BaseException:
+        volume_cache.release(loader)
+        raise
+
+    # 切换工作区是最后一步: 已取消时释放引用并中止, 不覆盖工作区中更新的文件;
+    # 切换完成后任务即为完成, 之后到达的取消请求不再改变结果
+    workspaces.open_file(workspace, loader, annotation_manager, check=job.check_cancelled)
+    return result
+
+
+@app.route('/api/load_jobs', methods=['POST'])
+def start_load_job():
+    """
+    开始后台加载文件, 返回任务ID(之前未完成的加载任务会被取消)
+
+    进度通过 GET /api/load_jobs/<job_id> 轮询或 GET /api/load_jobs/<job_id>/events (SSE) 获取,
+    完成后任务状态的 result 字段与 /api/load_file 的返回相同
+    """
+    try:
+        data = request.json
+        file_path = data.get('file_path', '').strip()
+        include_slices = data.get('include_slices', True)
+        codec = data.get('codec') or app.config['SLICE_CODEC']
 
-        return jsonify({
-            'success': True,
-            'info': info,
-            'annotations': annotations,
-            'slices': {
-                'x': x_slice,
-                'y': y_slice,
-                'z': z_slice
-            }
-        })
+        if not os.path.exists(file_path):
+            return jsonify({'success': False, 'error': '文件不存在'})
+
+        workspace = current_workspace()
+        job = load_jobs.start(file_path, lambda job: run_load_job(job, workspace, include_slices, codec),
+                              owner=workspace.workspace_id)
+        return jsonify({'success': True, 'job_id': job.job_id})
 
     except Exception as e:
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)})
 
 
+def find_load_job(job_id: str):
+    """查找当前会话的加载任务(其他会话的任务视为不存在)"""
+    job = load_jobs.get(job_id)
+    if job is None or job.owner != current_workspace().workspace_id:
+        return None
+    return job
+
+
+@app.route('/api/load_jobs/<job_id>', methods=['GET'])
+def get_load_job(job_id):
+    """查询加载任务状态"""
+    job = find_load_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+
+@app.route('/api/load_jobs/<job_id>/cancel', methods=['POST'])
+def cancel_load_job(job_id):
+    """取消加载任务"""
+    job = find_load_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    job.cancel()
+    return jsonify({'success': True})
+
+
+@app.route('/api/load_jobs/<job_id>/events', methods=['GET'])
+def load_job_events(job_id):
+    """以Server-Sent Events推送加载任务状态, 任务结束后关闭"""
+    job = find_load_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+
+    def stream():
+        version = -1
+        while True:
+            job.wait_for_update(version, LOAD_EVENT_KEEPALIVE)
+            status = job.to_dict()
+            version = status['version']
+            yield f"data: {json.dumps(status, ensure_ascii=False)}\n\n"
+            if status['state'] in FINISHED_STATES:
+                break
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/api/get_slice', methods=['POST'])
 def get_slice():
     """获取指定轴向和位置的切片"""
-    global current_loader
-
-    if current_loader is None:
+    loader = current_workspace().loader
+    if loader is None:
         return jsonify({'success': False, 'error': '未加载数据'})
 
     try:
@@ -170,19 +582,18 @@ def get_slice():
         index = int(data.get('index', 0))
 
         # 验证索引范围
-        if axis == 'x':
-            max_idx = current_loader.shape[2] - 1
-        elif axis == 'y':
-            max_idx = current_loader.shape[1] - 1
-        else:  # z
-            max_idx = current_loader.shape[0] - 1
+        index = clamp_slice_index(loader, axis, index)
+
+        ticket = request_sequencer.register(data.get('client_id'), f'slice-{axis}', data.get('seq'))
+        slice_data = loader.get_display_slice(axis, index, parse_pyramid_level(data))
 
-        index = max(0, min(index, max_idx))
+        # 已有更新的请求, 跳过PNG编码
+        if request_sequencer.is_stale(ticket):
+            return jsonify({'success': False, 'stale': True, 'error': '请求已被取代'})
 
         # 获取切片
-        slice_img = current_loader.slice_to_base64(
-            current_loader.get_slice_with_rotation(axis, index)
-        )
+        codec = data.get('codec') or app.config['SLICE_CODEC']
+        slice_img = loader.slice_to_base64(slice_data, codec)
 
         return jsonify({
             'success': True,
@@ -195,12 +606,156 @@ def get_slice():
         return jsonify({'success': False, 'error': str(e)})
 
 
+@app.route('/api/get_slice_binary', methods=['POST'])
+def get_slice_binary():
+    """
+    获取切片的原始uint8像素(二进制响应, 不经过PNG和base64)
+
+    响应头 X-Slice-Width / X-Slice-Height / X-Slice-Axis / X-Slice-Index 描述切片,
+    请求 compress=true 且浏览器支持时使用 deflate 压缩传输;
+    指定 window + level (或 preset) 时在原始HU数据上渲染窗宽窗位;
+    指定 pyramid_level=L 时返回块平均降采样(每边缩小 2^L 倍)的预览切片;
+    指定 region=[x0, y0, x1, y1] + size=[宽, 高] 时只返回裁剪并重采样后的可见区域(放大显示用)
+    """
+    loader = current_workspace().loader
+    if loader is None:
+        return jsonify({'success': False, 'error': '未加载数据'}), 400
+
+    try:
+        data = request.json
+        axis = data.get('axis', 'z')
+        index = clamp_slice_index(loader, axis, int(data.get('index', 0)))
+        # 视口请求与整张切片请求各自保留最新
+        channel = 'viewport' if data.get('region') else 'slice'
+        ticket = request_sequencer.register(data.get('client_id'), f'{channel}-{axis}', data.get('seq'))
+        window_level = parse_window(data)
+
+        if request_sequencer.is_stale(ticket):
+            return stale_response(ticket)
+
+        slice_data = render_slice(loader, axis, index, data, window_level)
+        # 渲染期间已有更新的请求, 跳过编码和压缩
+        if request_sequencer.is_stale(ticket):
+            return stale_response(ticket)
+
+        headers = slice_headers(axis, index, slice_data, data)
+        headers['X-Request-Seq'] = str(ticket.seq)
+        return binary_response(slice_data, headers, data.get('compress'), data.get('codec'))
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/slice/<volume_id>/<axis>/<int:index>', methods=['GET'])
+def get_slice_by_id(volume_id, axis, index):
+    """
+    按体数据指纹获取切片(可被浏览器/反向代理缓存)
+
+    URL内容只由 volume_id、轴、索引和查询参数决定, 响应带强ETag和长期Cache-Control,
+    If-None-Match 命中时直接返回304; 查询参数 codec 选择编码器(默认与JSON接口相同),
+    window + level (或 preset) 在原始HU数据上渲染窗宽窗位, pyramid_level=L 返回每边缩小 2^L 倍的预览切片,
+    region=x0,y0,x1,y1 + size=宽,高 只返回裁剪重采样后的可见区域, compress=1 时raw编码使用deflate传输;
+    可选请求头 X-Client-Id / X-Request-Seq 用于跳过已被取代的请求(不影响缓存键)
+    """
+    loader = find_volume(volume_id)
+    if loader is None:
+        return jsonify({'success': False, 'error': '体数据未加载或已失效'}), 404
+    if axis not in ('x', 'y', 'z') or not 0 <= index < slice_axis_size(loader, axis):
+        return jsonify({'success': False, 'error': '切片索引超出范围'}), 404
+
+    try:
+        args = request.args
+        codec = args.get('codec') or app.config['SLICE_CODEC']
+        compress = args.get('compress') in ('1', 'true')
+        window_level = parse_window(args)
+        pyramid_level = parse_pyramid_level(args)
+        viewport = parse_viewport(args)
+        parse_codec_spec(codec)
+
+        # 强ETag: 同一URL参数对应完全相同的字节(deflate由Accept-Encoding决定, 单独区分)
+        deflate = compress and codec == 'raw' and \
+            'deflate' in request.headers.get('Accept-Encoding', '')
+        etag_key = f"{volume_id}|{axis}|{index}|{pyramid_level}|{viewport}|{codec}|{window_level}|{deflate}"
+        etag = hashlib.sha1(etag_key.encode('utf-8')).hexdigest()
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            channel = 'viewport' if viewport is not None else 'slice'
+            ticket = request_sequencer.register(request.headers.get('X-Client-Id'), f'{channel}-{axis}',
+                                                request.headers.get('X-Request-Seq'))
+            if request_sequencer.is_stale(ticket):
+                return stale_response(ticket)
+
+            slice_data = render_slice(loader, axis, index, args, window_level)
+            if request_sequencer.is_stale(ticket):
+                return stale_response(ticket)
+            response = binary_response(slice_data, slice_headers(axis, index, slice_data, args),
+                                       compress, codec)
+
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/get_slab', methods=['POST'])
+def get_slab():
+    """
+    批量获取一段连续的Z轴切片, 打包为一个二进制缓冲区(按Z顺序依次排列)
+
+    响应头 X-Slab-Start / X-Slab-Count 给出实际返回的范围(可能被截断到数据边界);
+    请求可附带 slab_window=[lo, hi), 之后起始位置落在新窗口之外的旧请求会被跳过;
+    window/level(或preset)用于服务端窗宽窗位渲染
+    """
+    loader = current_workspace().loader
+    if loader is None:
+        return jsonify({'success': False, 'error': '未加载数据'}), 400
+
+    try:
+        data = request.json
+        start = clamp_slice_index(loader, 'z', int(data.get('start', 0)))
+        count = max(1, min(int(data.get('count', MAX_SLAB_SLICES)), MAX_SLAB_SLICES))
+        end = min(loader.shape[0], start + count)
+        ticket = request_sequencer.register(data.get('client_id'), 'slab',
+                                            data.get('seq'), data.get('slab_window'))
+
+        window_level = parse_window(data)
+
+        # 读者已滚动到别处, 该slab不再需要
+        if request_sequencer.is_stale(ticket, start):
+            return stale_response(ticket)
+
+        if window_level is not None:
+            slab = loader.render_z_slab_windowed(start, end, *window_level)
+        else:
+            slab = loader.get_z_slab(start, end)
+        _, height, width = slab.shape
+
+        return binary_response(slab, {
+            'X-Slice-Width': str(width),
+            'X-Slice-Height': str(height),
+            'X-Slab-Start': str(start),
+            'X-Slab-Count': str(end - start),
+            'X-Request-Seq': str(ticket.seq)
+        }, data.get('compress'), data.get('codec'))
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/add_annotation', methods=['POST'])
 def add_annotation():
     """添加新标注"""
-    global current_annotation_manager
-
-    if current_annotation_manager is None:
+    workspace = current_workspace()
+    annotation_manager = workspace.annotation_manager
+    if annotation_manager is None:
         return jsonify({'success': False, 'error': '未加载数据'})
 
     try:
@@ -218,7 +773,8 @@ def add_annotation():
         )
 
         # 添加到管理器
-        current_annotation_manager.add_annotation(annotation)
+        with workspace.lock:
+            annotation_manager.add_annotation(annotation)
 
         return jsonify({
             'success': True,
@@ -233,9 +789,9 @@ def add_annotation():
 @app.route('/api/update_annotation', methods=['POST'])
 def update_annotation():
     """更新标注"""
-    global current_annotation_manager
-
-    if current_annotation_manager is None:
+    workspace = current_workspace()
+    annotation_manager = workspace.annotation_manager
+    if annotation_manager is None:
         return jsonify({'success': False, 'error': '未加载数据'})
 
     try:
@@ -243,7 +799,8 @@ def update_annotation():
         annotation_id = data.get('annotation_id')
         updated_data = data.get('data', {})
 
-        success = current_annotation_manager.update_annotation(annotation_id, updated_data)
+        with workspace.lock:
+            success = annotation_manager.update_annotation(annotation_id, updated_data)
 
         return jsonify({'success': success})
 
@@ -255,16 +812,17 @@ def update_annotation():
 @app.route('/api/delete_annotation', methods=['POST'])
 def delete_annotation():
     """删除标注"""
-    global current_annotation_manager
-
-    if current_annotation_manager is None:
+    workspace = current_workspace()
+    annotation_manager = workspace.annotation_manager
+    if annotation_manager is None:
         return jsonify({'success': False, 'error': '未加载数据'})
 
     try:
         data = request.json
         annotation_id = data.get('annotation_id')
 
-        success = current_annotation_manager.remove_annotation(annotation_id)
+        with workspace.lock:
+            success = annotation_manager.remove_annotation(annotation_id)
 
         return jsonify({'success': success})
 
@@ -276,13 +834,14 @@ def delete_annotation():
 @app.route('/api/get_annotations', methods=['GET'])
 def get_annotations():
     """获取所有标注"""
-    global current_annotation_manager
-
-    if current_annotation_manager is None:
+    workspace = current_workspace()
+    annotation_manager = workspace.annotation_manager
+    if annotation_manager is None:
         return jsonify({'success': False, 'error': '未加载数据'})
 
     try:
-        annotations = current_annotation_manager.get_all_annotations()
+        with workspace.lock:
+            annotations = annotation_manager.get_all_annotations()
         return jsonify({
             'success': True,
             'annotations': annotations
@@ -296,19 +855,21 @@ def get_annotations():
 @app.route('/api/save_annotations', methods=['POST'])
 def save_annotations():
     """保存标注到文件"""
-    global current_annotation_manager
-
-    if current_annotation_manager is None:
+    workspace = current_workspace()
+    annotation_manager = workspace.annotation_manager
+    if annotation_manager is None:
         return jsonify({'success': False, 'error': '未加载数据'})
 
     try:
-        success = current_annotation_manager.save()
+        with workspace.lock:
+            success = annotation_manager.save()
+            annotations = annotation_manager.get_all_annotations()
 
         if success:
             return jsonify({
                 'success': True,
-                'file': current_annotation_manager.annotation_file,
-                'annotations': current_annotation_manager.get_all_annotations()
+                'file': annotation_manager.annotation_file,
+                'annotations': annotations
             })
         else:
             return jsonify({'success': False, 'error': '保存失败'})
@@ -350,33 +911,48 @@ def browse_directory():
         parent = os.path.dirname(path) if path != os.path.dirname(path) else None
 
         # 列出子目录
-        directories = []
         try:
-            items = os.listdir(path)
-            for item in sorted(items):
-                item_path = os.path.join(path, item)
-                if os.path.isdir(item_path):
-                    # 检查是否包含NRRD文件
-                    nrrd_count = 0
-                    try:
-                        nrrd_files = scan_nrrd_files(item_path)
-                        nrrd_count = len(nrrd_files)
-                    except:
-                        pass
-
-                    directories.append({
-                        'name': item,
-                        'path': item_path,
-                        'nrrd_count': nrrd_count
-                    })
+            with os.scandir(path) as it:
+                items = sorted((entry.name, entry.path) for entry in it if entry.is_dir())
         except PermissionError:
             return jsonify({'success': False, 'error': '没有权限访问此目录'})
 
+        # NRRD文件数: 有缓存时直接返回, 否则为None并在后台统计(客户端通过 /api/directory_counts 轮询)
+        counts = directory_counter.request([item_path for _, item_path in items])
+        directories = []
+        for item, item_path in items:
+            count = counts[item_path]
+            directories.append({
+                'name': item,
+                'path': item_path,
+                'nrrd_count': count['count'] if count else None,
+                'count_complete': count['complete'] if count else False
+            })
+
         return jsonify({
             'success': True,
             'current_path': path,
             'parent_path': parent,
-            'directories': directories
+            'directories': directories,
+            'counts_pending': any(count is None for count in counts.values())
+        })
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@app.route('/api/directory_counts', methods=['POST'])
+def directory_counts():
+    """轮询子目录NRRD文件数(只返回已统计完成的目录, 缓存失效的目录重新提交统计)"""
+    try:
+        paths = request.json.get('paths', [])
+        counts = {path: count for path, count in directory_counter.request(paths).items()
+                  if count is not None}
+        return jsonify({
+            'success': True,
+            'counts': counts,
+            'pending': len(paths) - len(counts)
         })
 
     except Exception as e:
@@ -386,25 +962,26 @@ def browse_directory():
 
 @app.route('/api/get_info', methods=['GET'])
 def get_info():
-    """获取当前数据信息"""
-    global current_loader, current_doctor_name, current_data_directory
+    """获取当前会话的数据信息"""
+    workspace = current_workspace()
+    loader = workspace.loader
 
-    if current_loader is None:
+    if loader is None:
         return jsonify({
             'success': True,
             'loaded': False,
-            'doctor_name': current_doctor_name,
-            'directory': current_data_directory
+            'doctor_name': workspace.doctor_name,
+            'directory': workspace.data_directory
         })
 
     try:
-        info = current_loader.get_info()
+        info = loader.get_info()
         return jsonify({
             'success': True,
             'loaded': True,
             'info': info,
-            'doctor_name': current_doctor_name,
-            'directory': current_data_directory
+            'doctor_name': workspace.doctor_name,
+            'directory': workspace.data_directory
         })
 
     except Exception as e:
@@ -412,9 +989,45 @@ def get_info():
         return jsonify({'success': False, 'error': str(e)})
 
 
+@app.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    """获取体数据缓存和预取统计(命中/未命中/淘汰次数)"""
+    loader = current_workspace().loader
+    return jsonify({
+        'success': True,
+        'volume_cache': volume_cache.stats(),
+        'prefetch': volume_prefetcher.stats(),
+        'requests': request_sequencer.stats(),
+        'codecs': available_codecs(),
+        'directory_index': directory_index.stats(),
+        'directory_counts': directory_counter.stats(),
+        'volume_store': loader.volume_store_stats() if loader is not None else None,
+        'workspaces': workspaces.stats(),
+        'shared_volumes': shared_volume_loader.stats() if shared_volume_loader is not None else None
+    })
+
+
+def serve(host: str, port: int, threads: int):
+    """
+    生产模式: 使用waitress多线程服务(未安装时报错退出, 不退回Flask开发服务器)
+
+    会话工作区和共享体数据池保存在服务进程内, 因此只使用一个服务进程;
+    耗时的文件加载在加载进程池中进行, 请求线程只做切片和编码(numpy/编码器大多释放GIL)
+    """
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        print("错误: 生产模式需要waitress, 但未安装 (pip install -r requirements.txt)", file=sys.stderr)
+        sys.exit(1)
+    waitress_serve(app, host=host, port=port, threads=threads)
+
+
 def main():
     """主函数"""
     import argparse
+    import atexit
+
+    global shared_volume_loader
 
     parser = argparse.ArgumentParser(description='医学影像标注工具')
     parser.add_argument('--host', type=str, default='127.0.0.1',
@@ -423,17 +1036,76 @@ def main():
                       help='服务器端口 (default: 5000)')
     parser.add_argument('--debug', action='store_true',
                       help='启用调试模式')
+    parser.add_argument('--volume-cache-mb', type=int, default=DEFAULT_VOLUME_CACHE_MB,
+                      help=f'体数据缓存内存预算(MB), 0表示禁用 (default: {DEFAULT_VOLUME_CACHE_MB})')
+    parser.add_argument('--prefetch-radius', type=int, default=DEFAULT_PREFETCH_RADIUS,
+                      help=f'预取当前文件前后各N个文件, 0表示禁用 (default: {DEFAULT_PREFETCH_RADIUS})')
+    parser.add_argument('--prefetch-workers', type=int, default=DEFAULT_PREFETCH_WORKERS,
+                      help=f'同时进行的最大预取数 (default: {DEFAULT_PREFETCH_WORKERS})')
+    parser.add_argument('--sidecar-cache', action='store_true',
+                      help='将标准化后的体数据写入sidecar缓存文件, 再次打开时直接映射')
+    parser.add_argument('--sidecar-dir', type=str, default=None,
+                      help='sidecar缓存目录 (default: 数据文件旁的 .cpr_cache 目录)')
+    parser.add_argument('--normalization', choices=['histogram', 'percentile'], default='histogram',
+                      help='强度标准化方式: histogram(原始类型+直方图, 低内存) 或 percentile(float32排序) (default: histogram)')
+    parser.add_argument('--keep-raw', action='store_true',
+                      help='保留原始HU数据, 启用服务端HU窗宽窗位(额外占用原始数据类型大小的内存和sidecar空间)')
+    parser.add_argument('--eager-cpr', action='store_true',
+                      help='加载时预先构建已旋转的X/Y视图堆叠(额外占用约2倍体数据内存, 旋转浏览更快)')
+    parser.add_argument('--slice-codec', type=str, default='png',
+                      help='JSON接口切片图像编码器, 如 png、png:1、webp (default: png; '
+                           '可用编码器与速度见 python utils/benchmark_codecs.py)')
+    parser.add_argument('--compress-volumes', nargs='?', const='auto', default=None,
+                      choices=['auto'] + available_compressors(),
+                      help='常驻内存的体数据按Z分块压缩保存, 取切片时只解压涉及的块 '
+                           '(省略取值时为auto: 有lz4用lz4, 否则zlib)')
+    parser.add_argument('--production', action='store_true',
+                      help='生产模式: 多线程WSGI服务器(waitress) + 加载进程池')
+    parser.add_argument('--threads', type=int, default=DEFAULT_SERVER_THREADS,
+                      help=f'生产模式的请求线程数 (default: {DEFAULT_SERVER_THREADS})')
+    parser.add_argument('--load-workers', type=int, default=None,
+                      help='在N个独立进程中加载文件并通过共享内存交回, 0表示在服务进程内加载 '
+                           f'(default: 生产模式 {DEFAULT_PRODUCTION_LOAD_WORKERS}, 否则 0)')
+    parser.add_argument('--index-db', type=str, default=DEFAULT_INDEX_DB,
+                      help=f'目录索引数据库路径, ":memory:" 表示不持久化 (default: {DEFAULT_INDEX_DB})')
 
     args = parser.parse_args()
 
+    app.config['SIDECAR_CACHE'] = args.sidecar_cache
+    app.config['SIDECAR_DIR'] = args.sidecar_dir
+    app.config['NORMALIZATION'] = args.normalization
+    app.config['KEEP_RAW'] = args.keep_raw
+    app.config['EAGER_CPR'] = args.eager_cpr
+    app.config['SLICE_CODEC'] = args.slice_codec
+    app.config['VOLUME_COMPRESSION'] = args.compress_volumes
+    app.config['LOAD_WORKERS'] = args.load_workers if args.load_workers is not None else \
+        (DEFAULT_PRODUCTION_LOAD_WORKERS if args.production else 0)
+    if not parse_codec_spec(args.slice_codec)[0].is_image:
+        parser.error('--slice-codec 必须是图像编码器(png 或 webp)')
+
+    volume_cache.resize(args.volume_cache_mb * 1024 * 1024)
+    directory_index.open(args.index_db)
+    volume_prefetcher.configure(args.prefetch_radius, args.prefetch_workers)
+    if app.config['LOAD_WORKERS'] > 0:
+        shared_volume_loader = SharedVolumeLoader(app.config['LOAD_WORKERS'])
+        atexit.register(shared_volume_loader.shutdown)
+
     print("=" * 60)
     print("医学影像标注工具")
     print("=" * 60)
     print(f"服务器地址: http://{args.host}:{args.port}")
+    print(f"体数据缓存: {args.volume_cache_mb} MB")
+    if app.config['LOAD_WORKERS'] > 0:
+        print(f"加载进程: {app.config['LOAD_WORKERS']} (共享内存)")
     print("按 Ctrl+C 停止服务器")
     print("=" * 60)
 
-    app.run(host=args.host, port=args.port, debug=args.debug)
+    if args.production:
+        serve(args.host, args.port, args.threads)
+        return
+
+    # 多线程处理请求: 各会话状态相互独立, 共享的体数据池和缓存均有锁保护
+    app.run(host=args.host, port=args.port, debug=args.debug, threaded=True)
 
 
 if __name__ == '__main__':
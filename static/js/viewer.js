@@ -42,6 +42,7 @@ const appState = {
     defaultWindowLevel: 40,
     minIntensity: null,  // 图像数据的最小值
     maxIntensity: null,  // 图像数据的最大值
+    serverWindowing: false,  // 在服务端按原始HU值渲染窗宽窗位
 
     // 保存状态
     hasUnsavedChanges: false,
@@ -62,6 +63,80 @@ const images = {
     z: null
 };
 
+// Z切片环形缓存: 第z层存放在 slots[z % capacity], 拖动Z轴时优先从缓存显示
+const zSliceRing = {
+    capacity: 256,     // 最多缓存的切片数
+    slabSize: 16,      // 每次批量获取的切片数
+    slabsAhead: 3,     // 沿移动方向预取的slab数
+    slabsBehind: 1,    // 反方向保留预取的slab数
+    file: null,
+    width: 0,
+    height: 0,
+    slots: [],
+    generation: 0,       // 每次重置递增, 丢弃重置前发出的请求结果
+    pending: new Map(),  // 正在获取的slab起始位置 -> AbortController
+    seq: 0,              // 预取轮次序号
+    lastZ: null
+};
+
+// 窗宽窗位映射后的位图缓存(每个轴及其视口图像各一份)和查找表缓存
+const windowedImages = {
+    x: null,
+    y: null,
+    z: null
+};
+const windowLevelLUT = { lut: null, windowWidth: null, windowLevel: null };
+
+// 客户端ID和每个轴的切片请求状态(只保留最新请求)
+const clientId = Math.random().toString(36).slice(2) + Date.now().toString(36);
+const sliceRequests = {
+    x: { seq: 0, controller: null },
+    y: { seq: 0, controller: null },
+    z: { seq: 0, controller: null }
+};
+
+// 视口裁剪渲染: 放大到 VIEWPORT_MIN_ZOOM 以上时整张切片只取低分辨率层级,
+// 可见区域由服务端按屏幕分辨率裁剪重采样后单独返回, 传输量只与可见区域大小有关
+const VIEWPORT_MIN_ZOOM = 2.0;
+const VIEWPORT_BASE_LEVEL = 2;
+const VIEWPORT_DEBOUNCE_MS = 100;
+const viewportState = {
+    x: { seq: 0, controller: null, timer: null, current: null },
+    y: { seq: 0, controller: null, timer: null, current: null },
+    z: { seq: 0, controller: null, timer: null, current: null }
+};
+
+// 每个动画帧最多处理一次Z轴变化
+let zFrameRequested = false;
+
+// 切片金字塔: 首次显示先请求的预览层级, 以及快速拖动Z轴时使用的层级
+const PREVIEW_PYRAMID_LEVEL = 2;
+const SCRUB_PYRAMID_LEVEL = 2;
+const SCRUB_FAST_SLICES_PER_MS = 0.1;   // 超过该速度(约每帧2层)视为快速拖动
+const SCRUB_SETTLE_MS = 150;            // 停止拖动多久后补齐原分辨率
+const zScrubState = { lastZ: 0, lastTime: null, settleTimer: null };
+
+// 后台加载任务状态(只处理最新一次加载)
+const loadState = {
+    token: 0,        // 每次加载递增
+    source: null     // 当前任务的EventSource
+};
+
+// 文件列表: 分页加载, 只渲染可见行
+const FILE_PAGE_SIZE = 200;
+const FILE_ROW_HEIGHT = 32;    // 行高(px), 与 .file-list-spacer .file-item 一致
+const FILE_ROW_OVERSCAN = 8;   // 可见区域上下额外渲染的行数
+const fileListState = {
+    files: [],            // 已加载的文件
+    nextCursor: null,     // 下一页游标, null表示已全部加载
+    loading: false,
+    generation: 0,        // 目录或过滤条件变化时递增, 丢弃旧的分页结果
+    status: '',
+    prefix: '',
+    filterTimer: null,
+    renderRequested: false
+};
+
 // ===== 初始化 =====
 document.addEventListener('DOMContentLoaded', () => {
     initializeElements();
@@ -83,6 +158,14 @@ function initializeEventListeners() {
     document.getElementById('browseBtn').addEventListener('click', browseDirectory);
     document.getElementById('setDirBtn').addEventListener('click', setDirectory);
 
+    // 文件列表: 虚拟滚动和过滤
+    document.getElementById('fileList').addEventListener('scroll', scheduleFileListRender);
+    document.getElementById('fileStatusFilter').addEventListener('change', applyFileFilter);
+    document.getElementById('filePrefixFilter').addEventListener('input', () => {
+        clearTimeout(fileListState.filterTimer);
+        fileListState.filterTimer = setTimeout(applyFileFilter, 250);
+    });
+
     // 保存
     document.getElementById('saveBtn').addEventListener('click', saveAnnotations);
 
@@ -225,6 +308,7 @@ function loadDirectoryContent(path) {
 
             const listContainer = document.getElementById('directoryList');
             listContainer.innerHTML = '';
+            listContainer.dataset.path = data.current_path;
 
             if (data.directories.length === 0) {
                 listContainer.innerHTML = '<p class="placeholder">此目录下没有子文件夹</p>';
@@ -245,13 +329,8 @@ function loadDirectoryContent(path) {
 
                 const badge = document.createElement('span');
                 badge.className = 'dir-badge';
-                if (dir.nrrd_count > 0) {
-                    badge.textContent = `${dir.nrrd_count} 文件`;
-                    badge.style.color = '#5cb85c';
-                } else {
-                    badge.textContent = '空';
-                    badge.style.color = '#888';
-                }
+                badge.dataset.path = dir.path;
+                updateDirectoryBadge(badge, dir.nrrd_count, dir.count_complete);
 
                 dirItem.appendChild(icon);
                 dirItem.appendChild(name);
@@ -275,6 +354,11 @@ function loadDirectoryContent(path) {
                 listContainer.appendChild(dirItem);
             });
 
+            // 文件数在后台统计, 轮询直到全部完成
+            if (data.counts_pending) {
+                pollDirectoryCounts(data.current_path, data.directories.map(dir => dir.path));
+            }
+
             // 启用/禁用上级按钮
             const parentBtn = document.getElementById('parentDirBtn');
             if (data.parent_path) {
@@ -292,6 +376,56 @@ function loadDirectoryContent(path) {
     });
 }
 
+function updateDirectoryBadge(badge, count, complete) {
+    if (count === null || count === undefined) {
+        badge.textContent = '统计中...';
+        badge.style.color = '#888';
+    } else if (count > 0) {
+        // 超出深度/时间预算时显示为下限
+        badge.textContent = complete ? `${count} 文件` : `${count}+ 文件`;
+        badge.style.color = '#5cb85c';
+    } else {
+        badge.textContent = complete ? '空' : '0+';
+        badge.style.color = '#888';
+    }
+}
+
+let directoryCountPoll = null;
+function pollDirectoryCounts(browsePath, paths, delay = 300) {
+    clearTimeout(directoryCountPoll);
+    directoryCountPoll = setTimeout(() => {
+        // 已切换目录或关闭对话框时停止
+        const listContainer = document.getElementById('directoryList');
+        if (!listContainer || listContainer.dataset.path !== browsePath) return;
+
+        fetch('/api/directory_counts', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({paths: paths})
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) return;
+            const remaining = [];
+            document.querySelectorAll('#directoryList .dir-badge').forEach(badge => {
+                const count = data.counts[badge.dataset.path];
+                if (count) {
+                    updateDirectoryBadge(badge, count.count, count.complete);
+                }
+            });
+            paths.forEach(path => {
+                if (!data.counts[path]) remaining.push(path);
+            });
+            if (remaining.length > 0) {
+                pollDirectoryCounts(browsePath, remaining, Math.min(delay * 2, 2000));
+            }
+        })
+        .catch(error => {
+            console.error('获取目录文件数失败:', error);
+        });
+    }, delay);
+}
+
 function navigateToParent() {
     const parentBtn = document.getElementById('parentDirBtn');
     if (!parentBtn.disabled) {
@@ -322,13 +456,14 @@ function setDirectory() {
     fetch('/api/set_directory', {
         method: 'POST',
         headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({directory: directory})
+        body: JSON.stringify({directory: directory, page_size: FILE_PAGE_SIZE})
     })
     .then(response => response.json())
     .then(data => {
         if (data.success) {
             appState.currentDirectory = data.directory;
-            displayFileList(data.files);
+            resetFileFilter();
+            displayFileList(data.files, data.next_cursor);
             document.getElementById('fileCount').innerHTML =
                 `<strong>找到 ${data.count} 个NRRD文件</strong>`;
             showMessage(`成功加载目录,找到 ${data.count} 个文件`, 'success');
@@ -341,116 +476,335 @@ function setDirectory() {
     });
 }
 
-function displayFileList(files) {
+function displayFileList(files, nextCursor = null) {
+    fileListState.generation++;
+    fileListState.files = files;
+    fileListState.nextCursor = nextCursor;
+    fileListState.loading = false;
+
     const fileList = document.getElementById('fileList');
     fileList.innerHTML = '';
+    fileList.scrollTop = 0;
 
     if (files.length === 0) {
-        fileList.innerHTML = '<p class="placeholder">目录中没有NRRD文件</p>';
+        const filtered = fileListState.status || fileListState.prefix;
+        fileList.innerHTML = `<p class="placeholder">${filtered ? '没有符合条件的文件' : '目录中没有NRRD文件'}</p>`;
         return;
     }
 
-    files.forEach(file => {
-        const fileItem = document.createElement('div');
-        fileItem.className = 'file-item';
+    // 只为可见行创建DOM节点, 占位元素撑开整个列表的滚动高度
+    const spacer = document.createElement('div');
+    spacer.className = 'file-list-spacer';
+    fileList.appendChild(spacer);
+    renderVisibleFiles();
+}
 
-        // 创建文件名和状态指示器
-        const fileName = document.createElement('span');
-        fileName.textContent = file.name;
-        fileName.className = 'file-name';
+function scheduleFileListRender() {
+    if (fileListState.renderRequested) return;
+    fileListState.renderRequested = true;
+    requestAnimationFrame(() => {
+        fileListState.renderRequested = false;
+        renderVisibleFiles();
+    });
+}
 
-        const statusIndicator = document.createElement('span');
-        statusIndicator.className = 'file-status';
+function renderVisibleFiles() {
+    const fileList = document.getElementById('fileList');
+    const spacer = fileList.querySelector('.file-list-spacer');
+    if (!spacer) return;
 
-        // 如果后端返回了 has_annotation 标记，初始化 fileStates
-        if (file.has_annotation && !appState.fileStates[file.path]) {
-            appState.fileStates[file.path] = { saved: true };
-        }
+    const files = fileListState.files;
+    spacer.style.height = `${files.length * FILE_ROW_HEIGHT}px`;
+
+    const first = Math.max(0, Math.floor(fileList.scrollTop / FILE_ROW_HEIGHT) - FILE_ROW_OVERSCAN);
+    const last = Math.min(files.length,
+        Math.ceil((fileList.scrollTop + fileList.clientHeight) / FILE_ROW_HEIGHT) + FILE_ROW_OVERSCAN);
+
+    spacer.innerHTML = '';
+    for (let i = first; i < last; i++) {
+        const fileItem = createFileItem(files[i]);
+        fileItem.style.top = `${i * FILE_ROW_HEIGHT}px`;
+        spacer.appendChild(fileItem);
+    }
+
+    // 接近已加载部分的末尾时获取下一页
+    if (fileListState.nextCursor && last >= files.length - FILE_ROW_OVERSCAN) {
+        loadMoreFiles();
+    }
+}
+
+function createFileItem(file) {
+    const fileItem = document.createElement('div');
+    fileItem.className = 'file-item';
+
+    // 创建文件名和状态指示器
+    const fileName = document.createElement('span');
+    fileName.textContent = file.name;
+    fileName.className = 'file-name';
+
+    const statusIndicator = document.createElement('span');
+    statusIndicator.className = 'file-status';
+
+    // 如果后端返回了 has_annotation 标记，初始化 fileStates
+    if (file.has_annotation && !appState.fileStates[file.path]) {
+        appState.fileStates[file.path] = { saved: true };
+    }
+
+    // 检查是否有保存的标注
+    const hasSavedAnnotation = appState.fileStates[file.path]?.saved;
+    if (hasSavedAnnotation === true) {
+        statusIndicator.textContent = ' ✓';
+        statusIndicator.style.color = '#5cb85c';
+        statusIndicator.title = '已保存标注';
+    } else if (hasSavedAnnotation === false) {
+        statusIndicator.textContent = ' ●';
+        statusIndicator.style.color = '#d9534f';
+        statusIndicator.title = '未保存标注';
+    } else if (file.has_annotation) {
+        // 如果后端说有标注但 fileStates 中没有记录，显示为已保存
+        statusIndicator.textContent = ' ✓';
+        statusIndicator.style.color = '#5cb85c';
+        statusIndicator.title = '已保存标注';
+    }
+
+    fileItem.appendChild(fileName);
+    fileItem.appendChild(statusIndicator);
 
-        // 检查是否有保存的标注
-        const hasSavedAnnotation = appState.fileStates[file.path]?.saved;
-        if (hasSavedAnnotation === true) {
-            statusIndicator.textContent = ' ✓';
-            statusIndicator.style.color = '#5cb85c';
-            statusIndicator.title = '已保存标注';
-        } else if (hasSavedAnnotation === false) {
-            statusIndicator.textContent = ' ●';
-            statusIndicator.style.color = '#d9534f';
-            statusIndicator.title = '未保存标注';
-        } else if (file.has_annotation) {
-            // 如果后端说有标注但 fileStates 中没有记录，显示为已保存
-            statusIndicator.textContent = ' ✓';
-            statusIndicator.style.color = '#5cb85c';
-            statusIndicator.title = '已保存标注';
+    fileItem.title = file.path;
+    if (file.path === appState.currentFile) {
+        fileItem.classList.add('active');
+    }
+    fileItem.addEventListener('click', () => loadFile(file.path));
+    return fileItem;
+}
+
+function fetchFilePage(cursor) {
+    const params = new URLSearchParams({limit: FILE_PAGE_SIZE});
+    if (cursor) params.set('cursor', cursor);
+    if (fileListState.status) params.set('status', fileListState.status);
+    if (fileListState.prefix) params.set('prefix', fileListState.prefix);
+    return fetch(`/api/files?${params}`).then(response => response.json());
+}
+
+function loadMoreFiles() {
+    if (fileListState.loading || !fileListState.nextCursor) return;
+    fileListState.loading = true;
+    const generation = fileListState.generation;
+
+    fetchFilePage(fileListState.nextCursor)
+    .then(data => {
+        // 过滤条件或目录已变化
+        if (generation !== fileListState.generation) return;
+        fileListState.loading = false;
+        if (!data.success) {
+            showMessage('加载文件列表失败: ' + data.error, 'error');
+            return;
+        }
+        fileListState.files = fileListState.files.concat(data.files);
+        fileListState.nextCursor = data.next_cursor;
+        renderVisibleFiles();
+    })
+    .catch(error => {
+        if (generation === fileListState.generation) {
+            fileListState.loading = false;
         }
+        showMessage('加载文件列表失败: ' + error, 'error');
+    });
+}
+
+function resetFileFilter() {
+    fileListState.status = '';
+    fileListState.prefix = '';
+    document.getElementById('fileStatusFilter').value = '';
+    document.getElementById('filePrefixFilter').value = '';
+}
 
-        fileItem.appendChild(fileName);
-        fileItem.appendChild(statusIndicator);
+function applyFileFilter() {
+    if (!appState.currentDirectory) return;
+    fileListState.status = document.getElementById('fileStatusFilter').value;
+    fileListState.prefix = document.getElementById('filePrefixFilter').value.trim();
+    const generation = ++fileListState.generation;
 
-        fileItem.title = file.path;
-        fileItem.addEventListener('click', () => loadFile(file.path));
-        fileList.appendChild(fileItem);
+    fetchFilePage(null)
+    .then(data => {
+        if (generation !== fileListState.generation) return;
+        if (data.success) {
+            displayFileList(data.files, data.next_cursor);
+        } else {
+            showMessage('加载文件列表失败: ' + data.error, 'error');
+        }
+    })
+    .catch(error => {
+        showMessage('加载文件列表失败: ' + error, 'error');
     });
 }
 
 function loadFile(filePath) {
     showMessage('正在加载文件...', 'info');
 
-    fetch('/api/load_file', {
+    // 文件列表中已有文件头信息时, 在体素加载完成前先显示尺寸并布局视图
+    const entry = fileListState.files.find(file => file.path === filePath);
+    if (entry && entry.header) {
+        previewFileLayout(filePath, entry.header);
+    }
+
+    // 后台加载: 服务端会取消之前未完成的任务, 客户端同时停止接收旧任务的进度
+    const token = ++loadState.token;
+    closeLoadEvents();
+    updateLoadProgress({stage: '', progress: 0});
+
+    fetch('/api/load_jobs', {
         method: 'POST',
         headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({file_path: filePath})
+        body: JSON.stringify({file_path: filePath, include_slices: false})
     })
     .then(response => response.json())
     .then(data => {
-        if (data.success) {
-            appState.currentFile = filePath;
-            appState.currentData = data.info;
-            appState.annotations = data.annotations || [];
-            appState.currentZ = data.info.center.z;
-
-            // 更新UI
-            updateCurrentFileInfo(data.info);
-            loadImages(data.slices);
-            updateAnnotationsList();
+        if (token !== loadState.token) return;
+        if (!data.success) {
+            updateLoadProgress(null);
+            showMessage('加载失败: ' + data.error, 'error');
+            return;
+        }
 
-            // 设置Z轴滑块
-            const zSlider = document.getElementById('zSlider');
-            zSlider.max = data.info.shape.z - 1;
-            zSlider.value = appState.currentZ;
+        const source = new EventSource(`/api/load_jobs/${data.job_id}/events`);
+        loadState.source = source;
+        source.onmessage = event => {
+            const job = JSON.parse(event.data);
+            if (token !== loadState.token) {
+                source.close();
+                return;
+            }
+            if (job.state === 'done') {
+                closeLoadEvents();
+                updateLoadProgress(null);
+                applyLoadedFile(filePath, job.result);
+            } else if (job.state === 'failed') {
+                closeLoadEvents();
+                updateLoadProgress(null);
+                showMessage('加载失败: ' + job.error, 'error');
+            } else if (job.state === 'cancelled') {
+                closeLoadEvents();
+                updateLoadProgress(null);
+            } else {
+                updateLoadProgress(job);
+            }
+        };
+        source.onerror = () => {
+            if (loadState.source !== source) return;
+            closeLoadEvents();
+            updateLoadProgress(null);
+            showMessage('加载失败: 与服务器的连接中断', 'error');
+        };
+    })
+    .catch(error => {
+        if (token !== loadState.token) return;
+        updateLoadProgress(null);
+        showMessage('加载失败: ' + error, 'error');
+    });
+}
 
-            // 设置Z轴输入范围
-            document.getElementById('zStartInput').max = data.info.shape.z - 1;
-            document.getElementById('zEndInput').max = data.info.shape.z - 1;
+function closeLoadEvents() {
+    if (loadState.source) {
+        loadState.source.close();
+        loadState.source = null;
+    }
+}
 
-            // 初始化窗宽窗位（使用CT软组织窗的默认值）
-            appState.windowWidth = 400;
-            appState.windowLevel = 40;
-            appState.defaultWindowWidth = 400;
-            appState.defaultWindowLevel = 40;
-            updateWindowLevelDisplay();
+const LOAD_STAGE_NAMES = {
+    read: '读取文件',
+    normalize: '标准化',
+    sidecar: '写入缓存',
+    cpr: '构建视图',
+    compress: '压缩数据',
+    annotations: '读取标注',
+    slices: '准备切片'
+};
 
-            // 启用保存按钮
-            document.getElementById('saveBtn').disabled = false;
+function updateLoadProgress(job) {
+    const container = document.getElementById('loadProgress');
+    if (!job) {
+        container.hidden = true;
+        return;
+    }
+    container.hidden = false;
+    const percent = Math.round((job.progress || 0) * 100);
+    container.querySelector('.load-progress-bar').style.width = `${percent}%`;
+    container.querySelector('.load-progress-text').textContent =
+        `${LOAD_STAGE_NAMES[job.stage] || '等待加载'} ${percent}%`;
+}
+
+// 加载任务完成: 切换到新文件
+function applyLoadedFile(filePath, data) {
+    appState.currentFile = filePath;
+    appState.currentData = data.info;
+    appState.annotations = data.annotations || [];
+    appState.currentZ = data.info.center.z;
+
+    // 更新UI
+    updateCurrentFileInfo(data.info);
+    updateWindowingOptions(data.info);
+    resetZSliceRing(filePath);
+    loadImages(data.info.center);
+    prefetchZSlabs(appState.currentZ);
+    updateAnnotationsList();
+
+    // 设置Z轴滑块
+    const zSlider = document.getElementById('zSlider');
+    zSlider.max = data.info.shape.z - 1;
+    zSlider.value = appState.currentZ;
+
+    // 设置Z轴输入范围
+    document.getElementById('zStartInput').max = data.info.shape.z - 1;
+    document.getElementById('zEndInput').max = data.info.shape.z - 1;
+
+    // 初始化窗宽窗位（使用CT软组织窗的默认值）
+    appState.windowWidth = 400;
+    appState.windowLevel = 40;
+    appState.defaultWindowWidth = 400;
+    appState.defaultWindowLevel = 40;
+    updateWindowLevelDisplay();
+
+    // 启用保存按钮
+    document.getElementById('saveBtn').disabled = false;
+
+    // 高亮选中的文件
+    document.querySelectorAll('.file-item').forEach(item => {
+        item.classList.remove('active');
+        if (item.title === filePath) {
+            item.classList.add('active');
+        }
+    });
 
-            // 高亮选中的文件
-            document.querySelectorAll('.file-item').forEach(item => {
-                item.classList.remove('active');
-                if (item.title === filePath) {
-                    item.classList.add('active');
-                }
-            });
+    showMessage('文件加载成功', 'success');
+}
 
-            showMessage('文件加载成功', 'success');
-        } else {
-            showMessage('加载失败: ' + data.error, 'error');
-        }
-    })
-    .catch(error => {
-        showMessage('加载失败: ' + error, 'error');
+function previewFileLayout(filePath, header) {
+    updateCurrentFileInfo({...header, filename: filePath.split(/[\\/]/).pop()});
+    ['x', 'y', 'z'].forEach(axis => {
+        const [height, width] = header.slice_shapes[axis];
+        drawPlaceholder(axis, width, height);
     });
 }
 
+// 按最终切片尺寸(与drawCanvas相同的缩放规则)绘制占位区域
+function drawPlaceholder(axis, width, height) {
+    const canvas = canvases[axis];
+    if (!canvas) return;
+
+    const wrapper = canvas.parentElement;
+    canvas.width = wrapper.clientWidth;
+    canvas.height = wrapper.clientHeight;
+
+    const scale = Math.min(canvas.width / width, canvas.height / height) * appState.zoom;
+    const ctx = canvas.getContext('2d');
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    ctx.fillStyle = '#1a1a1a';
+    ctx.fillRect((canvas.width - width * scale) / 2 + appState.panState[axis].panX,
+                 (canvas.height - height * scale) / 2 + appState.panState[axis].panY,
+                 width * scale, height * scale);
+}
+
 function updateCurrentFileInfo(info) {
     const infoDiv = document.getElementById('currentFileInfo');
     infoDiv.innerHTML = `
@@ -475,19 +829,374 @@ function updateZAxisInfo() {
 }
 
 // ===== 图像显示 =====
-function loadImages(slices) {
-    loadImage('x', slices.x);
-    loadImage('y', slices.y);
-    loadImage('z', slices.z);
+function loadImages(center) {
+    loadImageProgressive('x', center.x);
+    loadImageProgressive('y', center.y);
+    loadImageProgressive('z', center.z);
+}
+
+// options.level: 金字塔层级(0为原分辨率); options.shouldApply: 到达时是否仍需显示
+function loadImage(axis, index, options = {}) {
+    // 同一轴只保留最新请求: 中止仍在进行的旧请求
+    const request = sliceRequests[axis];
+    if (request.controller) {
+        request.controller.abort();
+    }
+    const controller = new AbortController();
+    const seq = ++request.seq;
+    request.controller = controller;
+
+    const level = options.level !== undefined ? options.level : baseSliceLevel();
+    return fetchSliceBinary(axis, index, {signal: controller.signal, seq: seq, level: level})
+    .then(slice => {
+        // 服务端已跳过(204)或响应乱序到达时丢弃
+        if (!slice || seq !== request.seq) return null;
+        if (options.shouldApply && !options.shouldApply()) return null;
+        images[axis] = slice.image;
+        request.shown = seq;
+        drawCanvas(axis);
+        return slice;
+    })
+    .catch(error => {
+        if (error.name !== 'AbortError') {
+            console.error('获取切片失败:', error);
+        }
+    })
+    .finally(() => {
+        if (request.controller === controller) {
+            request.controller = null;
+        }
+    });
 }
 
-function loadImage(axis, base64Data) {
-    const img = new Image();
-    img.onload = () => {
-        images[axis] = img;
+// 同时请求低分辨率预览和原分辨率切片, 预览只在原分辨率到达前显示
+function loadImageProgressive(axis, index) {
+    // 放大状态下整张切片本身就是低分辨率层级
+    if (baseSliceLevel() > 0) {
+        return loadImage(axis, index);
+    }
+
+    const request = sliceRequests[axis];
+    const full = loadImage(axis, index);
+    const seq = request.seq;
+
+    fetchSliceBinary(axis, index, {signal: request.controller.signal, seq: seq, level: PREVIEW_PYRAMID_LEVEL})
+    .then(slice => {
+        if (!slice || seq !== request.seq || request.shown === seq) return;
+        images[axis] = slice.image;
         drawCanvas(axis);
+    })
+    .catch(error => {
+        if (error.name !== 'AbortError') {
+            console.error('获取预览切片失败:', error);
+        }
+    });
+    return full;
+}
+
+// 以二进制方式获取切片原始像素(服务端deflate压缩, 浏览器自动解压)
+// 使用按体数据指纹寻址的GET地址, 重复访问同一切片时直接命中浏览器缓存
+function fetchSliceBinary(axis, index, options = {}) {
+    const level = options.level || 0;
+    const params = new URLSearchParams({codec: 'raw', compress: '1', ...serverWindowParams()});
+    if (options.viewport) {
+        params.set('region', options.viewport.region.join(','));
+        params.set('size', `${options.viewport.width},${options.viewport.height}`);
+    } else if (level > 0) {
+        params.set('pyramid_level', level);
+    }
+    const volumeId = encodeURIComponent(appState.currentData.volume_id);
+    return fetch(`/api/slice/${volumeId}/${axis}/${index}?${params}`, {
+        headers: {
+            'X-Client-Id': clientId,
+            'X-Request-Seq': String(options.seq || 0)
+        },
+        signal: options.signal
+    })
+    .then(response => {
+        if (response.status === 204) {
+            return null;
+        }
+        if (!response.ok) {
+            return response.json().then(data => {
+                throw new Error(data.error || response.statusText);
+            });
+        }
+        const width = parseInt(response.headers.get('X-Slice-Width'));
+        const height = parseInt(response.headers.get('X-Slice-Height'));
+        const sliceIndex = parseInt(response.headers.get('X-Slice-Index'));
+        // 预览切片按原分辨率尺寸显示, 坐标换算不受层级影响
+        const [displayHeight, displayWidth] = level > 0 && !options.viewport ?
+            appState.currentData.slice_shapes[axis] : [height, width];
+        return response.arrayBuffer().then(buffer => ({
+            axis: axis,
+            index: sliceIndex,
+            level: level,
+            image: makeGrayImage(new Uint8Array(buffer), width, height, displayWidth, displayHeight)
+        }));
+    });
+}
+
+// 当前缩放下整张切片请求的金字塔层级
+function baseSliceLevel() {
+    return appState.zoom >= VIEWPORT_MIN_ZOOM ? VIEWPORT_BASE_LEVEL : 0;
+}
+
+function currentSliceIndex(axis) {
+    return axis === 'z' ? appState.currentZ : appState.currentData.center[axis];
+}
+
+// ===== 视口裁剪渲染 =====
+// 计算切片在画布上的可见区域(切片像素坐标, 向外取整)和对应的屏幕像素尺寸
+function visibleSliceRegion(canvas, img, x, y, scale) {
+    const x0 = Math.max(0, Math.floor(-x / scale));
+    const y0 = Math.max(0, Math.floor(-y / scale));
+    const x1 = Math.min(img.width, Math.ceil((canvas.width - x) / scale));
+    const y1 = Math.min(img.height, Math.ceil((canvas.height - y) / scale));
+    if (x1 <= x0 || y1 <= y0) return null;
+    return {
+        region: [x0, y0, x1, y1],
+        width: Math.max(1, Math.min(Math.round((x1 - x0) * scale), 4096)),
+        height: Math.max(1, Math.min(Math.round((y1 - y0) * scale), 4096))
+    };
+}
+
+// 在低分辨率整张切片上叠加视口图像
+function drawViewportOverlay(ctx, axis, x, y, scale) {
+    const viewport = viewportState[axis].current;
+    if (!viewport || viewport.source !== images[axis]) return;
+
+    const [x0, y0, x1, y1] = viewport.region;
+    ctx.drawImage(getWindowedImage(`viewport-${axis}`, viewport.image),
+                  x + x0 * scale, y + y0 * scale, (x1 - x0) * scale, (y1 - y0) * scale);
+}
+
+// 重绘后检查视口图像是否仍覆盖可见区域, 缩放/平移停止后再请求
+function scheduleViewportUpdate(axis, needed) {
+    const state = viewportState[axis];
+    const img = images[axis];
+    clearTimeout(state.timer);
+    if (!img || !appState.currentData) return;
+
+    const coarse = img.pixelWidth < img.width || img.pixelHeight < img.height;
+    if (!coarse) return;
+
+    if (baseSliceLevel() === 0) {
+        // 缩小回普通倍数: 没有进行中的请求时补齐原分辨率整张切片
+        state.timer = setTimeout(() => {
+            if (images[axis] === img && !sliceRequests[axis].controller) {
+                loadImage(axis, currentSliceIndex(axis), {level: 0});
+            }
+        }, VIEWPORT_DEBOUNCE_MS);
+        return;
+    }
+
+    if (!needed || viewportCovers(state.current, img, needed)) return;
+    // 缩放/平移/拖动Z轴停止后再请求
+    state.timer = setTimeout(() => requestViewport(axis, img, needed), VIEWPORT_DEBOUNCE_MS);
+}
+
+function viewportCovers(viewport, img, needed) {
+    if (!viewport || viewport.source !== img) return false;
+    const [x0, y0, x1, y1] = viewport.region;
+    const [nx0, ny0, nx1, ny1] = needed.region;
+    const resolution = viewport.width / (x1 - x0);
+    const neededResolution = needed.width / (nx1 - nx0);
+    return x0 <= nx0 && y0 <= ny0 && x1 >= nx1 && y1 >= ny1 && resolution >= neededResolution * 0.9;
+}
+
+function requestViewport(axis, img, needed) {
+    const state = viewportState[axis];
+    if (images[axis] !== img) return;
+    if (state.controller) {
+        state.controller.abort();
+    }
+    const controller = new AbortController();
+    const seq = ++state.seq;
+    state.controller = controller;
+
+    fetchSliceBinary(axis, currentSliceIndex(axis), {signal: controller.signal, seq: seq, viewport: needed})
+    .then(slice => {
+        if (!slice || seq !== state.seq || images[axis] !== img) return;
+        state.current = {
+            source: img,
+            region: needed.region,
+            width: needed.width,
+            image: slice.image
+        };
+        drawCanvas(axis);
+    })
+    .catch(error => {
+        if (error.name !== 'AbortError') {
+            console.error('获取视口切片失败:', error);
+        }
+    })
+    .finally(() => {
+        if (state.controller === controller) {
+            state.controller = null;
+        }
+    });
+}
+
+// ===== Z切片环形缓存 =====
+function resetZSliceRing(filePath) {
+    zSliceRing.pending.forEach(controller => controller.abort());
+    zSliceRing.generation++;
+    zSliceRing.file = filePath;
+    zSliceRing.slots = new Array(zSliceRing.capacity).fill(null);
+    zSliceRing.pending = new Map();
+    zSliceRing.lastZ = null;
+}
+
+// 环形缓存条目对应的像素来源: 标准化灰度, 或服务端按某个窗宽窗位渲染的结果
+function zSliceRingKey() {
+    const params = serverWindowParams();
+    return appState.serverWindowing ? `${params.window}/${params.level}` : 'normalized';
+}
+
+function getCachedZSlice(z) {
+    const slot = zSliceRing.slots[z % zSliceRing.capacity];
+    return slot && slot.z === z && slot.key === zSliceRingKey() ? slot.pixels : null;
+}
+
+// 中止正在获取的slab(窗宽窗位变化后结果已不再需要), 已缓存的其他窗宽窗位条目保留, 切换回来时可复用
+function abortZSlabRequests() {
+    zSliceRing.pending.forEach(controller => controller.abort());
+    zSliceRing.pending = new Map();
+}
+
+function isZSlabCached(start) {
+    const end = Math.min(start + zSliceRing.slabSize, appState.currentData.shape.z) - 1;
+    return getCachedZSlice(start) !== null && getCachedZSlice(end) !== null;
+}
+
+// 批量获取一个slab并写入环形缓存
+function fetchZSlab(start, seq, slabWindow) {
+    const ring = zSliceRing;
+    if (ring.pending.has(start)) return;
+
+    const generation = ring.generation;
+    const key = zSliceRingKey();
+    const pending = ring.pending;
+    const controller = new AbortController();
+    pending.set(start, controller);
+
+    fetch('/api/get_slab', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({
+            start: start,
+            count: ring.slabSize,
+            compress: true,
+            client_id: clientId,
+            seq: seq,
+            slab_window: slabWindow,
+            ...serverWindowParams()
+        }),
+        signal: controller.signal
+    })
+    .then(response => {
+        // 204: 服务端判断该slab已不在当前预取窗口内
+        if (response.status === 204) return;
+        if (!response.ok) {
+            throw new Error(response.statusText);
+        }
+        const width = parseInt(response.headers.get('X-Slice-Width'));
+        const height = parseInt(response.headers.get('X-Slice-Height'));
+        const slabStart = parseInt(response.headers.get('X-Slab-Start'));
+        const count = parseInt(response.headers.get('X-Slab-Count'));
+
+        return response.arrayBuffer().then(buffer => {
+            // 期间已切换文件, 丢弃结果
+            if (ring.generation !== generation) return;
+
+            const pixels = new Uint8Array(buffer);
+            const sliceBytes = width * height;
+            ring.width = width;
+            ring.height = height;
+            for (let i = 0; i < count; i++) {
+                const z = slabStart + i;
+                ring.slots[z % ring.capacity] = {
+                    z: z,
+                    key: key,
+                    pixels: pixels.subarray(i * sliceBytes, (i + 1) * sliceBytes)
+                };
+            }
+
+            // 当前Z正在等待这个slab时立即显示
+            if (key === zSliceRingKey() && slabStart <= appState.currentZ && appState.currentZ < slabStart + count) {
+                showCachedZSlice(appState.currentZ);
+            }
+        });
+    })
+    .catch(error => {
+        if (error.name !== 'AbortError') {
+            console.error('获取Z切片失败:', error);
+        }
+    })
+    .finally(() => {
+        if (pending.get(start) === controller) {
+            pending.delete(start);
+        }
+    });
+}
+
+// 沿移动方向预取当前Z附近的slab, 中止已不在预取范围内的请求
+function prefetchZSlabs(z) {
+    if (!appState.currentData) return;
+
+    const ring = zSliceRing;
+    const nz = appState.currentData.shape.z;
+    const direction = (ring.lastZ === null || z >= ring.lastZ) ? 1 : -1;
+    const base = Math.floor(z / ring.slabSize) * ring.slabSize;
+
+    // 先当前slab, 再前方, 最后后方
+    const offsets = [0];
+    for (let i = 1; i <= ring.slabsAhead; i++) offsets.push(i * direction);
+    for (let i = 1; i <= ring.slabsBehind; i++) offsets.push(-i * direction);
+
+    const starts = offsets
+        .map(offset => base + offset * ring.slabSize)
+        .filter(start => start >= 0 && start < nz);
+    const wanted = new Set(starts);
+
+    ring.pending.forEach((controller, start) => {
+        if (!wanted.has(start)) {
+            controller.abort();
+            ring.pending.delete(start);
+        }
+    });
+
+    const seq = ++ring.seq;
+    const slabWindow = [Math.min(...starts), Math.max(...starts) + ring.slabSize];
+    starts.forEach(start => {
+        if (!isZSlabCached(start)) {
+            fetchZSlab(start, seq, slabWindow);
+        }
+    });
+
+    ring.lastZ = z;
+}
+
+function showCachedZSlice(z) {
+    const pixels = getCachedZSlice(z);
+    if (!pixels) return false;
+
+    images.z = makeGrayImage(pixels, zSliceRing.width, zSliceRing.height);
+    drawCanvas('z');
+    return true;
+}
+
+// 切片原始灰度像素, 显示时经窗宽窗位映射生成位图
+// width/height为显示(原分辨率)尺寸, pixelWidth/pixelHeight为像素数据尺寸(预览切片较小)
+function makeGrayImage(pixels, width, height, displayWidth = width, displayHeight = height) {
+    return {
+        width: displayWidth,
+        height: displayHeight,
+        pixelWidth: width,
+        pixelHeight: height,
+        pixels: pixels
     };
-    img.src = base64Data;
 }
 
 function drawCanvas(axis) {
@@ -519,11 +1228,10 @@ function drawCanvas(axis) {
     const x = (containerWidth - scaledWidth) / 2 + appState.panState[axis].panX;
     const y = (containerHeight - scaledHeight) / 2 + appState.panState[axis].panY;
 
-    // 绘制图像
-    ctx.drawImage(img, x, y, scaledWidth, scaledHeight);
-
-    // 对所有轴应用窗宽窗位
-    applyWindowLevel(ctx, x, y, scaledWidth, scaledHeight);
+    // 绘制窗宽窗位映射后的位图(平移/缩放/叠加层重绘时直接复用)
+    ctx.drawImage(getWindowedImage(axis, img), x, y, scaledWidth, scaledHeight);
+    drawViewportOverlay(ctx, axis, x, y, scale);
+    scheduleViewportUpdate(axis, visibleSliceRegion(canvas, img, x, y, scale));
 
     // 在X和Y轴CPR视图上绘制标注区间和当前Z线
     if (axis === 'x' || axis === 'y') {
@@ -540,46 +1248,149 @@ function drawCanvas(axis) {
     }
 }
 
-// 应用窗宽窗位到Z轴图像
-function applyWindowLevel(ctx, imgX, imgY, imgWidth, imgHeight) {
-    try {
-        // 读取图像像素数据
-        const imageData = ctx.getImageData(imgX, imgY, imgWidth, imgHeight);
-        const data = imageData.data;
-
-        // 计算窗宽窗位的显示范围
-        const minValue = appState.windowLevel - appState.windowWidth / 2;
-        const maxValue = appState.windowLevel + appState.windowWidth / 2;
-
-        // 遍历所有像素
-        for (let i = 0; i < data.length; i += 4) {
-            // 获取灰度值（假设R=G=B）
-            const gray = data[i];
-
-            // 应用窗宽窗位映射
-            let newGray;
-            if (gray <= minValue) {
-                newGray = 0;  // 低于窗口下限，显示为黑色
-            } else if (gray >= maxValue) {
-                newGray = 255;  // 高于窗口上限，显示为白色
-            } else {
-                // 线性映射到 [0, 255]
-                newGray = ((gray - minValue) / (maxValue - minValue)) * 255;
-            }
+// ===== 窗宽窗位 =====
+// 生成256项查找表, 每项为打包的RGBA灰度像素(小端序: A B G R)
+function buildWindowLevelLUT(windowWidth, windowLevel) {
+    const lut = new Uint32Array(256);
+    const minValue = windowLevel - windowWidth / 2;
+    const maxValue = windowLevel + windowWidth / 2;
 
-            // 更新RGB值（保持灰度图）
-            data[i] = newGray;      // R
-            data[i + 1] = newGray;  // G
-            data[i + 2] = newGray;  // B
-            // data[i + 3] 是 alpha，保持不变
+    for (let gray = 0; gray < 256; gray++) {
+        let newGray;
+        if (gray <= minValue) {
+            newGray = 0;  // 低于窗口下限，显示为黑色
+        } else if (gray >= maxValue) {
+            newGray = 255;  // 高于窗口上限，显示为白色
+        } else {
+            // 线性映射到 [0, 255]
+            newGray = Math.round(((gray - minValue) / (maxValue - minValue)) * 255);
         }
+        lut[gray] = (0xFF000000 | (newGray << 16) | (newGray << 8) | newGray) >>> 0;
+    }
+    return lut;
+}
+
+// 获取应用窗宽窗位后的位图, 仅在切片或窗宽窗位变化时重新计算
+function getWindowedImage(key, img) {
+    let cached = windowedImages[key];
+
+    // 服务端窗宽窗位模式下像素已映射, 使用恒等查找表
+    const windowWidth = appState.serverWindowing ? 255 : appState.windowWidth;
+    const windowLevel = appState.serverWindowing ? 127.5 : appState.windowLevel;
+
+    if (cached && cached.source === img &&
+        cached.windowWidth === windowWidth &&
+        cached.windowLevel === windowLevel) {
+        return cached.canvas;
+    }
+
+    if (!cached) {
+        cached = windowedImages[key] = { canvas: document.createElement('canvas') };
+    }
+
+    const lut = getWindowLevelLUT(windowWidth, windowLevel);
+    const canvas = cached.canvas;
+    if (canvas.width !== img.pixelWidth || canvas.height !== img.pixelHeight) {
+        canvas.width = img.pixelWidth;
+        canvas.height = img.pixelHeight;
+    }
+
+    const ctx = canvas.getContext('2d');
+    const imageData = ctx.createImageData(img.pixelWidth, img.pixelHeight);
+    const data32 = new Uint32Array(imageData.data.buffer);
+    const pixels = img.pixels;
+    for (let i = 0; i < pixels.length; i++) {
+        data32[i] = lut[pixels[i]];
+    }
+    ctx.putImageData(imageData, 0, 0);
+
+    cached.source = img;
+    cached.windowWidth = windowWidth;
+    cached.windowLevel = windowLevel;
+    return canvas;
+}
+
+// 窗宽窗位查找表(窗宽窗位不变时复用)
+function getWindowLevelLUT(windowWidth, windowLevel) {
+    if (!windowLevelLUT.lut ||
+        windowLevelLUT.windowWidth !== windowWidth ||
+        windowLevelLUT.windowLevel !== windowLevel) {
+        windowLevelLUT.lut = buildWindowLevelLUT(windowWidth, windowLevel);
+        windowLevelLUT.windowWidth = windowWidth;
+        windowLevelLUT.windowLevel = windowLevel;
+    }
+    return windowLevelLUT.lut;
+}
+
+// 服务端窗宽窗位模式下随切片请求发送的参数
+function serverWindowParams() {
+    if (!appState.serverWindowing) return {};
+    return {
+        window: Math.round(appState.windowWidth),
+        level: Math.round(appState.windowLevel)
+    };
+}
+
+// 服务端模式下拖动窗宽窗位停止该时间(毫秒)后才重新请求切片
+const WINDOW_REFRESH_IDLE_MS = 150;
+
+// 窗宽窗位变化: 服务端模式在停止调整后重新请求切片(拖动过程中不请求), 否则仅重绘
+let windowRefreshTimer = null;
+function onWindowLevelChanged() {
+    updateWindowLevelDisplay();
+
+    if (!appState.serverWindowing || !appState.currentData) {
+        ['x', 'y', 'z'].forEach(axis => {
+            if (images[axis]) {
+                drawCanvas(axis);
+            }
+        });
+        return;
+    }
+
+    clearTimeout(windowRefreshTimer);
+    windowRefreshTimer = setTimeout(reloadSlicesForWindowing, WINDOW_REFRESH_IDLE_MS);
+}
+
+// 立即执行等待中的切片刷新(如拖动结束时)
+function flushWindowRefresh() {
+    if (windowRefreshTimer === null) return;
+    reloadSlicesForWindowing();
+}
 
-        // 将处理后的图像数据写回canvas
-        ctx.putImageData(imageData, imgX, imgY);
-    } catch (e) {
-        // 如果出错（例如跨域问题），静默失败
-        console.error('应用窗宽窗位失败:', e);
+// 以当前窗宽窗位模式重新获取三个视图的切片
+function reloadSlicesForWindowing() {
+    clearTimeout(windowRefreshTimer);
+    windowRefreshTimer = null;
+    if (!appState.currentData) return;
+
+    const center = appState.currentData.center;
+    abortZSlabRequests();
+    loadImage('x', center.x);
+    loadImage('y', center.y);
+    loadImage('z', appState.currentZ);
+    prefetchZSlabs(appState.currentZ);
+}
+
+// 根据数据信息更新HU窗开关和预设列表
+function updateWindowingOptions(info) {
+    const modeCheckbox = document.getElementById('wlServerMode');
+    modeCheckbox.disabled = !info.has_raw;
+    if (!info.has_raw) {
+        modeCheckbox.checked = false;
+        appState.serverWindowing = false;
     }
+
+    const presetSelect = document.getElementById('wlPresetSelect');
+    presetSelect.innerHTML = '<option value="">预设</option>';
+    Object.entries(info.window_presets || {}).forEach(([name, preset]) => {
+        const option = document.createElement('option');
+        option.value = name;
+        option.textContent = `${name} (${preset.window}/${preset.level})`;
+        option.dataset.window = preset.window;
+        option.dataset.level = preset.level;
+        presetSelect.appendChild(option);
+    });
 }
 
 function drawAnnotationsOnZ(ctx, imgX, imgY, imgWidth, imgHeight) {
@@ -784,6 +1595,16 @@ function updateZSlice(z) {
     appState.currentZ = z;
     updateZAxisInfo();
 
+    // 合并同一帧内的多次变化, 只处理最新的Z
+    if (zFrameRequested) return;
+    zFrameRequested = true;
+    requestAnimationFrame(() => {
+        zFrameRequested = false;
+        renderZChange(appState.currentZ);
+    });
+}
+
+function renderZChange(z) {
     // 重新绘制X和Y轴视图以更新当前Z位置的红线
     ['x', 'y'].forEach(axis => {
         if (images[axis]) {
@@ -791,21 +1612,37 @@ function updateZSlice(z) {
         }
     });
 
-    // 重新加载Z轴切片
-    fetch('/api/get_slice', {
-        method: 'POST',
-        headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({axis: 'z', index: z})
-    })
-    .then(response => response.json())
-    .then(data => {
-        if (data.success) {
-            loadImage('z', data.slice);
+    // 优先从环形缓存显示, 未命中时由所在slab到达后显示; 快速拖动时先显示低分辨率预览
+    if (!showCachedZSlice(z)) {
+        requestZPreview(z);
+    }
+    prefetchZSlabs(z);
+}
+
+function requestZPreview(z) {
+    const now = performance.now();
+    const scrub = zScrubState;
+    const speed = scrub.lastTime !== null ?
+        Math.abs(z - scrub.lastZ) / Math.max(now - scrub.lastTime, 1) : 0;
+    scrub.lastZ = z;
+    scrub.lastTime = now;
+
+    if (speed >= SCRUB_FAST_SLICES_PER_MS) {
+        loadImage('z', z, {
+            level: SCRUB_PYRAMID_LEVEL,
+            // 原分辨率已到达(slab缓存命中)或已移到别处时不显示预览
+            shouldApply: () => appState.currentZ === z && getCachedZSlice(z) === null
+        });
+    }
+
+    // 停止拖动后补齐原分辨率
+    clearTimeout(scrub.settleTimer);
+    scrub.settleTimer = setTimeout(() => {
+        const currentZ = appState.currentZ;
+        if (!showCachedZSlice(currentZ)) {
+            loadImage('z', currentZ, {shouldApply: () => appState.currentZ === currentZ});
         }
-    })
-    .catch(error => {
-        console.error('获取切片失败:', error);
-    });
+    }, SCRUB_SETTLE_MS);
 }
 
 // ===== 工具和交互 =====
@@ -1027,21 +1864,15 @@ function setupWindowLevelControl() {
         const levelSensitivity = 1;
         appState.windowLevel = startLevel - deltaY * levelSensitivity;
 
-        // 更新显示
-        updateWindowLevelDisplay();
-
-        // 重绘所有视图
-        ['x', 'y', 'z'].forEach(axis => {
-            if (images[axis]) {
-                drawCanvas(axis);
-            }
-        });
+        // 更新显示并重绘
+        onWindowLevelChanged();
     });
 
     // 鼠标松开
     document.addEventListener('mouseup', () => {
         if (isDragging) {
             isDragging = false;
+            flushWindowRefresh();
         }
     });
 
@@ -1049,18 +1880,30 @@ function setupWindowLevelControl() {
     resetBtn.addEventListener('click', () => {
         appState.windowWidth = appState.defaultWindowWidth;
         appState.windowLevel = appState.defaultWindowLevel;
+        onWindowLevelChanged();
+    });
+
+    // HU窗开关: 切换后按新模式重新获取切片
+    document.getElementById('wlServerMode').addEventListener('change', (e) => {
+        appState.serverWindowing = e.target.checked;
         updateWindowLevelDisplay();
-        // 重绘所有视图
-        ['x', 'y', 'z'].forEach(axis => {
-            if (images[axis]) {
-                drawCanvas(axis);
-            }
-        });
+        reloadSlicesForWindowing();
+    });
+
+    // 窗宽窗位预设
+    document.getElementById('wlPresetSelect').addEventListener('change', (e) => {
+        const option = e.target.selectedOptions[0];
+        if (!option || !option.value) return;
+        appState.windowWidth = parseFloat(option.dataset.window);
+        appState.windowLevel = parseFloat(option.dataset.level);
+        e.target.value = '';
+        onWindowLevelChanged();
     });
 }
 
 function updateWindowLevelDisplay() {
-    const wlText = `窗宽: ${Math.round(appState.windowWidth)} | 窗位: ${Math.round(appState.windowLevel)}`;
+    const unit = appState.serverWindowing ? ' HU' : '';
+    const wlText = `窗宽: ${Math.round(appState.windowWidth)}${unit} | 窗位: ${Math.round(appState.windowLevel)}${unit}`;
     document.getElementById('wlInfoText').textContent = wlText;
 }
 
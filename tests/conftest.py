@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""测试公共设置: 导入路径与合成NRRD数据"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'utils'))
+
+
+@pytest.fixture
+def nrrd_file(tmp_path):
+    """合成的int16 CPR体数据 (Z, Y, X) = (40, 24, 32), 取值覆盖常见HU范围"""
+    import SimpleITK as sitk
+
+    rng = np.random.default_rng(0)
+    volume = rng.integers(-1000, 1500, size=(40, 24, 32)).astype(np.int16)
+    path = str(tmp_path / 'vessel.nrrd')
+    sitk.WriteImage(sitk.GetImageFromArray(volume), path)
+    return path
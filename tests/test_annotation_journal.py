@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""标注日志测试: 重放、压缩到快照文件、手动保存"""
+import json
+import os
+
+import annotation_manager
+from annotation_manager import Annotation, AnnotationManager, AnnotationRegistry
+
+
+def _manager(tmp_path, **kwargs):
+    kwargs.setdefault('autosave_delay', None)
+    return AnnotationManager(str(tmp_path / 'vessel.nrrd'), 'doc', **kwargs)
+
+
+def test_journal_replayed_after_crash(tmp_path):
+    manager = _manager(tmp_path)
+    first = Annotation(0, 10, confidence=1)
+    manager.add_annotation(first)
+    manager.add_annotation(Annotation(5, 20, confidence=2))
+    manager.update_annotation(first.annotation_id, {'z_end': 12, 'stenosis': 3})
+
+    # 写了一半的行被忽略
+    with open(manager.journal_file, 'a', encoding='utf-8') as f:
+        f.write('{"seq": 99, "op": "ad')
+
+    restored = _manager(tmp_path)
+    assert restored.get_all_annotations() == manager.get_all_annotations()
+    assert not os.path.exists(manager.annotation_file)
+
+
+def test_compact_writes_snapshot_not_label(tmp_path, monkeypatch):
+    monkeypatch.setattr(annotation_manager, 'JOURNAL_COMPACT_OPS', 3)
+    manager = _manager(tmp_path)
+    # 未解决冲突的重叠标注
+    for z in (0, 2, 4):
+        manager.add_annotation(Annotation(z, z + 5))
+
+    assert not os.path.exists(manager.journal_file)
+    assert not os.path.exists(manager.annotation_file)
+    assert manager.snapshot_file.endswith('vessel_doc_label.journal.json')
+    with open(manager.snapshot_file, 'r', encoding='utf-8') as f:
+        assert len(json.load(f)['annotations']) == 3
+
+    manager.add_annotation(Annotation(30, 40))
+    restored = _manager(tmp_path)
+    assert restored.get_all_annotations() == manager.get_all_annotations()
+
+
+def test_save_writes_label_and_removes_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(annotation_manager, 'JOURNAL_COMPACT_OPS', 2)
+    manager = _manager(tmp_path)
+    manager.add_annotation(Annotation(0, 10, confidence=1))
+    manager.add_annotation(Annotation(5, 20, confidence=2))
+    snapshot = open(manager.snapshot_file, 'r', encoding='utf-8').read()
+
+    assert manager.save()
+    assert os.path.exists(manager.annotation_file)
+    assert not os.path.exists(manager.snapshot_file)
+    assert not os.path.exists(manager.journal_file)
+
+    # 保存后、删除快照前崩溃: 旧快照不覆盖已解决冲突的标注文件
+    with open(manager.snapshot_file, 'w', encoding='utf-8') as f:
+        f.write(snapshot)
+    restored = _manager(tmp_path)
+    assert restored.get_all_annotations() == manager.get_all_annotations()
+    assert [(a['z_start'], a['z_end']) for a in restored.get_all_annotations()] == [(0, 4), (5, 20)]
+
+
+def test_snapshot_newer_than_label_wins(tmp_path, monkeypatch):
+    monkeypatch.setattr(annotation_manager, 'JOURNAL_COMPACT_OPS', 2)
+    manager = _manager(tmp_path)
+    manager.add_annotation(Annotation(0, 10))
+    assert manager.save()
+    manager.add_annotation(Annotation(20, 30))
+    manager.add_annotation(Annotation(40, 50))
+    assert os.path.exists(manager.snapshot_file)
+
+    with open(manager.annotation_file, 'r', encoding='utf-8') as f:
+        assert len(json.load(f)['annotations']) == 1
+    restored = _manager(tmp_path)
+    assert restored.get_all_annotations() == manager.get_all_annotations()
+
+
+def test_sessions_share_one_manager_per_file(tmp_path):
+    registry = AnnotationRegistry(autosave_delay=None)
+    data_file = str(tmp_path / 'vessel.nrrd')
+    first = registry.acquire(data_file, 'doc')
+    second = registry.acquire(data_file, 'doc')
+    assert first is second
+    assert registry.acquire(data_file, 'other') is not first
+
+    # 两个会话交替修改, 日志序号不冲突
+    a = Annotation(0, 10)
+    first.add_annotation(a)
+    second.add_annotation(Annotation(20, 30))
+    second.update_annotation(a.annotation_id, {'stenosis': 2})
+    first.add_annotation(Annotation(40, 50))
+    with open(first.journal_file, 'r', encoding='utf-8') as f:
+        assert [json.loads(line)['seq'] for line in f] == [1, 2, 3, 4]
+
+    registry.release(first)
+    second.compact()
+    second.add_annotation(Annotation(60, 70))
+    registry.release(second)
+    assert registry.stats()['count'] == 1
+
+    restored = _manager(tmp_path)
+    assert restored.get_all_annotations() == second.get_all_annotations()
+    assert len(restored.get_all_annotations()) == 4
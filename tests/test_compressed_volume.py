@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""压缩体数据存储测试"""
+import numpy as np
+
+from compressed_volume import CompressedVolume
+
+
+def make_volume():
+    rng = np.random.default_rng(0)
+    array = rng.integers(0, 256, size=(120, 64, 64)).astype(np.uint8)
+    return array, CompressedVolume(array, 'zlib', chunk_depth=4, hot_cache_bytes=64 * 1024)
+
+
+def test_indexing_matches_array():
+    array, volume = make_volume()
+    np.testing.assert_array_equal(volume[17], array[17])
+    np.testing.assert_array_equal(volume[10:90], array[10:90])
+    np.testing.assert_array_equal(volume[:, 5, :], array[:, 5, :])
+    np.testing.assert_array_equal(volume[:, :, 7], array[:, :, 7])
+    np.testing.assert_array_equal(np.asarray(volume), array)
+
+
+def test_slab_reads_do_not_grow_memory():
+    array, volume = make_volume()
+    nbytes = volume.nbytes
+    for z0 in range(0, 100, 10):
+        np.testing.assert_array_equal(volume[z0:z0 + 20, :, :], array[z0:z0 + 20])
+    stats = volume.stats()
+    assert stats['cross_sections'] == 0
+    assert stats['hot_cache_bytes'] <= volume.hot_cache_bytes
+    assert volume.nbytes == nbytes
+
+
+def test_cross_sections_are_cached_within_budget():
+    _, volume = make_volume()
+    nbytes = volume.nbytes
+    for x in range(20):
+        volume[:, :, x]
+    stats = volume.stats()
+    assert 0 < stats['cross_sections'] <= 8
+    assert stats['cross_section_bytes'] <= volume.hot_cache_bytes
+    assert volume.nbytes == nbytes
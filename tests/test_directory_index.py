@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""目录索引测试: 增量刷新结果, 遍历期间不持有索引锁"""
+import os
+
+from directory_index import DirectoryIndex
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb'):
+        pass
+
+
+def test_refresh_lists_files_and_labels(tmp_path):
+    _touch(str(tmp_path / 'p1' / 'a.nrrd'))
+    _touch(str(tmp_path / 'p1' / 'a_doc_label.json'))
+    _touch(str(tmp_path / 'p1' / 'b.nrrd'))
+    # 日志快照不算标注文件
+    _touch(str(tmp_path / 'p1' / 'b_doc_label.journal.json'))
+    _touch(str(tmp_path / 'p2' / 'sub' / 'c.NRRD'))
+
+    index = DirectoryIndex()
+    stats = index.refresh(str(tmp_path))
+    assert stats['dirs'] == 4 and stats['rescanned'] == 4
+    files = index.list_files(str(tmp_path), 'doc')
+    assert [(os.path.basename(f['path']), f['has_annotation']) for f in files] == [
+        ('a.nrrd', True), ('b.nrrd', False), ('c.NRRD', False)]
+
+    os.remove(str(tmp_path / 'p1' / 'b.nrrd'))
+    index.refresh(str(tmp_path))
+    assert [os.path.basename(p) for p in index.list_paths(str(tmp_path))] == ['a.nrrd', 'c.NRRD']
+
+
+def test_directories_scanned_outside_lock(tmp_path, monkeypatch):
+    _touch(str(tmp_path / 'p1' / 'a.nrrd'))
+    index = DirectoryIndex()
+    scan_dir = DirectoryIndex._scan_dir
+    held = []
+
+    def checked_scan_dir(path, mtime_ns, now_ns):
+        # 遍历期间其他请求可以获取索引锁
+        acquired = index._lock.acquire(timeout=1)
+        if acquired:
+            index._lock.release()
+        held.append(not acquired)
+        return scan_dir(path, mtime_ns, now_ns)
+
+    monkeypatch.setattr(DirectoryIndex, '_scan_dir', staticmethod(checked_scan_dir))
+    index.refresh(str(tmp_path))
+    assert held == [False, False]
+    assert index.count_files(str(tmp_path)) == 1
+
+
+def test_page_cursor_only_when_matching_files_remain(tmp_path):
+    for name in ('a', 'b', 'c', 'd'):
+        _touch(str(tmp_path / f'{name}.nrrd'))
+    for name in ('a', 'b'):
+        _touch(str(tmp_path / f'{name}_doc_label.json'))
+
+    index = DirectoryIndex()
+    index.refresh(str(tmp_path))
+    root = str(tmp_path)
+
+    page, cursor = index.list_files_page(root, 'doc', limit=2, status='annotated')
+    assert [f['name'] for f in page] == ['a.nrrd', 'b.nrrd']
+    assert cursor is None
+
+    page, cursor = index.list_files_page(root, 'doc', limit=1, status='unannotated')
+    assert [f['name'] for f in page] == ['c.nrrd']
+    page, cursor = index.list_files_page(root, 'doc', cursor=cursor, limit=1, status='unannotated')
+    assert [f['name'] for f in page] == ['d.nrrd']
+    assert cursor is None
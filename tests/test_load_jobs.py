@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""加载任务状态测试: 取消只在提交之前生效"""
+import threading
+
+from load_jobs import LoadJobManager, JOB_DONE, JOB_CANCELLED
+
+
+def _wait(job):
+    while job.state not in (JOB_DONE, JOB_CANCELLED):
+        job.wait_for_update(job.version, 1.0)
+    return job.state
+
+
+def test_cancel_after_commit_reports_done():
+    manager = LoadJobManager(max_workers=1)
+    committed = []
+
+    def work(job):
+        job.report('read', 0.5)
+        committed.append(job.file_path)
+        # 提交后到达的取消请求
+        job.cancel()
+        return {'file': job.file_path}
+
+    job = manager.start('a.nrrd', work, owner='ws')
+    assert _wait(job) == JOB_DONE
+    assert committed == ['a.nrrd']
+    assert job.result == {'file': 'a.nrrd'}
+
+
+def test_cancel_before_commit_reports_cancelled():
+    manager = LoadJobManager(max_workers=1)
+    started = threading.Event()
+    release = threading.Event()
+    committed = []
+
+    def work(job):
+        started.set()
+        release.wait(5)
+        job.check_cancelled()
+        committed.append(job.file_path)
+        return {}
+
+    first = manager.start('a.nrrd', work, owner='ws')
+    started.wait(5)
+    second = manager.start('b.nrrd', lambda job: {}, owner='ws')
+    release.set()
+    assert _wait(first) == JOB_CANCELLED
+    assert _wait(second) == JOB_DONE
+    assert committed == []
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""强度标准化测试: 直方图方式与percentile方式逐体素一致"""
+import numpy as np
+import pytest
+
+from nrrd_loader import NRRDLoader
+
+
+def _write(tmp_path, volume, name='volume.nrrd'):
+    import SimpleITK as sitk
+
+    path = str(tmp_path / name)
+    sitk.WriteImage(sitk.GetImageFromArray(volume), path)
+    return path
+
+
+def _normalize_both(path):
+    histogram = NRRDLoader(path, normalization='histogram').volume
+    percentile = NRRDLoader(path, normalization='percentile').volume
+    assert histogram.dtype == np.uint8
+    return np.asarray(histogram), np.asarray(percentile)
+
+
+def _volumes(dtype, low, high):
+    rng = np.random.default_rng(1)
+    return {
+        'random': rng.integers(low, high, size=(17, 23, 29)).astype(dtype),
+        'single_voxel': np.array([[[high - 1]]], dtype=dtype),
+        'constant': np.full((5, 6, 7), low + 3, dtype=dtype),
+    }
+
+
+@pytest.mark.parametrize('dtype, low, high', [(np.int16, -1024, 3072), (np.uint8, 0, 256)])
+@pytest.mark.parametrize('case', ['random', 'single_voxel', 'constant'])
+def test_integer_histogram_matches_percentile(tmp_path, dtype, low, high, case):
+    path = _write(tmp_path, _volumes(dtype, low, high)[case])
+    histogram, percentile = _normalize_both(path)
+    np.testing.assert_array_equal(histogram, percentile)
+
+
+def test_float_histogram_within_one_level(tmp_path):
+    rng = np.random.default_rng(2)
+    volume = rng.normal(40, 300, size=(17, 23, 29)).astype(np.float32)
+    histogram, percentile = _normalize_both(_write(tmp_path, volume))
+    difference = np.abs(histogram.astype(np.int16) - percentile.astype(np.int16))
+    assert difference.max() <= 1
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+冲突解决等价性测试
+保留扫描线实现之前的O(n²)逐段比较实现作为参照, 在随机生成的重叠、嵌套、
+置信度与更新时间相同、标注ID重复的区间上比较两者的结果以及调用后输入标注的状态
+"""
+import random
+from typing import List
+
+import pytest
+
+from annotation_manager import Annotation, AnnotationManager
+
+
+def reference_resolve_conflicts(annotations: List[Annotation]) -> List[Annotation]:
+    """原实现: 对每个标注与已有结果逐一比较重叠"""
+    if len(annotations) <= 1:
+        return annotations.copy()
+
+    sorted_anns = sorted(annotations, key=lambda a: a.z_start)
+    result: List[Annotation] = []
+    for ann in sorted_anns:
+        conflicts = [existing for existing in result if ann.overlaps_with(existing)]
+        if not conflicts:
+            result.append(ann)
+        else:
+            _reference_resolve_single_conflict(ann, conflicts, result)
+    return result
+
+
+def _reference_resolve_single_conflict(new_ann: Annotation,
+                                       conflicts: List[Annotation],
+                                       result: List[Annotation]):
+    """原实现: 在关键点切分的每一段上选优先级最高的标注"""
+    segments = [(new_ann.z_start, new_ann.z_end, new_ann)]
+    for conf in conflicts:
+        segments.append((conf.z_start, conf.z_end, conf))
+
+    points = set()
+    for start, end, _ in segments:
+        points.add(start)
+        points.add(end + 1)
+    sorted_points = sorted(points)
+
+    for i in range(len(sorted_points) - 1):
+        seg_start = sorted_points[i]
+        seg_end = sorted_points[i + 1] - 1
+
+        covering = [ann for start, end, ann in segments
+                    if start <= seg_start and seg_end <= end]
+        if covering:
+            winner = max(covering, key=lambda a: (a.confidence, a.updated_at))
+            if result and result[-1].annotation_id == winner.annotation_id and \
+               result[-1].z_end + 1 == seg_start:
+                result[-1].z_end = seg_end
+            else:
+                result.append(Annotation(
+                    z_start=seg_start,
+                    z_end=seg_end,
+                    presence=winner.presence,
+                    type_main=winner.type_main,
+                    type_exclude=winner.type_exclude.copy(),
+                    stenosis=winner.stenosis,
+                    confidence=winner.confidence,
+                    created_at=winner.created_at,
+                    updated_at=winner.updated_at,
+                    annotation_id=winner.annotation_id
+                ))
+
+    for conf in conflicts:
+        result.remove(conf)
+
+
+def _random_annotations(rng: random.Random, count: int, span: int) -> List[dict]:
+    """随机标注: 长短区间混合(产生嵌套), 少量档位的置信度与更新时间(产生平局), 部分ID重复"""
+    ids = [f"ann_{i}" for i in range(count)]
+    anns = []
+    for i in range(count):
+        start = rng.randrange(span)
+        end = start + rng.randrange(max(1, span // rng.choice([2, 5, 20])))
+        annotation_id = rng.choice(ids[:max(1, i)]) if rng.random() < 0.2 else ids[i]
+        anns.append({
+            'z_start': start,
+            'z_end': end,
+            'presence': rng.choice([-1, 0, 1, None]),
+            'type_main': rng.randrange(4),
+            'type_exclude': [str(i)],
+            'stenosis': rng.randrange(5),
+            'confidence': rng.randrange(3),
+            'created_at': '2026-01-01T00:00:00',
+            'updated_at': f"2026-01-0{rng.randrange(1, 4)}T00:00:00",
+            'annotation_id': annotation_id
+        })
+    return anns
+
+
+def _run(resolve, dicts: List[dict]):
+    """执行冲突解决, 返回结果、调用后的输入以及结果中直接引用输入对象的位置"""
+    inputs = [Annotation.from_dict(d) for d in dicts]
+    result = resolve(inputs)
+    positions = {id(ann): i for i, ann in enumerate(inputs)}
+    return ([ann.to_dict() for ann in result],
+            [ann.to_dict() for ann in inputs],
+            [positions.get(id(ann)) for ann in result])
+
+
+def _resolve_with_manager(tmp_path):
+    def resolve(inputs: List[Annotation]) -> List[Annotation]:
+        manager = AnnotationManager(str(tmp_path / 'vessel.nrrd'), autosave_delay=None)
+        manager.annotations = inputs
+        return manager.resolve_conflicts()
+    return resolve
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_sweep_matches_reference(tmp_path, seed):
+    rng = random.Random(seed)
+    resolve = _resolve_with_manager(tmp_path)
+    for _ in range(300):
+        dicts = _random_annotations(rng, rng.randrange(0, 25), rng.choice([5, 20, 100]))
+        assert _run(resolve, dicts) == _run(reference_resolve_conflicts, dicts)
+
+
+def test_sweep_matches_reference_nested_ties(tmp_path):
+    # 同起点、同终点、完全嵌套且优先级相同的区间
+    dicts = []
+    for i, (start, end) in enumerate([(0, 20), (0, 20), (5, 10), (5, 10), (0, 5),
+                                      (10, 20), (6, 6), (20, 30), (21, 21)]):
+        dicts.append({
+            'z_start': start, 'z_end': end, 'confidence': i % 2,
+            'created_at': '2026-01-01T00:00:00', 'updated_at': '2026-01-02T00:00:00',
+            'annotation_id': f"ann_{i % 3}"
+        })
+    resolve = _resolve_with_manager(tmp_path)
+    assert _run(resolve, dicts) == _run(reference_resolve_conflicts, dicts)
+
+
+def test_failed_save_leaves_annotations_unchanged(tmp_path, monkeypatch):
+    manager = AnnotationManager(str(tmp_path / 'vessel.nrrd'), autosave_delay=None)
+    for start, end, confidence in ((0, 10, 1), (5, 20, 2), (15, 30, 1)):
+        manager.add_annotation(Annotation(start, end, confidence=confidence))
+    before = manager.get_all_annotations()
+
+    def fail(path, annotations):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(manager, '_write_file', fail)
+    assert not manager.save()
+    assert manager.get_all_annotations() == before
+    assert [a.to_dict() for a in manager.get_annotations_in_range(21, 30)] == [before[2]]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""共享内存加载测试: sidecar映射的数组按文件引用传递, 不复制到共享内存; 映射后不占用文件描述符"""
+import gc
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from nrrd_loader import NRRDLoader
+from shared_volumes import SharedVolumeLoader, MappedArrayRef, SharedArrayRef, load_and_publish
+
+
+@pytest.fixture
+def shared_loader():
+    loader = SharedVolumeLoader(max_workers=1)
+    yield loader
+    loader.shutdown()
+
+
+def test_sidecar_arrays_passed_by_file(nrrd_file, tmp_path, shared_loader):
+    kwargs = {'use_sidecar': True, 'sidecar_dir': str(tmp_path / 'cache'), 'keep_raw': True}
+    reference = NRRDLoader(nrrd_file, **kwargs)
+    assert not reference.from_sidecar
+
+    published = load_and_publish(nrrd_file, kwargs)
+    assert published.from_sidecar
+    assert isinstance(published.volume, MappedArrayRef)
+    assert isinstance(published.raw_volume, MappedArrayRef)
+
+    loader = shared_loader.attach(pickle.loads(pickle.dumps(published)))
+    assert isinstance(loader.volume, np.memmap)
+    assert not loader.volume.flags.writeable
+    assert np.array_equal(loader.volume, reference.volume)
+    assert np.array_equal(loader.raw_volume, reference.raw_volume)
+    # 只有内存中构造的数组(X/Y视图堆叠)放入共享内存
+    assert shared_loader.stats()['shared_bytes'] == sum(
+        stack.nbytes for stack in loader._cpr_stacks.values() if isinstance(stack, np.ndarray))
+
+
+def test_in_memory_arrays_copied_to_shared_memory(nrrd_file, shared_loader):
+    published = load_and_publish(nrrd_file, {'keep_raw': True})
+    assert isinstance(published.volume, SharedArrayRef)
+
+    loader = shared_loader.attach(pickle.loads(pickle.dumps(published)))
+    reference = NRRDLoader(nrrd_file, keep_raw=True)
+    assert np.array_equal(loader.volume, reference.volume)
+    assert not loader.volume.flags.writeable
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='需要 /proc/self/fd')
+def test_attached_segments_do_not_leak_fds(nrrd_file, shared_loader):
+    def load_and_drop():
+        published = load_and_publish(nrrd_file, {'keep_raw': True, 'eager_cpr': True})
+        loader = shared_loader.attach(pickle.loads(pickle.dumps(published)))
+        assert shared_loader.stats()['segments'] > 0
+        del loader
+        gc.collect()
+
+    # 首次使用共享内存时启动的resource_tracker等占用的描述符不计入
+    load_and_drop()
+    baseline = len(os.listdir('/proc/self/fd'))
+    for _ in range(5):
+        load_and_drop()
+    assert shared_loader.stats()['segments'] == 0
+    assert len(os.listdir('/proc/self/fd')) == baseline
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""sidecar测试: 同一进程内并发写入同一文件的sidecar不互相破坏"""
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from nrrd_loader import NRRDLoader, _write_atomically
+
+
+def test_concurrent_sidecar_writes(nrrd_file, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    loaders = [NRRDLoader(nrrd_file, keep_raw=True) for _ in range(4)]
+    for loader in loaders:
+        loader.sidecar_dir = cache_dir
+
+    threads = [threading.Thread(target=loader._write_sidecar) for loader in loaders]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not [name for name in os.listdir(cache_dir) if name.endswith('.tmp')]
+    reloaded = NRRDLoader(nrrd_file, use_sidecar=True, sidecar_dir=cache_dir, keep_raw=True)
+    assert reloaded.from_sidecar
+    assert np.array_equal(reloaded.volume, loaders[0].volume)
+    assert np.array_equal(reloaded.raw_volume, loaders[0].raw_volume)
+
+
+def test_failed_write_removes_temp_file(tmp_path):
+    target = str(tmp_path / 'data.npy')
+
+    def write(f):
+        f.write(b'partial')
+        raise OSError('disk full')
+
+    with pytest.raises(OSError):
+        _write_atomically(target, 'wb', write)
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""批量Z切片接口测试"""
+import numpy as np
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def client(nrrd_file):
+    app_module.app.config['KEEP_RAW'] = True
+    app_module.volume_cache.clear()
+    client = app_module.app.test_client()
+    response = client.post('/api/load_file', json={'file_path': nrrd_file, 'include_slices': False})
+    assert response.json['success']
+    yield client
+    app_module.app.config['KEEP_RAW'] = False
+
+
+def current_loader():
+    return next(ws.loader for ws in app_module.workspaces._workspaces.values() if ws.loader is not None)
+
+
+def test_slab_with_server_windowing(client):
+    response = client.post('/api/get_slab', json={
+        'start': 8, 'count': 4, 'client_id': 'test', 'seq': 1,
+        'slab_window': [0, 32], 'window': 400, 'level': 40
+    })
+    assert response.status_code == 200
+    assert response.headers['X-Slab-Start'] == '8'
+    assert response.headers['X-Slab-Count'] == '4'
+
+    height = int(response.headers['X-Slice-Height'])
+    width = int(response.headers['X-Slice-Width'])
+    slab = np.frombuffer(response.data, dtype=np.uint8).reshape(4, height, width)
+    expected = current_loader().render_z_slab_windowed(8, 12, 400, 40)
+    np.testing.assert_array_equal(slab, expected)
+
+
+def test_slab_outside_new_window_is_skipped(client):
+    first = {'start': 0, 'count': 4, 'client_id': 'test-window', 'seq': 1, 'slab_window': [0, 16]}
+    client.post('/api/get_slab', json=first)
+    client.post('/api/get_slab', json={'start': 24, 'count': 4, 'client_id': 'test-window', 'seq': 2,
+                                       'slab_window': [16, 40]})
+    response = client.post('/api/get_slab', json=first)
+    assert response.status_code == 204
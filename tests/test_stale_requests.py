@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""切片请求过期测试: 渲染期间到达的新请求使旧请求跳过编码"""
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def client(nrrd_file):
+    app_module.volume_cache.clear()
+    client = app_module.app.test_client()
+    response = client.post('/api/load_file', json={'file_path': nrrd_file, 'include_slices': False})
+    assert response.json['success']
+    return client
+
+
+@pytest.fixture
+def newer_request_during_render(monkeypatch):
+    """渲染切片时登记同一客户端同一通道的更新序号"""
+    render_slice = app_module.render_slice
+
+    def render_and_supersede(loader, axis, index, data, window_level):
+        result = render_slice(loader, axis, index, data, window_level)
+        app_module.request_sequencer.register('test-stale', f'slice-{axis}', 2)
+        return result
+
+    monkeypatch.setattr(app_module, 'render_slice', render_and_supersede)
+
+
+def test_binary_slice_superseded_during_render(client, newer_request_during_render):
+    response = client.post('/api/get_slice_binary', json={
+        'axis': 'z', 'index': 5, 'client_id': 'test-stale', 'seq': 1
+    })
+    assert response.status_code == 204
+    assert response.headers['X-Request-Seq'] == '1'
+
+
+def test_slice_url_superseded_during_render(client, newer_request_during_render):
+    loader = next(ws.loader for ws in app_module.workspaces._workspaces.values() if ws.loader is not None)
+    response = client.get(f'/api/slice/{loader.volume_id}/z/5',
+                          headers={'X-Client-Id': 'test-stale', 'X-Request-Seq': '1'})
+    assert response.status_code == 204
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""体数据池测试: 同一文件只加载一次, 引用计数不被并发加载覆盖"""
+import threading
+
+import pytest
+
+from nrrd_loader import LoadCancelled
+
+from volume_cache import VolumeCache
+from volume_prefetcher import VolumePrefetcher
+
+
+class _Loader:
+    nbytes = 100
+
+    def __init__(self, path):
+        self.file_path = path
+
+
+def _slow_factory(started: threading.Event, release: threading.Event, loads: list):
+    def factory(path, *args):
+        loads.append(path)
+        started.set()
+        release.wait(5)
+        return _Loader(path)
+    return factory
+
+
+def test_put_during_acquire_does_not_replace_pinned_entry(tmp_path):
+    path = str(tmp_path / 'a.nrrd')
+    open(path, 'wb').close()
+    cache = VolumeCache(1000)
+    started, release, loads = threading.Event(), threading.Event(), []
+    result = {}
+
+    thread = threading.Thread(target=lambda: result.setdefault(
+        'loader', cache.acquire(path, _slow_factory(started, release, loads))))
+    thread.start()
+    assert started.wait(5)
+    assert not cache.put(path, _Loader(path))
+    release.set()
+    thread.join(5)
+
+    loader = result['loader']
+    assert cache.acquire(path, lambda p: _Loader(p)) is loader
+    assert cache.stats()['pinned'] == {'a.nrrd': 2}
+    cache.release(loader)
+    cache.release(loader)
+    assert cache.stats()['pinned'] == {}
+    assert cache.current_bytes == 100
+
+
+def test_prefetch_and_request_share_one_load(tmp_path):
+    paths = []
+    for name in ('a', 'b'):
+        path = tmp_path / f'{name}.nrrd'
+        path.write_bytes(b'')
+        paths.append(str(path))
+
+    cache = VolumeCache(1000)
+    started, release, loads = threading.Event(), threading.Event(), []
+    factory = _slow_factory(started, release, loads)
+    prefetcher = VolumePrefetcher(cache, factory, radius=1)
+    prefetcher.set_file_list(paths, owner='ws')
+    prefetcher.prefetch_around(paths[0], owner='ws')
+    assert started.wait(5)
+
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault('loader', cache.acquire(paths[1], factory)))
+    thread.start()
+    # 请求进入acquire后才让预取完成
+    thread.join(0.2)
+    release.set()
+    thread.join(5)
+
+    assert loads == [paths[1]]
+    assert prefetcher.take(paths[1]) is result['loader']
+    assert cache.stats()['pinned'] == {'b.nrrd': 1}
+
+
+def test_waiting_acquire_can_be_cancelled(tmp_path):
+    path = str(tmp_path / 'a.nrrd')
+    open(path, 'wb').close()
+    cache = VolumeCache(1000)
+    started, release, loads = threading.Event(), threading.Event(), []
+    thread = threading.Thread(target=cache.acquire, args=(path, _slow_factory(started, release, loads)))
+    thread.start()
+    assert started.wait(5)
+
+    def cancelled(stage, progress):
+        raise LoadCancelled(path)
+
+    try:
+        with pytest.raises(LoadCancelled):
+            cache.acquire(path, lambda p: _Loader(p), cancelled)
+    finally:
+        release.set()
+        thread.join(5)
+    assert cache.stats()['pinned'] == {'a.nrrd': 1}
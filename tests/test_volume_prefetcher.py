@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""预取测试: 读者跳到别处时正在进行的预取被中止, 等待预取的请求可以被取消"""
+import threading
+
+import pytest
+
+from nrrd_loader import LoadCancelled
+from volume_prefetcher import VolumePrefetcher
+
+
+class _Cache:
+    def __init__(self):
+        self.items = {}
+
+    def contains(self, path):
+        return path in self.items
+
+    def acquire(self, path, loader_factory):
+        self.items[path] = loader_factory(path)
+        return self.items[path]
+
+    def release(self, loader):
+        pass
+
+
+def test_running_prefetch_cancelled(tmp_path):
+    files = []
+    for name in ('a', 'b', 'c', 'd', 'e'):
+        path = tmp_path / f'{name}.nrrd'
+        path.write_bytes(b'')
+        files.append(str(path))
+
+    started = threading.Event()
+    finished = []
+
+    def factory(path, progress_callback):
+        started.set()
+        try:
+            while True:
+                progress_callback('read', 0.1)
+                threading.Event().wait(0.01)
+        except LoadCancelled:
+            finished.append(path)
+            raise
+
+    cache = _Cache()
+    prefetcher = VolumePrefetcher(cache, factory, radius=1, max_workers=1)
+    prefetcher.set_file_list(files, owner='ws')
+    prefetcher.prefetch_around(files[1], owner='ws')
+    assert started.wait(5)
+
+    # 跳到列表末尾: 正在加载的c不再相邻, 未开始的a直接取消
+    prefetcher.prefetch_around(files[4], owner='ws')
+    prefetcher.forget('ws')
+    executor = prefetcher._executor
+    executor.shutdown(wait=True)
+
+    assert files[2] in finished
+    assert files[0] not in finished
+    assert cache.items == {}
+    assert prefetcher.stats()['pending'] == 0
+
+
+def test_take_reports_progress_and_can_be_cancelled(tmp_path):
+    files = []
+    for name in ('a', 'b'):
+        path = tmp_path / f'{name}.nrrd'
+        path.write_bytes(b'')
+        files.append(str(path))
+
+    release = threading.Event()
+
+    def factory(path, progress_callback):
+        progress_callback('normalize', 0.5)
+        release.wait(5)
+        return object()
+
+    prefetcher = VolumePrefetcher(_Cache(), factory, radius=1, max_workers=1)
+    prefetcher.set_file_list(files, owner='ws')
+    prefetcher.prefetch_around(files[0], owner='ws')
+
+    reports = []
+
+    def job_report(stage, progress):
+        reports.append((stage, progress))
+        if len(reports) >= 3:
+            raise LoadCancelled(files[1])
+
+    try:
+        with pytest.raises(LoadCancelled):
+            prefetcher.take(files[1], job_report)
+    finally:
+        release.set()
+    assert ('normalize', 0.5) in reports
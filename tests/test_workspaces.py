@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""会话工作区测试: 请求中按间隔回收超时的工作区"""
+import time
+
+from workspaces import WorkspaceManager
+
+
+class _Pool:
+    def __init__(self):
+        self.released = []
+
+    def release(self, loader):
+        self.released.append(loader)
+
+
+class _Loader:
+    file_path = 'a.nrrd'
+
+
+def test_idle_workspace_expired_from_request_path():
+    pool = _Pool()
+    expired = []
+    manager = WorkspaceManager(pool, idle_timeout=0.05, expire_interval=0.05,
+                               on_expire=lambda ws: expired.append(ws.workspace_id))
+    idle = manager.get('idle')
+    loader = _Loader()
+    manager.open_file(idle, loader, None)
+
+    time.sleep(0.1)
+    # 已有会话的普通请求也会触发检查
+    manager.get('active')
+    assert expired == ['idle']
+    assert pool.released == [loader]
+    assert manager.stats()['count'] == 1
+
+
+def test_expiry_checked_at_most_once_per_interval():
+    manager = WorkspaceManager(_Pool(), idle_timeout=0.05, expire_interval=60)
+    manager.get('idle')
+    time.sleep(0.1)
+    manager.get('active')
+    assert manager.stats()['count'] == 2
@@ -5,14 +5,33 @@
 """
 import os
 import json
-from datetime import datetime
+import uuid
+import threading
+from collections import deque
+from itertools import count
+from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
 
+from interval_index import IntervalIndex
+
+# 可通过update_annotation修改的字段
+UPDATABLE_FIELDS = ('z_start', 'z_end', 'presence', 'type_main', 'type_exclude', 'stenosis', 'confidence')
+# 最后一次修改后等待该时间(秒)再自动压缩日志到快照文件
+DEFAULT_AUTOSAVE_DELAY = 30.0
+# 日志中未压缩的操作数达到该值时立即压缩
+JOURNAL_COMPACT_OPS = 500
+# 日志落盘: 优先只同步数据(不同步文件元数据)
+_fdatasync = getattr(os, 'fdatasync', os.fsync)
+
 
 class Annotation:
     """单个标注对象"""
 
+    # 最近生成ID使用的时间, 保证同一微秒内批量创建的标注ID也不重复
+    _id_lock = threading.Lock()
+    _last_id_time: Optional[datetime] = None
+
     def __init__(self, z_start: int, z_end: int,
                  presence: Optional[int] = None,
                  type_main: Optional[int] = None,
@@ -51,8 +70,14 @@ class Annotation:
         self.annotation_id = annotation_id or self._generate_id()
 
     def _generate_id(self) -> str:
-        """生成唯一ID"""
-        return f"ann_{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+        """生成唯一ID(时间戳格式, 与上一个ID相同或更早时顺延1微秒)"""
+        with Annotation._id_lock:
+            now = datetime.now()
+            last = Annotation._last_id_time
+            if last is not None and now <= last:
+                now = last + timedelta(microseconds=1)
+            Annotation._last_id_time = now
+        return f"ann_{now.strftime('%Y%m%d%H%M%S%f')}"
 
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典"""
@@ -108,31 +133,85 @@ class Annotation:
 
 
 class AnnotationManager:
-    """标注管理器"""
-
-    def __init__(self, data_file: str, doctor_name: str = ""):
+    """
+    标注管理器
+
+    每次添加/修改/删除都追加到标注文件旁的日志(<标注文件>.journal)并落盘, 加载时在标注文件之上重放;
+    最后一次修改后 autosave_delay 秒(或日志累计 JOURNAL_COMPACT_OPS 条操作时)将当前标注原样(不解决冲突)
+    压缩到单独的快照文件(<文件名>_label.journal.json), 标注文件(_label.json)只在手动保存时解决冲突后写入,
+    因此目录列表中的"已标注"只反映医生保存过的文件。加载时依次使用标注文件、比其更新的快照和日志。
+    文件均通过临时文件+重命名原子替换。同一标注文件只能有一个管理器写入, 多个会话通过AnnotationRegistry共享
+    """
+
+    def __init__(self, data_file: str, doctor_name: str = "",
+                 autosave_delay: Optional[float] = DEFAULT_AUTOSAVE_DELAY):
         """
         初始化标注管理器
 
         Args:
             data_file: 数据文件路径
             doctor_name: 医生名字
+            autosave_delay: 自动压缩日志的延迟(秒), None表示只在手动保存和日志过长时压缩
         """
         self.data_file = data_file
         self.doctor_name = doctor_name
-        self.annotations: List[Annotation] = []
+        # 标注按加入顺序保存: 序号 -> 标注
+        self._entries: Dict[int, Annotation] = {}
+        # 标注ID -> 序号列表(冲突解决拆分出的片段沿用原标注ID, 同一ID可能对应多个片段)
+        self._by_id: Dict[str, List[int]] = {}
+        # 按Z区间索引的序号
+        self._z_index = IntervalIndex()
+        self._serials = count()
 
         # 确定标注文件路径
+        self.annotation_file = self.annotation_path(data_file, doctor_name)
+
+        self.journal_file = self.annotation_file + '.journal'
+        # 日志压缩后的快照(未解决冲突, 不被目录索引识别为标注文件)
+        self.snapshot_file = os.path.splitext(self.annotation_file)[0] + '.journal.json'
+        self.autosave_delay = autosave_delay
+        # 追加写入的日志文件(首次修改时打开)
+        self._journal = None
+        # 最后一条日志操作的序号(标注文件和快照记录其已包含的序号, 重放时跳过)
+        self._journal_seq = 0
+        # 日志中尚未压缩的操作数
+        self._journal_ops = 0
+        self._autosave_timer: Optional[threading.Timer] = None
+        # 修改标注、写日志和压缩时持有(自动压缩在定时器线程中进行)
+        self._lock = threading.RLock()
+
+        # 尝试加载现有标注
+        self.load()
+
+    @staticmethod
+    def annotation_path(data_file: str, doctor_name: str = "") -> str:
+        """数据文件对应的标注文件路径"""
         base_name = os.path.splitext(os.path.basename(data_file))[0]
         data_dir = os.path.dirname(data_file)
 
         if doctor_name:
-            self.annotation_file = os.path.join(data_dir, f"{base_name}_{doctor_name}_label.json")
-        else:
-            self.annotation_file = os.path.join(data_dir, f"{base_name}_label.json")
-
-        # 尝试加载现有标注
-        self.load()
+            return os.path.join(data_dir, f"{base_name}_{doctor_name}_label.json")
+        return os.path.join(data_dir, f"{base_name}_label.json")
+
+    @property
+    def annotations(self) -> List[Annotation]:
+        """所有标注(按加入顺序)"""
+        return list(self._entries.values())
+
+    @annotations.setter
+    def annotations(self, annotations: List[Annotation]):
+        self._entries = {}
+        self._by_id = {}
+        self._z_index.clear()
+        for ann in annotations:
+            self._insert(ann)
+
+    def _insert(self, annotation: Annotation):
+        """加入标注并建立索引"""
+        serial = next(self._serials)
+        self._entries[serial] = annotation
+        self._by_id.setdefault(annotation.annotation_id, []).append(serial)
+        self._z_index.insert(annotation.z_start, annotation.z_end, serial)
 
     def add_annotation(self, annotation: Annotation) -> bool:
         """
@@ -144,12 +223,14 @@ class AnnotationManager:
         Returns:
             是否成功添加
         """
-        self.annotations.append(annotation)
+        with self._lock:
+            self._insert(annotation)
+            self._log('add', annotation=annotation.to_dict())
         return True
 
     def remove_annotation(self, annotation_id: str) -> bool:
         """
-        删除标注
+        删除标注(包括同一ID的所有片段)
 
         Args:
             annotation_id: 标注ID
@@ -157,13 +238,15 @@ class AnnotationManager:
         Returns:
             是否成功删除
         """
-        original_length = len(self.annotations)
-        self.annotations = [ann for ann in self.annotations if ann.annotation_id != annotation_id]
-        return len(self.annotations) < original_length
+        with self._lock:
+            if not self._remove(annotation_id):
+                return False
+            self._log('delete', annotation_id=annotation_id)
+        return True
 
     def update_annotation(self, annotation_id: str, updated_data: Dict[str, Any]) -> bool:
         """
-        更新标注
+        更新标注(同一ID有多个片段时更新最先加入的)
 
         Args:
             annotation_id: 标注ID
@@ -172,137 +255,293 @@ class AnnotationManager:
         Returns:
             是否成功更新
         """
-        for ann in self.annotations:
-            if ann.annotation_id == annotation_id:
-                # 更新字段
-                if 'z_start' in updated_data:
-                    ann.z_start = updated_data['z_start']
-                if 'z_end' in updated_data:
-                    ann.z_end = updated_data['z_end']
-                if 'presence' in updated_data:
-                    ann.presence = updated_data['presence']
-                if 'type_main' in updated_data:
-                    ann.type_main = updated_data['type_main']
-                if 'type_exclude' in updated_data:
-                    ann.type_exclude = updated_data['type_exclude']
-                if 'stenosis' in updated_data:
-                    ann.stenosis = updated_data['stenosis']
-                if 'confidence' in updated_data:
-                    ann.confidence = updated_data['confidence']
-                # 更新时间戳
-                ann.updated_at = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        # 更新字段和时间戳
+        data = {key: updated_data[key] for key in UPDATABLE_FIELDS if key in updated_data}
+        data['updated_at'] = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+
+        with self._lock:
+            if not self._update(annotation_id, data):
+                return False
+            self._log('update', annotation_id=annotation_id, data=data)
+        return True
+
+    def _remove(self, annotation_id: str) -> bool:
+        """删除同一ID的所有标注并更新索引"""
+        serials = self._by_id.pop(annotation_id, None)
+        if not serials:
+            return False
+        for serial in serials:
+            ann = self._entries.pop(serial)
+            self._z_index.remove(ann.z_start, serial)
+        return True
+
+    def _update(self, annotation_id: str, data: Dict[str, Any]) -> bool:
+        """将字段写入该ID最先加入的标注并更新索引"""
+        serials = self._by_id.get(annotation_id)
+        if not serials:
+            return False
+
+        serial = serials[0]
+        ann = self._entries[serial]
+        # Z范围可能变化, 先移出索引
+        self._z_index.remove(ann.z_start, serial)
+        for key, value in data.items():
+            setattr(ann, key, value)
+        self._z_index.insert(ann.z_start, ann.z_end, serial)
+        return True
+
+    def _log(self, op: str, **fields):
+        """
+        追加一条操作到日志并落盘(失败时只打印警告, 修改仍保留在内存中)
+
+        Args:
+            op: 'add' / 'update' / 'delete'
+            fields: 操作内容
+        """
+        self._journal_seq += 1
+        record = {'seq': self._journal_seq, 'op': op}
+        record.update(fields)
+        try:
+            if self._journal is None:
+                os.makedirs(os.path.dirname(self.annotation_file), exist_ok=True)
+                self._journal = open(self.journal_file, 'a', encoding='utf-8')
+                # 上次崩溃可能留下写了一半的行, 新操作从新行开始
+                if self._journal.tell() > 0:
+                    self._journal.write('\n')
+            self._journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._journal.flush()
+            _fdatasync(self._journal.fileno())
+        except OSError as e:
+            print(f"写入标注日志失败: {e}")
+            return
+
+        self._journal_ops += 1
+        if self._journal_ops >= JOURNAL_COMPACT_OPS:
+            self.compact()
+        else:
+            self._schedule_autosave()
+
+    def _replay_journal(self, after_seq: int) -> int:
+        """
+        重放日志中序号大于after_seq的操作
+
+        Returns:
+            重放的操作数
+        """
+        self._journal_seq = after_seq
+        self._journal_ops = 0
+        if not os.path.exists(self.journal_file):
+            return 0
+
+        with open(self.journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 崩溃时写了一半的行
+                    continue
+                seq = record.get('seq', 0)
+                if seq <= after_seq:
+                    continue
+
+                op = record.get('op')
+                if op == 'add':
+                    self._insert(Annotation.from_dict(record['annotation']))
+                elif op == 'update':
+                    self._update(record['annotation_id'], record['data'])
+                elif op == 'delete':
+                    self._remove(record['annotation_id'])
+                self._journal_seq = max(self._journal_seq, seq)
+                self._journal_ops += 1
+
+        if self._journal_ops:
+            self._schedule_autosave()
+        return self._journal_ops
+
+    def _schedule_autosave(self):
+        """重新开始自动压缩的计时(连续修改时只在最后一次修改后压缩一次)"""
+        if self.autosave_delay is None:
+            return
+        if self._autosave_timer is not None:
+            self._autosave_timer.cancel()
+        self._autosave_timer = threading.Timer(self.autosave_delay, self._autosave)
+        self._autosave_timer.daemon = True
+        self._autosave_timer.start()
+
+    def _autosave(self):
+        """自动压缩(在定时器线程中运行)"""
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"自动保存标注失败: {e}")
+
+    def compact(self) -> bool:
+        """
+        将当前标注原样(不解决冲突)写入快照文件并清空日志, 不修改标注文件
+
+        Returns:
+            是否成功(没有未压缩的操作时直接返回True)
+        """
+        with self._lock:
+            if self._journal_ops == 0:
                 return True
-        return False
+            try:
+                self._write_file(self.snapshot_file, self.annotations)
+                self._clear_journal()
+                return True
+            except Exception as e:
+                print(f"压缩标注日志失败: {e}")
+                return False
+
+    def close(self):
+        """停止自动压缩并关闭日志(未压缩的操作保留在日志中, 下次加载时重放)"""
+        with self._lock:
+            if self._autosave_timer is not None:
+                self._autosave_timer.cancel()
+                self._autosave_timer = None
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
 
     def get_annotation(self, annotation_id: str) -> Optional[Annotation]:
         """获取指定ID的标注"""
-        for ann in self.annotations:
-            if ann.annotation_id == annotation_id:
-                return ann
-        return None
+        with self._lock:
+            serials = self._by_id.get(annotation_id)
+            return self._entries[serials[0]] if serials else None
 
     def resolve_conflicts(self) -> List[Annotation]:
         """
         解决重叠标注的冲突
         规则: 优先保存置信度高的,如果置信度一样则优先保存标记时间更靠后的
 
+        按z_start顺序扫描: 已处理的片段互不重叠, 结束位置早于当前标注起点的片段不会再与后续标注重叠,
+        因此只需在按z排序的前沿队列头部查找冲突, 每个标注的代价与其重叠的片段数成正比
+
         Returns:
             解决冲突后的标注列表
         """
-        if len(self.annotations) <= 1:
-            return self.annotations.copy()
+        annotations = self.annotations
+        if len(annotations) <= 1:
+            return annotations
 
         # 按z_start排序
-        sorted_anns = sorted(self.annotations, key=lambda a: a.z_start)
+        sorted_anns = sorted(annotations, key=lambda a: a.z_start)
 
-        # 用于存储最终结果
-        result: List[Annotation] = []
+        # 最终结果(按加入顺序, 删除为O(1)): 序号 -> 片段
+        result: Dict[int, Annotation] = {}
+        # 仍可能与后续标注重叠的片段, 按z排序且互不重叠: (序号, 片段)
+        frontier: deque = deque()
+        # 结果中最后加入的片段: (序号, 片段)
+        tail: Optional[Tuple[int, Annotation]] = None
+        counter = count()
 
-        # 处理每个标注
         for ann in sorted_anns:
-            # 检查是否与已有结果中的标注重叠
+            # 结束早于当前起点的片段已确定, 移出前沿
+            while frontier and frontier[0][1].z_end < ann.z_start:
+                frontier.popleft()
+
+            # 与当前标注重叠的片段位于前沿头部
             conflicts = []
-            for existing in result:
-                if ann.overlaps_with(existing):
-                    conflicts.append(existing)
+            while frontier and frontier[0][1].z_start <= ann.z_end:
+                conflicts.append(frontier.popleft())
 
             if not conflicts:
                 # 没有冲突,直接添加
-                result.append(ann)
-            else:
-                # 有冲突,需要解决
-                self._resolve_single_conflict(ann, conflicts, result)
+                key = next(counter)
+                result[key] = ann
+                tail = (key, ann)
+                frontier.appendleft(tail)
+                continue
+
+            # 有冲突,需要解决
+            tail = self._resolve_single_conflict(ann, conflicts, result, frontier, tail, counter)
 
-        return result
+        return list(result.values())
 
     def _resolve_single_conflict(self, new_ann: Annotation,
-                                 conflicts: List[Annotation],
-                                 result: List[Annotation]):
+                                 conflicts: List[Tuple[int, Annotation]],
+                                 result: Dict[int, Annotation],
+                                 frontier: deque,
+                                 tail: Optional[Tuple[int, Annotation]],
+                                 counter) -> Optional[Tuple[int, Annotation]]:
         """
-        解决单个标注的冲突
+        解决单个标注的冲突: 将新标注与冲突片段覆盖的区间按优先级重新分段
 
         Args:
             new_ann: 新标注
-            conflicts: 冲突的标注列表
-            result: 结果列表(会被修改)
-        """
-        # 收集所有涉及的区间
-        segments = []  # (z_start, z_end, annotation)
-
-        # 添加新标注
-        segments.append((new_ann.z_start, new_ann.z_end, new_ann))
-
-        # 添加冲突的标注
-        for conf in conflicts:
-            segments.append((conf.z_start, conf.z_end, conf))
+            conflicts: 冲突的片段(按z排序): (结果序号, 片段)
+            result: 结果(会被修改)
+            frontier: 前沿队列(会被修改), 新片段放回头部
+            tail: 结果中最后加入的片段: (序号, 片段)
+            counter: 结果序号生成器
 
+        Returns:
+            处理后结果中最后加入的片段: (序号, 片段)
+        """
         # 找出所有关键点
-        points = set()
-        for start, end, _ in segments:
-            points.add(start)
-            points.add(end + 1)  # +1因为end是inclusive的
-
+        points = {new_ann.z_start, new_ann.z_end + 1}  # +1因为end是inclusive的
+        for _, conf in conflicts:
+            points.add(conf.z_start)
+            points.add(conf.z_end + 1)
         sorted_points = sorted(points)
 
-        # 对每个区间,确定最高优先级的标注
+        new_key = (new_ann.confidence, new_ann.updated_at)
+        # 重新分段后的片段(按z排序), 包括被扩展的之前最后一个片段
+        segments: List[Tuple[int, Annotation]] = []
+        conflict_index = 0
+
+        # 对每个区间,确定最高优先级的标注(冲突片段互不重叠, 每个区间最多被新标注和一个片段覆盖)
         for i in range(len(sorted_points) - 1):
             seg_start = sorted_points[i]
             seg_end = sorted_points[i + 1] - 1
 
-            # 找出覆盖这个区间的所有标注
-            covering = []
-            for start, end, ann in segments:
-                if start <= seg_start and seg_end <= end:
-                    covering.append(ann)
-
-            if covering:
-                # 选择优先级最高的
-                winner = max(covering, key=lambda a: (a.confidence, a.updated_at))
-
-                # 检查是否需要添加到结果
-                # 如果结果中最后一个标注与这个区间的winner相同且连续,则扩展
-                if result and result[-1].annotation_id == winner.annotation_id and \
-                   result[-1].z_end + 1 == seg_start:
-                    result[-1].z_end = seg_end
-                else:
-                    # 创建新的标注片段
-                    segment_ann = Annotation(
-                        z_start=seg_start,
-                        z_end=seg_end,
-                        presence=winner.presence,
-                        type_main=winner.type_main,
-                        type_exclude=winner.type_exclude.copy(),
-                        stenosis=winner.stenosis,
-                        confidence=winner.confidence,
-                        created_at=winner.created_at,
-                        updated_at=winner.updated_at,
-                        annotation_id=winner.annotation_id
-                    )
-                    result.append(segment_ann)
+            while conflict_index < len(conflicts) and conflicts[conflict_index][1].z_end < seg_start:
+                conflict_index += 1
+            covering = None
+            if conflict_index < len(conflicts):
+                conf = conflicts[conflict_index][1]
+                if conf.z_start <= seg_start and seg_end <= conf.z_end:
+                    covering = conf
+
+            # 优先级相同时新标注优先
+            if new_ann.z_start <= seg_start and seg_end <= new_ann.z_end:
+                if covering is None or (covering.confidence, covering.updated_at) <= new_key:
+                    covering = new_ann
+            if covering is None:
+                continue
+            winner = covering
+
+            # 如果结果中最后一个标注与这个区间的winner相同且连续,则扩展
+            if tail is not None and tail[1].annotation_id == winner.annotation_id and \
+               tail[1].z_end + 1 == seg_start:
+                if not segments:
+                    # 之前的最后一个片段与新区间相接, 扩展后重新成为前沿的一部分
+                    segments.append(tail)
+                tail[1].z_end = seg_end
+            else:
+                # 创建新的标注片段
+                segment_ann = Annotation(
+                    z_start=seg_start,
+                    z_end=seg_end,
+                    presence=winner.presence,
+                    type_main=winner.type_main,
+                    type_exclude=winner.type_exclude.copy(),
+                    stenosis=winner.stenosis,
+                    confidence=winner.confidence,
+                    created_at=winner.created_at,
+                    updated_at=winner.updated_at,
+                    annotation_id=winner.annotation_id
+                )
+                tail = (next(counter), segment_ann)
+                result[tail[0]] = segment_ann
+                segments.append(tail)
 
         # 从结果中移除被处理的冲突标注
-        for conf in conflicts:
-            result.remove(conf)
+        for key, _ in conflicts:
+            del result[key]
+
+        frontier.extendleft(reversed(segments))
+        return tail
 
     def save(self) -> bool:
         """
@@ -311,64 +550,194 @@ class AnnotationManager:
         Returns:
             是否成功保存
         """
-        try:
-            # 解决冲突
-            resolved = self.resolve_conflicts()
-
-            # 准备保存数据
-            data = {
-                'data_file': os.path.basename(self.data_file),
-                'doctor_name': self.doctor_name,
-                'last_modified': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'annotations': [ann.to_dict() for ann in resolved]
-            }
+        with self._lock:
+            try:
+                # 解决冲突
+                resolved = self.resolve_conflicts()
+                self._write_file(self.annotation_file, resolved)
+                # 标注文件已包含所有修改(删除快照前崩溃时, 快照的journal_seq不大于标注文件而被忽略)
+                self._clear_journal()
+                if os.path.exists(self.snapshot_file):
+                    os.remove(self.snapshot_file)
+
+                # 更新当前标注列表为解决冲突后的版本
+                self.annotations = resolved
 
-            # 保存到文件
-            os.makedirs(os.path.dirname(self.annotation_file), exist_ok=True)
-            with open(self.annotation_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+                return True
 
-            # 更新当前标注列表为解决冲突后的版本
-            self.annotations = resolved
+            except Exception as e:
+                print(f"保存标注失败: {e}")
+                return False
 
-            return True
+    def _write_file(self, path: str, annotations: List[Annotation]):
+        """
+        写入标注文件或快照(临时文件落盘后重命名替换, 中途崩溃时原文件不受影响)
 
-        except Exception as e:
-            print(f"保存标注失败: {e}")
-            return False
+        Args:
+            path: 目标文件
+            annotations: 要写入的标注
+        """
+        # 准备保存数据
+        data = {
+            'data_file': os.path.basename(self.data_file),
+            'doctor_name': self.doctor_name,
+            'last_modified': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'journal_seq': self._journal_seq,
+            'annotations': [ann.to_dict() for ann in annotations]
+        }
+
+        # 保存到文件
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_file = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, path)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    def _clear_journal(self):
+        """刚写入的文件已包含日志中的所有操作, 删除日志(重命名后、删除日志前崩溃时按journal_seq跳过)"""
+        if self._autosave_timer is not None:
+            self._autosave_timer.cancel()
+            self._autosave_timer = None
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self._journal_ops = 0
 
     def load(self) -> bool:
         """
-        从文件加载标注
+        从文件加载标注, 比标注文件更新的快照存在时以快照为准, 再重放日志中尚未压缩的修改
 
         Returns:
             是否成功加载
         """
-        if not os.path.exists(self.annotation_file):
-            return False
-
-        try:
-            with open(self.annotation_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+        journal_seq = 0
+        loaded = False
+        for path in (self.annotation_file, self.snapshot_file):
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"加载标注失败: {e}")
+                if path == self.annotation_file:
+                    return False
+                continue
+
+            # 手动保存后遗留的旧快照(序号不大于标注文件)忽略
+            if loaded and data.get('journal_seq', 0) <= journal_seq:
+                continue
 
             # 恢复标注
             self.annotations = [Annotation.from_dict(ann_data)
                               for ann_data in data.get('annotations', [])]
+            journal_seq = data.get('journal_seq', 0)
 
             # 更新医生名字(如果文件中有)
             if 'doctor_name' in data and not self.doctor_name:
                 self.doctor_name = data['doctor_name']
 
-            return True
+            loaded = True
 
+        try:
+            replayed = self._replay_journal(journal_seq)
         except Exception as e:
-            print(f"加载标注失败: {e}")
-            return False
+            print(f"重放标注日志失败: {e}")
+            return loaded
+        return loaded or replayed > 0
 
     def get_all_annotations(self) -> List[Dict[str, Any]]:
         """获取所有标注(字典格式)"""
-        return [ann.to_dict() for ann in self.annotations]
+        with self._lock:
+            return [ann.to_dict() for ann in self.annotations]
 
     def get_annotations_at_z(self, z: int) -> List[Annotation]:
-        """获取指定Z位置的所有标注"""
-        return [ann for ann in self.annotations if ann.z_start <= z <= ann.z_end]
+        """获取指定Z位置的所有标注(按加入顺序)"""
+        return self.get_annotations_in_range(z, z)
+
+    def get_annotations_in_range(self, z_start: int, z_end: int) -> List[Annotation]:
+        """获取与Z区间 [z_start, z_end] 重叠的所有标注(按加入顺序)"""
+        with self._lock:
+            serials = sorted(self._z_index.overlapping(min(z_start, z_end), max(z_start, z_end)))
+            return [self._entries[serial] for serial in serials]
+
+
+class AnnotationRegistry:
+    """
+    按标注文件共享的标注管理器(引用计数)
+
+    多个会话以相同医生名打开同一文件时使用同一个管理器, 日志序号和快照只有一个写入者;
+    否则各自的管理器会交替追加同一日志, 序号冲突导致重放时跳过或错序, 压缩时互相覆盖
+    """
+
+    def __init__(self, autosave_delay: Optional[float] = DEFAULT_AUTOSAVE_DELAY):
+        """
+        初始化
+
+        Args:
+            autosave_delay: 新建管理器的自动压缩延迟(秒)
+        """
+        self.autosave_delay = autosave_delay
+        # 标注文件路径 -> [管理器, 引用计数]
+        self._managers: Dict[str, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(annotation_file: str) -> str:
+        return os.path.normcase(os.path.abspath(annotation_file))
+
+    def acquire(self, data_file: str, doctor_name: str = "") -> AnnotationManager:
+        """
+        获取数据文件的标注管理器并增加引用计数(使用完毕后调用release)
+
+        Args:
+            data_file: 数据文件路径
+            doctor_name: 医生名字
+
+        Returns:
+            AnnotationManager(已有会话打开时为同一对象)
+        """
+        key = self._key(AnnotationManager.annotation_path(data_file, doctor_name))
+        with self._lock:
+            entry = self._managers.get(key)
+            if entry is None:
+                manager = AnnotationManager(data_file, doctor_name, self.autosave_delay)
+                entry = self._managers[key] = [manager, 0]
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, manager: AnnotationManager):
+        """
+        减少管理器的引用计数, 归零时关闭管理器(未压缩的操作保留在日志中)
+
+        Args:
+            manager: acquire返回的管理器(不是由本对象创建的直接忽略)
+        """
+        key = self._key(manager.annotation_file)
+        with self._lock:
+            entry = self._managers.get(key)
+            if entry is None or entry[0] is not manager:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._managers[key]
+        manager.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        with self._lock:
+            return {
+                'count': len(self._managers),
+                'refs': sum(entry[1] for entry in self._managers.values())
+            }
+
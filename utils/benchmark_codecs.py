@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+切片编码器基准测试
+对比各编码器/压缩级别在CPR切片上的编码耗时和传输字节数
+
+用法:
+    python utils/benchmark_codecs.py                  # 使用合成CPR体数据
+    python utils/benchmark_codecs.py path/to/file.nrrd
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from slice_codecs import available_codecs, parse_codec_spec
+
+# 每个编码器参与测试的压缩级别(None表示默认级别)
+BENCHMARK_LEVELS = {
+    'png': [0, 1, 6, 9],
+    'webp': [0, 50, 100],
+    'zlib': [1, 6],
+    'lz4': [0, 9],
+}
+
+
+def make_synthetic_volume(shape=(600, 64, 64), seed=0) -> np.ndarray:
+    """
+    构造合成CPR体数据: 沿Z方向拉直的管腔 + 背景噪声
+
+    Args:
+        shape: (Z, Y, X), 与NRRDLoader.volume相同的数组顺序
+        seed: 随机种子
+
+    Returns:
+        uint8 numpy array
+    """
+    rng = np.random.default_rng(seed)
+    z, y, x = shape
+    yy, xx = np.meshgrid(np.arange(y) - y / 2, np.arange(x) - x / 2, indexing='ij')
+    radius = np.sqrt(xx ** 2 + yy ** 2)
+
+    volume = np.empty(shape, dtype=np.float32)
+    for k in range(z):
+        lumen_radius = 6 + 2 * np.sin(k / 40.0)
+        plane = np.where(radius < lumen_radius, 180.0, 60.0)
+        plane += np.where(np.abs(radius - lumen_radius - 1.5) < 1.5, 60.0, 0.0)
+        volume[k] = plane
+    volume += rng.normal(0, 12, size=shape)
+    return np.clip(volume, 0, 255).astype(np.uint8)
+
+
+def load_volume(path: str = None):
+    """
+    通过NRRDLoader加载体数据(与服务端相同的标准化和切片方向)
+
+    Args:
+        path: NRRD文件路径, None时将合成体数据写入临时NRRD文件后加载
+
+    Returns:
+        NRRDLoader
+    """
+    from nrrd_loader import NRRDLoader
+    if path:
+        return NRRDLoader(path, keep_raw=False)
+
+    import SimpleITK as sitk
+    fd, temp_path = tempfile.mkstemp(suffix='.nrrd')
+    os.close(fd)
+    try:
+        sitk.WriteImage(sitk.GetImageFromArray(make_synthetic_volume()), temp_path)
+        return NRRDLoader(temp_path, keep_raw=False)
+    finally:
+        os.remove(temp_path)
+
+
+def sample_slices(loader, count: int):
+    """按轴均匀抽取服务端实际返回的切片(含X/Y视图的旋转)"""
+    slices = {}
+    for axis, dim in (('x', 2), ('y', 1), ('z', 0)):
+        indices = np.linspace(0, loader.shape[dim] - 1, count).astype(int)
+        slices[axis] = [np.ascontiguousarray(loader.get_slice_with_rotation(axis, int(i)))
+                        for i in indices]
+    return slices
+
+
+def benchmark(slices, spec: str, repeat: int):
+    """
+    测试单个编码器
+
+    Returns:
+        {axis: (每切片微秒, 每切片字节)}
+    """
+    codec, level = parse_codec_spec(spec)
+    results = {}
+    for axis, items in slices.items():
+        codec.encode(items[0], level)  # 预热
+        total_bytes = 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for item in items:
+                total_bytes += len(codec.encode(item, level))
+        elapsed = time.perf_counter() - start
+        n = repeat * len(items)
+        results[axis] = (elapsed / n * 1e6, total_bytes / n)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='切片编码器基准测试')
+    parser.add_argument('nrrd', nargs='?', help='NRRD文件路径(省略时使用合成数据)')
+    parser.add_argument('--slices', type=int, default=16, help='每个轴抽取的切片数 (default: 16)')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数 (default: 3)')
+    args = parser.parse_args()
+
+    loader = load_volume(args.nrrd)
+    slices = sample_slices(loader, args.slices)
+    print(f"体数据形状(Z, Y, X): {loader.shape}, 可用编码器: {', '.join(available_codecs())}")
+    print()
+
+    header = f"{'编码器':<10}" + ''.join(f"{axis + ' µs/切片':>14}{axis + ' 字节':>12}" for axis in slices)
+    print(header)
+    print('-' * len(header))
+
+    for name in available_codecs():
+        for level in BENCHMARK_LEVELS.get(name, [None]):
+            spec = name if level is None else f"{name}:{level}"
+            results = benchmark(slices, spec, args.repeat)
+            row = f"{spec:<10}" + ''.join(
+                f"{results[axis][0]:>14.0f}{results[axis][1]:>12.0f}" for axis in slices
+            )
+            print(row)
+
+
+if __name__ == '__main__':
+    main()
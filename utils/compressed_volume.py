@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+压缩体数据存储工具
+将常驻内存的体数据按Z方向分块压缩保存, 取切片时只解压涉及的块, 最近解压的块保存在小型热缓存中
+"""
+import zlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# 每块的目标字节数(按切片大小换算成Z方向层数)
+CHUNK_TARGET_BYTES = 256 * 1024
+# 默认热缓存容量(字节), 实际不超过未压缩体数据的1/4
+DEFAULT_HOT_CACHE_BYTES = 8 * 1024 * 1024
+# 缓存的跨越全部Z块的切面数(X/Y视图需要解压所有块), 总字节数另受热缓存容量限制
+MAX_CROSS_SECTIONS = 8
+
+# 压缩方式: 名称 -> (压缩函数, 解压函数)
+_COMPRESSORS = {
+    'zlib': (lambda data: zlib.compress(data, 1), zlib.decompress),
+}
+if lz4_frame is not None:
+    _COMPRESSORS['lz4'] = (lambda data: lz4_frame.compress(data, compression_level=0),
+                           lz4_frame.decompress)
+
+
+def available_compressors() -> List[str]:
+    """获取可用的压缩方式"""
+    return list(_COMPRESSORS)
+
+
+def resolve_compressor(name: str = 'auto') -> str:
+    """
+    解析压缩方式名称
+
+    Args:
+        name: 'auto'(有lz4时使用lz4, 否则zlib) 或具体名称
+
+    Returns:
+        压缩方式名称
+    """
+    if name == 'auto':
+        return 'lz4' if 'lz4' in _COMPRESSORS else 'zlib'
+    if name not in _COMPRESSORS:
+        raise ValueError(f"不可用的压缩方式: {name} (可用: {', '.join(_COMPRESSORS)})")
+    return name
+
+
+class CompressedVolume:
+    """
+    按Z分块压缩的只读体数据, 支持NRRDLoader用到的索引方式:
+    volume[z], volume[z0:z1], volume[:, y, :], volume[:, :, x], 以及np.asarray(volume)
+
+    X/Y切面需要解压全部Z块: zlib下每个新切面明显慢于lz4(几百毫秒量级), 需要频繁浏览X/Y视图时
+    建议安装lz4或同时使用预构建的X/Y视图堆叠
+    """
+
+    def __init__(self, array: np.ndarray, compressor: str = 'auto',
+                 chunk_depth: Optional[int] = None,
+                 hot_cache_bytes: int = DEFAULT_HOT_CACHE_BYTES):
+        """
+        压缩体数据
+
+        Args:
+            array: 3D数组 (Z, Y, X)
+            compressor: 压缩方式, 'auto' / 'zlib' / 'lz4'
+            chunk_depth: 每块的Z层数, None时按 CHUNK_TARGET_BYTES 自动确定
+            hot_cache_bytes: 已解压块的缓存容量(字节), 实际不超过未压缩体数据的1/4(至少容纳一块);
+                切面缓存使用同样的容量
+        """
+        if array.ndim != 3:
+            raise ValueError(f"只支持3D体数据: {array.shape}")
+
+        self.compressor = resolve_compressor(compressor)
+        self.shape = tuple(int(v) for v in array.shape)
+        self.dtype = array.dtype
+        slice_bytes = max(1, self.shape[1] * self.shape[2] * self.dtype.itemsize)
+        self.chunk_depth = max(1, int(chunk_depth or CHUNK_TARGET_BYTES // slice_bytes))
+        chunk_bytes = self.chunk_depth * slice_bytes
+        self.hot_cache_bytes = max(chunk_bytes, min(hot_cache_bytes, self.raw_bytes // 4))
+
+        compress = _COMPRESSORS[self.compressor][0]
+        self._chunks: List[bytes] = [
+            compress(np.ascontiguousarray(array[z:z + self.chunk_depth]).tobytes())
+            for z in range(0, self.shape[0], self.chunk_depth)
+        ]
+        self.compressed_bytes = sum(len(chunk) for chunk in self._chunks)
+
+        # 块序号 -> 已解压的只读数组
+        self._cache: 'OrderedDict[int, np.ndarray]' = OrderedDict()
+        self._cache_bytes = 0
+        # 跨越全部块的切面(如 volume[:, :, x]): 索引描述 -> 结果
+        self._cross_sections: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+        self._cross_section_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ndim(self) -> int:
+        return 3
+
+    @property
+    def size(self) -> int:
+        return self.shape[0] * self.shape[1] * self.shape[2]
+
+    @property
+    def raw_bytes(self) -> int:
+        """未压缩时的字节数"""
+        return self.size * self.dtype.itemsize
+
+    @property
+    def nbytes(self) -> int:
+        """
+        常驻内存字节数上限(压缩数据 + 热缓存容量 + 切面缓存容量)
+
+        按容量而非当前占用计算, VolumeCache只在加入时读取一次, 之后缓存增长不会超出预算
+        """
+        return self.compressed_bytes + 2 * self.hot_cache_bytes
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def _decode(self, chunk_index: int) -> np.ndarray:
+        """解压单个块(不经过缓存)"""
+        z0 = chunk_index * self.chunk_depth
+        depth = min(self.chunk_depth, self.shape[0] - z0)
+        data = _COMPRESSORS[self.compressor][1](self._chunks[chunk_index])
+        chunk = np.frombuffer(data, dtype=self.dtype).reshape(depth, self.shape[1], self.shape[2])
+        chunk.flags.writeable = False
+        return chunk
+
+    def _get_chunk(self, chunk_index: int) -> np.ndarray:
+        """获取解压后的块(优先热缓存)"""
+        with self._lock:
+            chunk = self._cache.get(chunk_index)
+            if chunk is not None:
+                self._cache.move_to_end(chunk_index)
+                self.hits += 1
+                return chunk
+            self.misses += 1
+
+        # 解压不持有锁, 并发未命中同一块时可能重复解压, 结果相同
+        chunk = self._decode(chunk_index)
+        with self._lock:
+            if chunk_index not in self._cache:
+                self._cache[chunk_index] = chunk
+                self._cache_bytes += chunk.nbytes
+                while self._cache_bytes > self.hot_cache_bytes and len(self._cache) > 1:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cache_bytes -= evicted.nbytes
+        return chunk
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        z_key, rest = key[0], key[1:]
+        nz = self.shape[0]
+
+        if isinstance(z_key, (int, np.integer)):
+            z = int(z_key) + (nz if z_key < 0 else 0)
+            if not 0 <= z < nz:
+                raise IndexError(f"Z索引超出范围: {z_key}")
+            chunk = self._get_chunk(z // self.chunk_depth)
+            return chunk[(z % self.chunk_depth,) + rest]
+
+        if not isinstance(z_key, slice) or z_key.step not in (None, 1):
+            return np.asarray(self)[key]
+
+        start, stop, _ = z_key.indices(nz)
+        if stop <= start:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + rest]
+
+        first, last = start // self.chunk_depth, (stop - 1) // self.chunk_depth
+        # 涉及的块超过热缓存一半时(如X/Y切面需要遍历全部块)逐块解压, 不挤占缓存
+        span_bytes = (last - first + 1) * self.chunk_depth * self.shape[1] * self.shape[2] * self.dtype.itemsize
+        use_cache = span_bytes <= self.hot_cache_bytes // 2
+        # 只缓存降维后的切面(其余维度中有整数索引), 大小与单个切片相当; Z范围读取(如Z批量切片)不缓存
+        reduces = any(isinstance(index, (int, np.integer)) for index in rest)
+        section_key = repr((start, stop) + rest) if not use_cache and reduces else None
+        if section_key is not None:
+            with self._lock:
+                section = self._cross_sections.get(section_key)
+                if section is not None:
+                    self._cross_sections.move_to_end(section_key)
+                    return section
+
+        parts = []
+        for chunk_index in range(first, last + 1):
+            chunk = self._get_chunk(chunk_index) if use_cache else self._decode(chunk_index)
+            z0 = chunk_index * self.chunk_depth
+            lo, hi = max(start, z0) - z0, min(stop, z0 + self.chunk_depth) - z0
+            parts.append(chunk[(slice(lo, hi),) + rest])
+        result = parts[0] if len(parts) == 1 else np.concatenate(parts, axis=0)
+
+        if section_key is not None:
+            result.flags.writeable = False
+            if result.nbytes <= self.hot_cache_bytes:
+                with self._lock:
+                    if section_key not in self._cross_sections:
+                        self._cross_sections[section_key] = result
+                        self._cross_section_bytes += result.nbytes
+                    while len(self._cross_sections) > MAX_CROSS_SECTIONS or \
+                            self._cross_section_bytes > self.hot_cache_bytes:
+                        _, evicted = self._cross_sections.popitem(last=False)
+                        self._cross_section_bytes -= evicted.nbytes
+        return result
+
+    def __array__(self, dtype=None, copy=None):
+        """完整解压为numpy数组"""
+        array = np.empty(self.shape, dtype=self.dtype)
+        for chunk_index in range(len(self._chunks)):
+            z0 = chunk_index * self.chunk_depth
+            chunk = self._decode(chunk_index)
+            array[z0:z0 + chunk.shape[0]] = chunk
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """序列化时只保留压缩数据, 不包含锁和热缓存"""
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_cache'] = OrderedDict()
+        state['_cache_bytes'] = 0
+        state['_cross_sections'] = OrderedDict()
+        state['_cross_section_bytes'] = 0
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        with self._lock:
+            return {
+                'compressor': self.compressor,
+                'chunks': len(self._chunks),
+                'chunk_depth': self.chunk_depth,
+                'raw_bytes': self.raw_bytes,
+                'compressed_bytes': self.compressed_bytes,
+                'ratio': self.raw_bytes / max(1, self.compressed_bytes),
+                'hot_cache_bytes': self._cache_bytes,
+                'hot_cache_chunks': len(self._cache),
+                'cross_sections': len(self._cross_sections),
+                'cross_section_bytes': self._cross_section_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
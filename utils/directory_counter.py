@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+子目录NRRD文件计数工具
+在后台线程池中按深度/时间预算统计目录浏览器中各子目录的NRRD文件数, 结果按目录mtime缓存
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Any, List, Optional
+
+from directory_index import is_nrrd_file
+
+
+class DirectoryCounter:
+    """带预算和缓存的子目录NRRD文件计数"""
+
+    def __init__(self, max_workers: int = 4, max_depth: int = 6,
+                 time_budget: float = 2.0, max_age: float = 300.0,
+                 max_entries: int = 4096):
+        """
+        初始化
+
+        Args:
+            max_workers: 计数线程数
+            max_depth: 最多向下统计的目录层数(超出时结果标记为不完整)
+            time_budget: 单个目录的统计时间上限(秒)
+            max_age: 缓存有效期(秒); 深层目录的变化不会改变顶层mtime, 过期后重新统计
+            max_entries: 最多缓存的目录数
+        """
+        self.max_workers = max(1, int(max_workers))
+        self.max_depth = max_depth
+        self.time_budget = time_budget
+        self.max_age = max_age
+        self.max_entries = max_entries
+
+        # 目录路径 -> (mtime_ns, 统计时刻, {'count', 'complete'})
+        self._cache: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._futures: Dict[str, Future] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def request(self, paths: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        获取一组目录的计数: 缓存有效时直接返回, 否则提交后台统计
+
+        Args:
+            paths: 目录路径列表
+
+        Returns:
+            {路径: {'count', 'complete'} 或 None(统计中)}
+        """
+        results = {}
+        for path in paths:
+            result = self._lookup(path)
+            if result is None:
+                self._submit(path)
+            results[path] = result
+        return results
+
+    def _lookup(self, path: str) -> Optional[Dict[str, Any]]:
+        """查找有效的缓存结果"""
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return {'count': 0, 'complete': True}
+
+        with self._lock:
+            entry = self._cache.get(path)
+            if entry is None:
+                return None
+            if entry[0] != mtime_ns or time.monotonic() - entry[1] > self.max_age:
+                del self._cache[path]
+                return None
+            self._cache.move_to_end(path)
+            return entry[2]
+
+    def _submit(self, path: str):
+        """提交后台统计(同一目录只提交一次)"""
+        with self._lock:
+            if path in self._futures:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='dir-count')
+            self._futures[path] = self._executor.submit(self._count, path)
+
+    def _count(self, path: str):
+        """统计目录下的NRRD文件数(在线程池中运行)"""
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            result = count_nrrd_files(path, self.max_depth, self.time_budget)
+            with self._lock:
+                self._cache[path] = (mtime_ns, time.monotonic(), result)
+                self._cache.move_to_end(path)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._futures.pop(path, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        with self._lock:
+            return {'cached': len(self._cache), 'pending': len(self._futures)}
+
+
+def count_nrrd_files(directory: str, max_depth: int = 6,
+                     time_budget: float = 2.0) -> Dict[str, Any]:
+    """
+    按预算统计目录下的NRRD文件数(与DirectoryIndex一致, 不进入符号链接目录)
+
+    Args:
+        directory: 目录路径
+        max_depth: 最多向下统计的目录层数
+        time_budget: 时间上限(秒)
+
+    Returns:
+        {'count': 文件数, 'complete': 是否在预算内统计完整}
+    """
+    deadline = time.monotonic() + time_budget
+    count = 0
+    complete = True
+    stack = [(directory, 0)]
+
+    while stack:
+        if time.monotonic() > deadline:
+            complete = False
+            break
+
+        path, depth = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            if entry.is_symlink():
+                                continue
+                            if depth < max_depth:
+                                stack.append((entry.path, depth + 1))
+                            else:
+                                complete = False
+                            continue
+                    except OSError:
+                        continue
+                    if is_nrrd_file(entry.name):
+                        count += 1
+        except OSError:
+            continue
+
+    return {'count': count, 'complete': complete}
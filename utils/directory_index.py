@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+目录索引工具
+将NRRD文件及标注文件的目录结构持久化到SQLite, 刷新时只重新列出修改时间发生变化的目录
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+# 修改时间距扫描时刻过近的目录不记录mtime(同一时间粒度内的后续修改无法被察觉), 下次强制重新列出
+RACY_MTIME_NS = 2 * 1000 ** 3
+
+LABEL_SUFFIX = '_label.json'
+NRRD_SUFFIX = '.nrrd'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    subdirs TEXT NOT NULL,
+    labels TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE TABLE IF NOT EXISTS headers (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    info TEXT NOT NULL
+);
+"""
+
+
+def subtree_range(path: str) -> Tuple[str, str]:
+    """
+    获取子树内路径的字符串范围[lo, hi), 用于范围查询(避免LIKE对 % 和 _ 的转义问题)
+
+    Args:
+        path: 绝对路径
+
+    Returns:
+        (lo, hi)
+    """
+    prefix = path.rstrip(os.sep) + os.sep
+    return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+
+def is_nrrd_file(name: str) -> bool:
+    """文件名是否为NRRD文件(扩展名不区分大小写)"""
+    return name.lower().endswith(NRRD_SUFFIX)
+
+
+def has_label_file(base_name: str, labels, doctor_name: str = '') -> bool:
+    """
+    判断是否存在标注文件(优先带医生名字的, 其次通用标注文件)
+
+    Args:
+        base_name: NRRD文件名(不含扩展名)
+        labels: 同目录下标注文件名集合
+        doctor_name: 医生名字
+
+    Returns:
+        是否存在标注
+    """
+    if doctor_name and f"{base_name}_{doctor_name}{LABEL_SUFFIX}" in labels:
+        return True
+    return f"{base_name}{LABEL_SUFFIX}" in labels
+
+
+class DirectoryIndex:
+    """NRRD文件目录索引(SQLite持久化, 按目录mtime增量刷新)"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        初始化索引
+
+        Args:
+            db_path: SQLite数据库路径, None表示仅在进程内存中保存
+        """
+        self._lock = threading.Lock()
+        self._conn = None
+        self.db_path = None
+        self.last_refresh: Dict[str, Any] = {}
+        self.open(db_path)
+
+    def open(self, db_path: Optional[str] = None):
+        """切换到指定的数据库文件(不存在时创建)"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+
+            if db_path and db_path != ':memory:':
+                os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self.db_path = db_path or ':memory:'
+
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            if self.db_path != ':memory:':
+                self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+            self._conn.commit()
+
+    def refresh(self, root: str) -> Dict[str, Any]:
+        """
+        刷新目录树的索引
+
+        每个目录只stat一次; mtime未变化的目录直接复用索引中的文件列表,
+        变化的目录用os.scandir重新列出(不对文件单独stat), 已删除的目录从索引移除。
+        遍历和stat在锁外进行(网络盘上可能很慢, 不阻塞其他请求查询索引), 结果最后在一个短事务中写入
+
+        Args:
+            root: 根目录
+
+        Returns:
+            统计信息(dirs: 目录总数, rescanned: 重新列出的目录数, seconds: 耗时)
+        """
+        root = os.path.abspath(root)
+        start = time.perf_counter()
+        lo, hi = subtree_range(root)
+
+        with self._lock:
+            known = {
+                path: (mtime_ns, subdirs)
+                for path, mtime_ns, subdirs in self._conn.execute(
+                    'SELECT path, mtime_ns, subdirs FROM dirs WHERE path = ? OR (path >= ? AND path < ?)',
+                    (root, lo, hi))
+            }
+
+        seen = set()
+        scans = []
+        now_ns = time.time_ns()
+        stack = [(root, os.stat(root).st_mtime_ns)]
+
+        while stack:
+            path, mtime_ns = stack.pop()
+            seen.add(path)
+            entry = known.get(path)
+
+            if entry is not None and entry[0] == mtime_ns:
+                # 目录未变化: 子目录仍需检查(深层修改不会改变上层目录的mtime)
+                for name in json.loads(entry[1]):
+                    sub_path = os.path.join(path, name)
+                    try:
+                        stack.append((sub_path, os.stat(sub_path).st_mtime_ns))
+                    except OSError:
+                        continue
+                continue
+
+            scan = self._scan_dir(path, mtime_ns, now_ns)
+            scans.append(scan)
+            stack.extend((os.path.join(path, name), sub_mtime) for name, sub_mtime in scan[4])
+
+        # 移除已不存在的目录
+        removed = [(path,) for path in known if path not in seen]
+        with self._lock:
+            conn = self._conn
+            for path, mtime_ns, nrrd_files, labels, subdirs in scans:
+                conn.execute('DELETE FROM files WHERE dir = ?', (path,))
+                conn.executemany('INSERT OR REPLACE INTO files (path, dir, name) VALUES (?, ?, ?)',
+                                 [(os.path.join(path, name), path, name) for name in nrrd_files])
+                conn.execute('INSERT OR REPLACE INTO dirs (path, mtime_ns, subdirs, labels) VALUES (?, ?, ?, ?)',
+                             (path, mtime_ns, json.dumps([name for name, _ in subdirs]), json.dumps(labels)))
+            conn.executemany('DELETE FROM dirs WHERE path = ?', removed)
+            conn.executemany('DELETE FROM files WHERE dir = ?', removed)
+            conn.commit()
+
+        self.last_refresh = {
+            'root': root,
+            'dirs': len(seen),
+            'rescanned': len(scans),
+            'seconds': time.perf_counter() - start
+        }
+        return self.last_refresh
+
+    @staticmethod
+    def _scan_dir(path: str, mtime_ns: int,
+                  now_ns: int) -> Tuple[str, int, List[str], List[str], List[Tuple[str, int]]]:
+        """
+        重新列出单个目录(不访问索引)
+
+        Returns:
+            (目录, 记录的mtime, NRRD文件名, 标注文件名, [(子目录名, 子目录mtime)])
+        """
+        nrrd_files, labels, subdirs = [], [], []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                        # 与os.walk一致: 不进入符号链接目录
+                        if is_dir and not entry.is_symlink():
+                            subdirs.append((entry.name, entry.stat(follow_symlinks=False).st_mtime_ns))
+                    except OSError:
+                        continue
+                    if is_dir:
+                        continue
+
+                    if is_nrrd_file(entry.name):
+                        nrrd_files.append(entry.name)
+                    elif entry.name.endswith(LABEL_SUFFIX):
+                        labels.append(entry.name)
+        except OSError:
+            # 无权限等情况与os.walk一致, 视为空目录
+            pass
+
+        if now_ns - mtime_ns < RACY_MTIME_NS:
+            mtime_ns = -1
+        return path, mtime_ns, nrrd_files, labels, subdirs
+
+    def list_files(self, root: str, doctor_name: str = '') -> List[Dict[str, Any]]:
+        """
+        获取目录树下的NRRD文件及标注状态(需先refresh)
+
+        Args:
+            root: 根目录
+            doctor_name: 医生名字, 用于查找带医生名字的标注文件
+
+        Returns:
+            按路径排序的 [{'path', 'name', 'has_annotation'}]
+        """
+        root = os.path.abspath(root)
+        lo, hi = subtree_range(root)
+
+        with self._lock:
+            # 每个目录的标注文件名集合只构建一次
+            labels = {
+                path: set(json.loads(names))
+                for path, names in self._conn.execute(
+                    'SELECT path, labels FROM dirs WHERE path = ? OR (path >= ? AND path < ?)',
+                    (root, lo, hi))
+            }
+            rows = self._conn.execute(
+                'SELECT path, dir, name FROM files WHERE path >= ? AND path < ? ORDER BY path',
+                (lo, hi)).fetchall()
+
+        return [{
+            'path': path,
+            'name': name,
+            'has_annotation': has_label_file(os.path.splitext(name)[0], labels.get(dir_path, ()), doctor_name)
+        } for path, dir_path, name in rows]
+
+    def list_files_page(self, root: str, doctor_name: str = '', cursor: Optional[str] = None,
+                        limit: int = 200, status: Optional[str] = None,
+                        prefix: str = '') -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        按游标分页获取文件列表(需先refresh)
+
+        游标为上一页最后一个文件的路径, 翻页期间目录有增删也不会重复或跳过已返回的文件
+
+        Args:
+            root: 根目录
+            doctor_name: 医生名字
+            cursor: 上一页返回的游标, None表示第一页
+            limit: 每页最多文件数
+            status: 'annotated' / 'unannotated' / None(全部)
+            prefix: 文件名前缀过滤(不区分大小写)
+
+        Returns:
+            (文件列表, 下一页游标或None)
+        """
+        if status not in (None, 'annotated', 'unannotated'):
+            raise ValueError(f"未知的标注状态过滤: {status}")
+
+        root = os.path.abspath(root)
+        lo, hi = subtree_range(root)
+        limit = max(1, int(limit))
+        sql = 'SELECT path, dir, name FROM files WHERE path > ? AND path < ?'
+        params = [max(lo, cursor or ''), hi]
+        if prefix:
+            escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            sql += " AND name LIKE ? ESCAPE '\\'"
+            params.append(escaped + '%')
+        sql += ' ORDER BY path'
+
+        page = []
+        has_more = False
+        labels: Dict[str, set] = {}
+        with self._lock:
+            rows = self._conn.execute(sql, params)
+            for path, dir_path, name in rows:
+                if dir_path not in labels:
+                    row = self._conn.execute('SELECT labels FROM dirs WHERE path = ?', (dir_path,)).fetchone()
+                    labels[dir_path] = set(json.loads(row[0])) if row else set()
+                has_annotation = has_label_file(os.path.splitext(name)[0], labels[dir_path], doctor_name)
+                if status == 'annotated' and not has_annotation:
+                    continue
+                if status == 'unannotated' and has_annotation:
+                    continue
+                # 已取满一页且还有符合过滤条件的文件
+                if len(page) >= limit:
+                    has_more = True
+                    break
+                page.append({'path': path, 'name': name, 'has_annotation': has_annotation})
+            rows.close()
+
+        next_cursor = page[-1]['path'] if has_more else None
+        return page, next_cursor
+
+    def list_paths(self, root: str) -> List[str]:
+        """获取目录树下按路径排序的NRRD文件路径(需先refresh)"""
+        lo, hi = subtree_range(os.path.abspath(root))
+        with self._lock:
+            return [path for path, in self._conn.execute(
+                'SELECT path FROM files WHERE path >= ? AND path < ? ORDER BY path', (lo, hi))]
+
+    def count_files(self, root: str) -> int:
+        """获取目录树下的NRRD文件总数(需先refresh)"""
+        lo, hi = subtree_range(os.path.abspath(root))
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM files WHERE path >= ? AND path < ?',
+                                      (lo, hi)).fetchone()[0]
+
+    def get_headers(self, paths: List[str],
+                    probe: Callable[[str], Dict[str, Any]]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        获取文件头信息(尺寸、间距等), 按文件mtime和大小缓存, 未命中时调用probe读取
+
+        Args:
+            paths: NRRD文件路径列表
+            probe: 头信息读取函数, 接收文件路径返回可JSON序列化的字典
+
+        Returns:
+            {路径: 头信息, 读取失败时为None}
+        """
+        signatures = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                signatures[path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                continue
+
+        results: Dict[str, Optional[Dict[str, Any]]] = {path: None for path in paths}
+        cached = {}
+        with self._lock:
+            keys = list(signatures)
+            # SQLite单条语句的参数数量有限, 分批查询
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                cached.update({
+                    path: (mtime_ns, size, info)
+                    for path, mtime_ns, size, info in self._conn.execute(
+                        f"SELECT path, mtime_ns, size, info FROM headers WHERE path IN ({','.join('?' * len(batch))})",
+                        batch)
+                })
+
+        probed = []
+        for path, signature in signatures.items():
+            entry = cached.get(path)
+            if entry is not None and entry[:2] == signature:
+                results[path] = json.loads(entry[2])
+                continue
+            try:
+                results[path] = probe(path)
+            except Exception:
+                continue
+            probed.append((path, signature[0], signature[1], json.dumps(results[path])))
+
+        if probed:
+            with self._lock:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO headers (path, mtime_ns, size, info) VALUES (?, ?, ?, ?)', probed)
+                self._conn.commit()
+        return results
+
+    def scan(self, root: str, doctor_name: str = '') -> List[Dict[str, Any]]:
+        """刷新索引并返回文件列表"""
+        self.refresh(root)
+        return self.list_files(root, doctor_name)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取索引统计信息"""
+        with self._lock:
+            dirs = self._conn.execute('SELECT COUNT(*) FROM dirs').fetchone()[0]
+            files = self._conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+            headers = self._conn.execute('SELECT COUNT(*) FROM headers').fetchone()[0]
+        return {
+            'db_path': self.db_path,
+            'dirs': dirs,
+            'files': files,
+            'headers': headers,
+            'last_refresh': self.last_refresh
+        }
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+区间索引工具
+按起点排序的树堆(treap), 每个节点记录子树内的最大终点, 支持按Z位置(或Z区间)查找重叠的闭区间
+插入、删除期望O(log n), 查询O(log n + k)级别(k为结果数)
+"""
+import random
+from typing import Any, Iterator, List, Optional, Tuple
+
+
+class _Node:
+    """树堆节点"""
+    __slots__ = ('start', 'end', 'key', 'item', 'priority', 'max_end', 'left', 'right')
+
+    def __init__(self, start: int, end: int, key: Any, item: Any):
+        self.start = start
+        self.end = end
+        self.key = key
+        self.item = item
+        self.priority = random.random()
+        self.max_end = end
+        self.left: Optional['_Node'] = None
+        self.right: Optional['_Node'] = None
+
+    def order(self) -> Tuple[int, Any]:
+        return (self.start, self.key)
+
+    def update(self):
+        """重新计算子树最大终点"""
+        max_end = self.end
+        if self.left is not None and self.left.max_end > max_end:
+            max_end = self.left.max_end
+        if self.right is not None and self.right.max_end > max_end:
+            max_end = self.right.max_end
+        self.max_end = max_end
+
+
+def _rotate_right(node: _Node) -> _Node:
+    left = node.left
+    node.left = left.right
+    left.right = node
+    node.update()
+    left.update()
+    return left
+
+
+def _rotate_left(node: _Node) -> _Node:
+    right = node.right
+    node.right = right.left
+    right.left = node
+    node.update()
+    right.update()
+    return right
+
+
+def _insert(node: Optional[_Node], new: _Node) -> _Node:
+    if node is None:
+        return new
+    if new.order() < node.order():
+        node.left = _insert(node.left, new)
+        if node.left.priority > node.priority:
+            return _rotate_right(node)
+    else:
+        node.right = _insert(node.right, new)
+        if node.right.priority > node.priority:
+            return _rotate_left(node)
+    node.update()
+    return node
+
+
+def _merge(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    """合并两棵树(left中所有键小于right)"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        left.update()
+        return left
+    right.left = _merge(left, right.left)
+    right.update()
+    return right
+
+
+class IntervalIndex:
+    """闭区间 [start, end] 的索引, 每个区间由唯一的key标识"""
+
+    def __init__(self):
+        self._root: Optional[_Node] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def insert(self, start: int, end: int, key: Any, item: Any = None):
+        """
+        插入区间
+
+        Args:
+            start: 起点(含)
+            end: 终点(含)
+            key: 唯一标识(可比较, 起点相同时用于排序)
+            item: 查询时返回的对象, None时返回key
+        """
+        self._root = _insert(self._root, _Node(start, end, key, key if item is None else item))
+        self._size += 1
+
+    def remove(self, start: int, key: Any) -> bool:
+        """
+        删除区间
+
+        Args:
+            start: 插入时的起点
+            key: 插入时的标识
+
+        Returns:
+            是否找到并删除
+        """
+        target = (start, key)
+        parent, node = None, self._root
+        path = []
+        while node is not None and node.order() != target:
+            path.append(node)
+            parent, node = node, (node.left if target < node.order() else node.right)
+        if node is None:
+            return False
+
+        replacement = _merge(node.left, node.right)
+        if parent is None:
+            self._root = replacement
+        elif parent.left is node:
+            parent.left = replacement
+        else:
+            parent.right = replacement
+        for ancestor in reversed(path):
+            ancestor.update()
+        self._size -= 1
+        return True
+
+    def clear(self):
+        """清空索引"""
+        self._root = None
+        self._size = 0
+
+    def overlapping(self, start: int, end: int) -> List[Any]:
+        """
+        查找与 [start, end] 重叠的区间
+
+        Returns:
+            区间的item列表(按起点排序)
+        """
+        return list(self._iter_overlapping(start, end))
+
+    def stab(self, z: int) -> List[Any]:
+        """查找包含z的区间"""
+        return self.overlapping(z, z)
+
+    def _iter_overlapping(self, start: int, end: int) -> Iterator[Any]:
+        # 中序遍历, 跳过最大终点小于start的子树和起点大于end的右侧部分
+        stack = []
+        node = self._root
+        while stack or node is not None:
+            while node is not None and node.max_end >= start:
+                stack.append(node)
+                node = node.left
+            if not stack:
+                return
+            node = stack.pop()
+            if node.start > end:
+                return
+            if node.end >= start:
+                yield node.item
+            node = node.right
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+后台加载任务工具
+在线程池中执行文件加载, 报告进度, 同一会话的新任务开始时取消该会话之前的任务
+"""
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, Optional
+
+from nrrd_loader import LoadCancelled
+
+# 任务状态
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+
+class LoadJob:
+    """单个加载任务"""
+
+    def __init__(self, file_path: str, owner: Optional[str] = None):
+        self.job_id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.owner = owner
+        self.state = JOB_PENDING
+        self.stage = ''
+        self.progress = 0.0
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        # 每次状态变化递增, 供事件流判断是否有更新
+        self.version = 0
+        self._cancel_event = threading.Event()
+        self._condition = threading.Condition()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """请求取消(在下一个进度检查点生效)"""
+        self._cancel_event.set()
+        with self._condition:
+            if self.state == JOB_PENDING:
+                self._set_locked(state=JOB_CANCELLED)
+
+    def check_cancelled(self):
+        """已请求取消时抛出LoadCancelled"""
+        if self._cancel_event.is_set():
+            raise LoadCancelled(self.file_path)
+
+    def report(self, stage: str, progress: float):
+        """
+        进度回调(可直接作为NRRDLoader的progress_callback)
+
+        Args:
+            stage: 阶段名
+            progress: 0-1进度
+        """
+        self.check_cancelled()
+        with self._condition:
+            self._set_locked(stage=stage, progress=max(self.progress, min(1.0, float(progress))))
+
+    def update(self, **fields):
+        """更新任务字段并通知等待者"""
+        with self._condition:
+            self._set_locked(**fields)
+
+    def _set_locked(self, **fields):
+        for key, value in fields.items():
+            setattr(self, key, value)
+        self.version += 1
+        self._condition.notify_all()
+
+    def wait_for_update(self, version: int, timeout: float) -> int:
+        """
+        等待任务状态变化
+
+        Args:
+            version: 调用方已知的版本
+            timeout: 最长等待秒数
+
+        Returns:
+            当前版本
+        """
+        with self._condition:
+            if self.version == version and self.state not in FINISHED_STATES:
+                self._condition.wait(timeout)
+            return self.version
+
+    def to_dict(self, include_result: bool = True) -> Dict[str, Any]:
+        """序列化任务状态"""
+        with self._condition:
+            data = {
+                'job_id': self.job_id,
+                'file_path': self.file_path,
+                'state': self.state,
+                'stage': self.stage,
+                'progress': self.progress,
+                'error': self.error,
+                'version': self.version
+            }
+            if include_result and self.state == JOB_DONE:
+                data['result'] = self.result
+            return data
+
+
+class LoadJobManager:
+    """加载任务管理: 每个会话同一时间只保留一个有效任务"""
+
+    def __init__(self, max_workers: int = 2, max_jobs: int = 32):
+        """
+        初始化
+
+        Args:
+            max_workers: 线程数(被取消的任务在下一个检查点退出前可能仍占用一个线程)
+            max_jobs: 保留的历史任务数
+        """
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)),
+                                            thread_name_prefix='load-job')
+        self._jobs: 'OrderedDict[str, LoadJob]' = OrderedDict()
+        # 会话ID -> 该会话最新的任务
+        self._active: Dict[Optional[str], LoadJob] = {}
+        self._lock = threading.Lock()
+
+    def start(self, file_path: str, work: Callable[[LoadJob], Any],
+              owner: Optional[str] = None) -> LoadJob:
+        """
+        开始新任务并取消同一会话之前的任务
+
+        Args:
+            file_path: 文件路径
+            work: 任务函数, 接收LoadJob, 返回结果(可JSON序列化); 需要响应取消时在检查点
+                调用job.check_cancelled()或job.report(), 有副作用的提交应放在最后一步
+            owner: 会话ID
+
+        Returns:
+            新任务
+        """
+        job = LoadJob(file_path, owner)
+        with self._lock:
+            previous = self._active.get(owner)
+            if previous is not None:
+                previous.cancel()
+            self._active[owner] = job
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+        self._executor.submit(self._run, job, work)
+        return job
+
+    def _run(self, job: LoadJob, work: Callable[[LoadJob], Any]):
+        """执行任务(在线程池中运行)"""
+        if job.cancelled:
+            job.update(state=JOB_CANCELLED)
+            return
+
+        job.update(state=JOB_RUNNING)
+        try:
+            # work正常返回即为完成(其中已提交的修改无法撤销), 取消只在work内的检查点生效
+            result = work(job)
+            job.update(state=JOB_DONE, stage='done', progress=1.0, result=result)
+        except LoadCancelled:
+            job.update(state=JOB_CANCELLED)
+        except Exception as e:
+            job.update(state=JOB_FAILED, error=str(e))
+        finally:
+            with self._lock:
+                if self._active.get(job.owner) is job:
+                    del self._active[job.owner]
+
+    def get(self, job_id: str) -> Optional[LoadJob]:
+        """按ID获取任务"""
+        with self._lock:
+            return self._jobs.get(job_id)
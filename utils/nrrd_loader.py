@@ -4,27 +4,256 @@ NRRD数据加载工具
 用于加载和处理CPR NRRD格式的医学影像数据
 """
 import os
+import re
 import sys
+import json
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
 import numpy as np
 import SimpleITK as sitk
-from typing import Tuple, Dict, Any
+from typing import Callable, Tuple, Dict, Any, Optional
 import base64
-from io import BytesIO
-from PIL import Image
 import tempfile
 import shutil
 
+from slice_codecs import parse_codec_spec
+from compressed_volume import CompressedVolume
+
+
+# 标准化结果缓存(sidecar)的格式版本, 格式或标准化算法变化时递增
+SIDECAR_VERSION = 3
+# 未指定sidecar目录时, 在数据文件旁创建的缓存目录名
+DEFAULT_SIDECAR_DIRNAME = '.cpr_cache'
+
+# 强度标准化方式: histogram(原始数据类型上基于直方图, 低内存), percentile(转float32后排序)
+NORMALIZATION_MODES = ('histogram', 'percentile')
+# 分块处理时每块的体素数
+NORMALIZE_CHUNK_VOXELS = 4 * 1024 * 1024
+# 整数数据直接bincount的最大取值范围, 超出时按浮点数据处理
+MAX_BINCOUNT_RANGE = 1 << 24
+# 浮点数据估计百分位时的直方图分箱数
+FLOAT_HISTOGRAM_BINS = 65536
+
+# 常用CT窗宽窗位预设 (窗宽, 窗位), 单位HU
+WINDOW_PRESETS = {
+    'soft_tissue': (400, 40),
+    'angio': (700, 200),
+    'calcium': (1500, 400),
+    'bone': (2000, 500)
+}
+# 每个体数据缓存的窗宽窗位查找表数量和渲染切片数量
+MAX_WINDOW_LUTS = 16
+MAX_RENDERED_SLICES = 256
+# 切片金字塔: 第L层为原分辨率按 2^L × 2^L 块平均降采样, 最多缓存的降采样切片数
+MAX_PYRAMID_LEVEL = 4
+MAX_PYRAMID_SLICES = 512
+# 视口裁剪渲染的最大输出边长(像素)
+MAX_VIEWPORT_SIZE = 4096
+
+
+def _write_atomically(path: str, mode: str, write: Callable[[Any], None]):
+    """
+    写入临时文件后重命名替换目标文件, 失败时删除临时文件
+
+    临时文件名每次写入唯一(同一进程中预取线程和请求线程可能同时写同一个sidecar)
+
+    Args:
+        path: 目标文件
+        mode: 打开模式('wb' / 'w')
+        write: 接收文件对象的写入函数
+    """
+    temp_file = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(temp_file, mode, encoding=None if 'b' in mode else 'utf-8') as f:
+            write(f)
+        os.replace(temp_file, path)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
+class LoadCancelled(Exception):
+    """加载被取消(由进度回调抛出)"""
+
+
+def _iter_z_chunks(shape: Tuple[int, ...], chunk_voxels: int = NORMALIZE_CHUNK_VOXELS):
+    """按Z轴分块, 生成(z_start, z_end)"""
+    nz = shape[0]
+    slice_voxels = max(1, int(np.prod(shape[1:])))
+    step = max(1, chunk_voxels // slice_voxels)
+    for z0 in range(0, nz, step):
+        yield z0, min(nz, z0 + step)
+
+
+def _rank_values(counts: np.ndarray, ranks: np.ndarray) -> np.ndarray:
+    """根据直方图计数求排序后第rank个元素所在的分箱下标"""
+    cumulative = np.cumsum(counts)
+    return np.searchsorted(cumulative, ranks, side='right')
+
+
+def histogram_percentiles(volume: np.ndarray, percentiles) -> Tuple[float, ...]:
+    """
+    基于直方图计算百分位数, 不复制或排序整个体数据
+
+    整数数据使用bincount, 结果与np.percentile(线性插值)完全一致;
+    浮点数据使用固定分箱直方图估计, 误差不超过一个分箱宽度
+
+    Args:
+        volume: 任意数据类型的体数据
+        percentiles: 百分位列表(0-100)
+
+    Returns:
+        与percentiles对应的数值
+    """
+    n = volume.size
+    gmin = volume.min()
+    gmax = volume.max()
+    positions = np.asarray(percentiles, dtype=np.float64) / 100.0 * (n - 1)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, n - 1)
+    frac = positions - lower
+
+    is_integer = np.issubdtype(volume.dtype, np.integer) or volume.dtype == np.bool_
+    if is_integer and int(gmax) - int(gmin) < MAX_BINCOUNT_RANGE:
+        gmin = int(gmin)
+        counts = np.zeros(int(gmax) - gmin + 1, dtype=np.int64)
+        for z0, z1 in _iter_z_chunks(volume.shape):
+            chunk = volume[z0:z1].ravel().astype(np.int64) - gmin
+            counts += np.bincount(chunk, minlength=counts.size)
+
+        lo_values = _rank_values(counts, lower) + gmin
+        hi_values = _rank_values(counts, upper) + gmin
+        return tuple(float(lo + f * (hi - lo))
+                     for lo, hi, f in zip(lo_values, hi_values, frac))
+
+    # 浮点数据(或取值范围过大的整数): 固定分箱直方图, 在分箱内线性插值
+    gmin = float(gmin)
+    gmax = float(gmax)
+    if gmax <= gmin:
+        return tuple(gmin for _ in positions)
+
+    counts = np.zeros(FLOAT_HISTOGRAM_BINS, dtype=np.int64)
+    for z0, z1 in _iter_z_chunks(volume.shape):
+        chunk_counts, _ = np.histogram(volume[z0:z1], bins=FLOAT_HISTOGRAM_BINS,
+                                       range=(gmin, gmax))
+        counts += chunk_counts
+
+    bin_width = (gmax - gmin) / FLOAT_HISTOGRAM_BINS
+    cumulative = np.cumsum(counts)
+    bins = np.searchsorted(cumulative, positions, side='right')
+    bins = np.minimum(bins, FLOAT_HISTOGRAM_BINS - 1)
+    before = np.where(bins > 0, cumulative[bins - 1], 0)
+    within = (positions - before + 0.5) / np.maximum(counts[bins], 1)
+    return tuple(float(gmin + (b + min(max(w, 0.0), 1.0)) * bin_width)
+                 for b, w in zip(bins, within))
+
+
+def downsample_block_mean(data: np.ndarray, factor: int) -> np.ndarray:
+    """
+    按 factor × factor 块平均降采样2D uint8图像(边缘不足一块时复制边缘像素补齐)
+
+    Args:
+        data: 2D uint8数组
+        factor: 降采样倍数
+
+    Returns:
+        尺寸为 ceil(H / factor) × ceil(W / factor) 的uint8数组
+    """
+    if factor <= 1:
+        return data
+
+    height, width = data.shape
+    pad_h, pad_w = (-height) % factor, (-width) % factor
+    if pad_h or pad_w:
+        data = np.pad(data, ((0, pad_h), (0, pad_w)), mode='edge')
+
+    blocks = data.reshape(data.shape[0] // factor, factor, data.shape[1] // factor, factor)
+    total = blocks.sum(axis=(1, 3), dtype=np.uint32)
+    area = factor * factor
+    return ((total + area // 2) // area).astype(np.uint8)
+
+
+def crop_resample(data: np.ndarray, region: Tuple[float, float, float, float],
+                  width: int, height: int, fill: int = 0) -> np.ndarray:
+    """
+    裁剪2D图像的矩形区域并最近邻重采样到指定尺寸(区域超出图像的部分填充fill)
+
+    Args:
+        data: 2D数组
+        region: 区域 (x0, y0, x1, y1), 图像像素坐标, x1/y1不包含
+        width: 输出宽度
+        height: 输出高度
+        fill: 图像外的填充值
+
+    Returns:
+        height × width 数组
+    """
+    x0, y0, x1, y1 = region
+    src_h, src_w = data.shape
+    # 输出像素中心对应的源像素
+    xs = np.floor(x0 + (np.arange(width) + 0.5) * ((x1 - x0) / width)).astype(np.intp)
+    ys = np.floor(y0 + (np.arange(height) + 0.5) * ((y1 - y0) / height)).astype(np.intp)
+    inside_x = (xs >= 0) & (xs < src_w)
+    inside_y = (ys >= 0) & (ys < src_h)
+
+    result = data[np.clip(ys, 0, src_h - 1)[:, None], np.clip(xs, 0, src_w - 1)[None, :]]
+    if not inside_x.all():
+        result[:, ~inside_x] = fill
+    if not inside_y.all():
+        result[~inside_y, :] = fill
+    return result
+
+
+def quick_file_hash(file_path: str, block_size: int = 65536) -> str:
+    """
+    计算文件的快速指纹(文件大小 + 首尾数据块的SHA1)
+
+    Args:
+        file_path: 文件路径
+        block_size: 首尾各读取的字节数
+
+    Returns:
+        十六进制指纹字符串
+    """
+    size = os.path.getsize(file_path)
+    sha1 = hashlib.sha1(str(size).encode())
+    with open(file_path, 'rb') as f:
+        sha1.update(f.read(block_size))
+        if size > block_size:
+            f.seek(max(block_size, size - block_size))
+            sha1.update(f.read(block_size))
+    return sha1.hexdigest()
+
 
 class NRRDLoader:
     """NRRD文件加载和处理类"""
 
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, use_sidecar: bool = False,
+                 sidecar_dir: Optional[str] = None,
+                 normalization: str = 'histogram',
+                 keep_raw: bool = False,
+                 eager_cpr: bool = False,
+                 compression: Optional[str] = None,
+                 progress_callback: Optional[Callable[[str, float], None]] = None):
         """
         初始化NRRD加载器
 
         Args:
             file_path: NRRD文件路径
+            use_sidecar: 是否使用标准化结果缓存文件(sidecar), 再次打开时直接mmap映射
+            sidecar_dir: sidecar存放目录, 默认为数据文件旁的 .cpr_cache 目录
+            normalization: 强度标准化方式, 'histogram'(默认, 低内存) 或 'percentile'
+            keep_raw: 是否保留原始数据类型的体数据(HU), 用于服务端窗宽窗位渲染
+            eager_cpr: 加载后立即构建连续存储、已旋转的X/Y视图堆叠
+            compression: 常驻内存体数据的压缩方式('auto' / 'zlib' / 'lz4'), None表示不压缩
+            progress_callback: 进度回调, 接收(阶段, 0-1进度); 回调抛出LoadCancelled可中止加载
         """
+        if normalization not in NORMALIZATION_MODES:
+            raise ValueError(f"未知的标准化方式: {normalization}")
+
         self.file_path = file_path
         self.volume = None
         self.spacing = None
@@ -32,10 +261,58 @@ class NRRDLoader:
         self.direction = None
         self.metadata = {}
         self.shape = None
+        self.from_sidecar = False
         self._temp_file = None  # 用于存储临时文件路径
 
-        self._load_data()
-        self._determine_orientation()
+        # 原始数据(HU)及其取值范围
+        self.raw_volume = None
+        self.raw_range = None
+        self.keep_raw = keep_raw
+
+        # 窗宽窗位查找表和渲染结果缓存
+        self._window_luts: 'OrderedDict[Tuple[int, int], np.ndarray]' = OrderedDict()
+        self._rendered_slices: 'OrderedDict[Tuple[str, int, int, int], np.ndarray]' = OrderedDict()
+        self._render_lock = threading.Lock()
+
+        # 降采样切片缓存: (轴, 索引, 金字塔层级, 窗宽窗位) -> uint8数组
+        self._pyramid_slices: 'OrderedDict[tuple, np.ndarray]' = OrderedDict()
+
+        # 预先构建的X/Y视图堆叠: axis -> (N, H, W), 第i层即旋转后的第i个切片
+        self._cpr_stacks: Dict[str, np.ndarray] = {}
+
+        self.use_sidecar = use_sidecar
+        self.sidecar_dir = sidecar_dir
+        self.normalization = normalization
+        self._progress_callback = progress_callback
+
+        # 体数据指纹: 同一文件同一版本同一标准化方式得到相同ID, 用于可缓存的切片URL
+        self.volume_id = self._compute_volume_id()
+
+        if self.use_sidecar and self._load_sidecar():
+            self.from_sidecar = True
+        else:
+            self._load_data()
+            self._determine_orientation()
+
+            if self.use_sidecar:
+                self._report_progress('sidecar', 0.9)
+                self._write_sidecar()
+
+        if eager_cpr:
+            self._report_progress('cpr', 0.95)
+            self.build_cpr_stacks()
+
+        if compression:
+            self._report_progress('compress', 0.97)
+            self.compress_volumes(compression)
+
+        # 加载完成后不再持有回调(loader可能被长期缓存)
+        self._progress_callback = None
+
+    def _report_progress(self, stage: str, fraction: float):
+        """报告加载进度(回调可抛出LoadCancelled中止加载)"""
+        if self._progress_callback is not None:
+            self._progress_callback(stage, fraction)
 
     def __del__(self):
         """析构函数,清理临时文件"""
@@ -45,6 +322,36 @@ class NRRDLoader:
             except:
                 pass
 
+    def __getstate__(self) -> Dict[str, Any]:
+        """序列化(用于在加载进程和服务进程之间传递): 不包含锁、渲染缓存、回调和临时文件"""
+        state = self.__dict__.copy()
+        for name in ('_render_lock', '_progress_callback'):
+            state.pop(name, None)
+        state['_window_luts'] = OrderedDict()
+        state['_rendered_slices'] = OrderedDict()
+        state['_pyramid_slices'] = OrderedDict()
+        # 临时文件由创建它的进程清理
+        state['_temp_file'] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._render_lock = threading.Lock()
+        self._progress_callback = None
+
+    def map_arrays(self, fn: Callable[[Any], Any]):
+        """
+        对体数据数组(标准化数据、原始数据、X/Y视图堆叠)逐个应用fn并替换, 用于放入或取出共享内存
+
+        Args:
+            fn: 接收数组返回替换对象的函数
+        """
+        if self.volume is not None:
+            self.volume = fn(self.volume)
+        if self.raw_volume is not None:
+            self.raw_volume = fn(self.raw_volume)
+        self._cpr_stacks = {axis: fn(stack) for axis, stack in self._cpr_stacks.items()}
+
     def _has_non_ascii(self, path: str) -> bool:
         """检查路径是否包含非ASCII字符(如中文)"""
         try:
@@ -83,10 +390,16 @@ class NRRDLoader:
             read_path = normalized_path
 
         # 使用SimpleITK读取NRRD
+        self._report_progress('read', 0.0)
         img = sitk.ReadImage(read_path)
+        self._report_progress('normalize', 0.4)
 
-        # 获取数据数组 (Z, Y, X)
-        self.volume = sitk.GetArrayFromImage(img).astype(np.float32)
+        # 获取数据数组 (Z, Y, X), 保持原始数据类型
+        self.volume = sitk.GetArrayFromImage(img)
+        if self.keep_raw:
+            # 标准化不会原地修改, 原始数组可直接保留
+            self.raw_volume = self.volume
+            self.raw_range = (self.volume.min().item(), self.volume.max().item())
 
         # 获取spacing (Z, Y, X)
         self.spacing = np.array(img.GetSpacing()[::-1])
@@ -105,12 +418,168 @@ class NRRDLoader:
         self._normalize_intensity()
 
     def _normalize_intensity(self):
-        """将intensity标准化到0-255范围"""
+        """将intensity标准化到0-255范围(1%-99%百分位截断)"""
+        if self.normalization == 'percentile':
+            self._normalize_intensity_percentile()
+        else:
+            self._normalize_intensity_histogram()
+
+    def _normalize_intensity_percentile(self):
+        """转为float32后用np.percentile排序计算(峰值内存为体数据的数倍)"""
+        self.volume = self.volume.astype(np.float32)
         vmin = np.percentile(self.volume, 1)
         vmax = np.percentile(self.volume, 99)
         self.volume = np.clip(self.volume, vmin, vmax)
         self.volume = ((self.volume - vmin) / (vmax - vmin + 1e-8) * 255).astype(np.uint8)
 
+    def _normalize_intensity_histogram(self):
+        """
+        在原始数据类型上标准化: 直方图计算百分位(O(n)), 按Z分块写出uint8
+
+        整数数据通过查找表映射, 峰值内存约为输入大小 + 输出大小
+        """
+        source = self.volume
+        # 与percentile方式相同的运算顺序和精度(float32, 先除后乘), 保证输出逐体素一致
+        vmin, vmax = histogram_percentiles(source, (1, 99))
+        vmin = np.float32(vmin)
+        vmax = np.float32(vmax)
+        denominator = vmax - vmin + 1e-8
+
+        output = np.empty(source.shape, dtype=np.uint8)
+        gmin = source.min()
+        gmax = source.max()
+        is_integer = np.issubdtype(source.dtype, np.integer) or source.dtype == np.bool_
+
+        if is_integer and int(gmax) - int(gmin) < MAX_BINCOUNT_RANGE:
+            # 查找表: 每个可能的原始值对应一个uint8输出
+            gmin = int(gmin)
+            values = np.arange(gmin, int(gmax) + 1, dtype=np.float32)
+            lut = ((np.clip(values, vmin, vmax) - vmin) / denominator * 255).astype(np.uint8)
+            for z0, z1 in _iter_z_chunks(source.shape):
+                index = source[z0:z1].astype(np.int64) - gmin
+                np.take(lut, index, out=output[z0:z1])
+                self._report_progress('normalize', 0.4 + 0.5 * z1 / source.shape[0])
+        else:
+            for z0, z1 in _iter_z_chunks(source.shape):
+                chunk = np.clip(source[z0:z1].astype(np.float32), vmin, vmax)
+                chunk -= vmin
+                chunk /= denominator
+                chunk *= 255
+                output[z0:z1] = chunk.astype(np.uint8)
+                self._report_progress('normalize', 0.4 + 0.5 * z1 / source.shape[0])
+
+        self.volume = output
+
+    def _sidecar_paths(self) -> Tuple[str, str, str]:
+        """获取sidecar的标准化数据、原始数据和元数据文件路径"""
+        abs_path = os.path.abspath(self.file_path)
+        cache_dir = self.sidecar_dir or os.path.join(os.path.dirname(abs_path),
+                                                     DEFAULT_SIDECAR_DIRNAME)
+        base_name = os.path.splitext(os.path.basename(abs_path))[0]
+        # 加入完整路径的哈希, 避免共享目录中同名文件冲突
+        path_hash = hashlib.sha1(abs_path.encode('utf-8')).hexdigest()[:12]
+        stem = os.path.join(cache_dir, f"{base_name}_{path_hash}")
+        return f"{stem}.u8.npy", f"{stem}.raw.npy", f"{stem}.meta.json"
+
+    def _source_signature(self) -> Dict[str, Any]:
+        """获取源文件签名, 用于判断sidecar是否失效"""
+        stat = os.stat(self.file_path)
+        return {
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'hash': quick_file_hash(self.file_path)
+        }
+
+    def _compute_volume_id(self) -> str:
+        """
+        计算体数据指纹(绝对路径 + mtime + 大小 + 标准化方式)
+
+        Returns:
+            16位十六进制字符串
+        """
+        stat = os.stat(self.file_path)
+        key = f"{os.path.abspath(self.file_path)}|{stat.st_mtime_ns}|{stat.st_size}|{self.normalization}"
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+    def _load_sidecar(self) -> bool:
+        """
+        从sidecar以只读mmap方式加载标准化后的体数据
+
+        Returns:
+            是否成功加载(不存在或已失效时返回False)
+        """
+        data_path, raw_path, meta_path = self._sidecar_paths()
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return False
+        if self.keep_raw and not os.path.exists(raw_path):
+            return False
+
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+
+            # 源文件的mtime或内容指纹变化时失效
+            if meta.get('version') != SIDECAR_VERSION or \
+               meta.get('normalization') != self.normalization or \
+               meta.get('source') != self._source_signature():
+                return False
+
+            # 只读映射, 按需换页, 多个进程共享操作系统页缓存
+            volume = np.load(data_path, mmap_mode='r')
+            if list(volume.shape) != meta['shape'] or volume.dtype != np.uint8:
+                return False
+
+            raw_volume = None
+            if self.keep_raw:
+                raw_volume = np.load(raw_path, mmap_mode='r')
+                if raw_volume.shape != volume.shape:
+                    return False
+        except Exception as e:
+            print(f"读取sidecar失败, 将重新加载: {e}")
+            return False
+
+        self.volume = volume
+        self.shape = volume.shape
+        self.spacing = np.array(meta['spacing'])
+        self.origin = tuple(meta['origin'])
+        self.direction = tuple(meta['direction'])
+        self.metadata = meta.get('metadata', {})
+        if raw_volume is not None:
+            self.raw_volume = raw_volume
+            self.raw_range = tuple(meta['raw_range'])
+
+        self._determine_orientation()
+        self.need_rotate = bool(meta['need_rotate'])
+        return True
+
+    def _write_sidecar(self):
+        """将标准化后的体数据和元数据写入sidecar(先写临时文件再原子替换)"""
+        data_path, raw_path, meta_path = self._sidecar_paths()
+        try:
+            os.makedirs(os.path.dirname(data_path), exist_ok=True)
+
+            meta = {
+                'version': SIDECAR_VERSION,
+                'normalization': self.normalization,
+                'source': self._source_signature(),
+                'shape': list(self.shape),
+                'spacing': [float(v) for v in self.spacing],
+                'origin': [float(v) for v in self.origin],
+                'direction': [float(v) for v in self.direction],
+                'need_rotate': bool(self.need_rotate),
+                'raw_range': list(self.raw_range) if self.raw_range else None,
+                'metadata': self.metadata
+            }
+
+            # 元数据最后写入, 作为sidecar完整可用的标志
+            _write_atomically(data_path, 'wb', lambda f: np.save(f, np.ascontiguousarray(self.volume)))
+            if self.raw_volume is not None:
+                _write_atomically(raw_path, 'wb', lambda f: np.save(f, np.ascontiguousarray(self.raw_volume)))
+            _write_atomically(meta_path, 'w', lambda f: json.dump(meta, f, ensure_ascii=False))
+        except Exception as e:
+            # 数据目录可能只读, sidecar写入失败不影响正常使用
+            print(f"写入sidecar失败: {e}")
+
     def _determine_orientation(self):
         """确定XYZ轴方向,并将长边竖直放置"""
         nz, ny, nx = self.shape
@@ -129,6 +598,53 @@ class NRRDLoader:
         self.center_x = nx // 2
         self.center_y = ny // 2
 
+    @property
+    def nbytes(self) -> int:
+        """常驻内存的体数据字节数(用于缓存预算)"""
+        total = int(self.volume.nbytes) if self.volume is not None else 0
+        if self.raw_volume is not None:
+            total += int(self.raw_volume.nbytes)
+        for stack in self._cpr_stacks.values():
+            total += int(stack.nbytes)
+        return total
+
+    def compress_volumes(self, compressor: str = 'auto'):
+        """
+        将常驻内存的体数据(标准化数据和原始HU数据)转为按Z分块压缩的存储
+
+        sidecar映射的数据由操作系统按需换页, 不占常驻内存, 保持不变; 已构建的X/Y视图堆叠也不压缩
+
+        Args:
+            compressor: 压缩方式, 'auto' / 'zlib' / 'lz4'
+        """
+        if isinstance(self.volume, np.ndarray) and not isinstance(self.volume, np.memmap):
+            self.volume = CompressedVolume(self.volume, compressor)
+        if isinstance(self.raw_volume, np.ndarray) and not isinstance(self.raw_volume, np.memmap):
+            self.raw_volume = CompressedVolume(self.raw_volume, compressor)
+
+    def volume_store_stats(self) -> Dict[str, Any]:
+        """体数据存储方式及压缩统计"""
+        stats = {}
+        for name, volume in (('volume', self.volume), ('raw_volume', self.raw_volume)):
+            if isinstance(volume, CompressedVolume):
+                stats[name] = volume.stats()
+            elif volume is not None:
+                stats[name] = {'compressor': None, 'mmap': isinstance(volume, np.memmap),
+                               'raw_bytes': int(volume.nbytes)}
+        return stats
+
+    def build_cpr_stacks(self):
+        """
+        构建X/Y视图堆叠: 一次性完成跨步收集和旋转, 之后每个X/Y切片都是连续内存
+
+        X堆叠形状为(X, Z, Y), Y堆叠为(Y, Z, X); 需要旋转时为旋转后的形状
+        """
+        for axis, source_axis in (('x', 2), ('y', 1)):
+            stack = np.moveaxis(self.volume, source_axis, 0)
+            if self.need_rotate:
+                stack = np.rot90(stack, k=-1, axes=(1, 2))  # 每层顺时针旋转90度
+            self._cpr_stacks[axis] = np.ascontiguousarray(stack)
+
     def get_slice(self, axis: str, index: int) -> np.ndarray:
         """
         获取指定轴向的切片
@@ -140,15 +656,19 @@ class NRRDLoader:
         Returns:
             2D numpy array
         """
+        return self._take_slice(self.volume, axis, index)
+
+    def _take_slice(self, volume: np.ndarray, axis: str, index: int) -> np.ndarray:
+        """从指定体数据中取出切片"""
         if axis == 'x':
             # X轴切面: 固定X坐标,得到(Z, Y)
-            slice_data = self.volume[:, :, index]  # (Z, Y)
+            slice_data = volume[:, :, index]  # (Z, Y)
         elif axis == 'y':
             # Y轴切面: 固定Y坐标,得到(Z, X)
-            slice_data = self.volume[:, index, :]  # (Z, X)
+            slice_data = volume[:, index, :]  # (Z, X)
         elif axis == 'z':
             # Z轴切面: 固定Z坐标,得到(Y, X)
-            slice_data = self.volume[index, :, :]  # (Y, X)
+            slice_data = volume[index, :, :]  # (Y, X)
         else:
             raise ValueError(f"未知的axis: {axis}")
 
@@ -165,37 +685,243 @@ class NRRDLoader:
         Returns:
             2D numpy array
         """
-        slice_data = self.get_slice(axis, index)
+        # 已构建堆叠时直接返回连续存储的切片
+        stack = self._cpr_stacks.get(axis)
+        if stack is not None:
+            return stack[index]
+
+        return self._rotate_slice(self.get_slice(axis, index), axis)
 
-        # 对于X和Y轴视图,如果需要旋转
+    def _rotate_slice(self, slice_data: np.ndarray, axis: str) -> np.ndarray:
+        """对于X和Y轴视图,如果需要则顺时针旋转90度"""
         if self.need_rotate and axis in ['x', 'y']:
             slice_data = np.rot90(slice_data, k=-1)  # 顺时针旋转90度
 
         return slice_data
 
-    def slice_to_base64(self, slice_data: np.ndarray) -> str:
+    @property
+    def has_raw(self) -> bool:
+        """是否保留了原始数据(可进行服务端窗宽窗位渲染)"""
+        return self.raw_volume is not None
+
+    def _get_window_lut(self, window: int, level: int) -> np.ndarray:
+        """
+        获取窗宽窗位查找表(覆盖原始数据的整数取值范围), 按(窗宽, 窗位)缓存
+
+        Args:
+            window: 窗宽
+            level: 窗位
+
+        Returns:
+            uint8查找表, 下标为 原始值 - raw_range[0]
+        """
+        key = (window, level)
+        with self._render_lock:
+            lut = self._window_luts.get(key)
+            if lut is not None:
+                self._window_luts.move_to_end(key)
+                return lut
+
+        gmin, gmax = int(self.raw_range[0]), int(self.raw_range[1])
+        values = np.arange(gmin, gmax + 1, dtype=np.float32)
+        lut = self._window_values(values, window, level)
+
+        with self._render_lock:
+            self._window_luts[key] = lut
+            while len(self._window_luts) > MAX_WINDOW_LUTS:
+                self._window_luts.popitem(last=False)
+        return lut
+
+    @staticmethod
+    def _window_values(values: np.ndarray, window: int, level: int) -> np.ndarray:
+        """对数值应用窗宽窗位, 线性映射到0-255"""
+        low = level - window / 2.0
+        scale = 255.0 / max(window, 1)
+        mapped = (values.astype(np.float32) - np.float32(low)) * np.float32(scale)
+        return np.clip(np.rint(mapped), 0, 255).astype(np.uint8)
+
+    def apply_window(self, raw_data: np.ndarray, window: int, level: int) -> np.ndarray:
+        """
+        对原始数据(切片或切片堆叠)应用窗宽窗位
+
+        Args:
+            raw_data: 原始数据类型的数组
+            window: 窗宽
+            level: 窗位
+
+        Returns:
+            相同形状的uint8数组
+        """
+        is_integer = np.issubdtype(raw_data.dtype, np.integer)
+        if is_integer and int(self.raw_range[1]) - int(self.raw_range[0]) < MAX_BINCOUNT_RANGE:
+            lut = self._get_window_lut(window, level)
+            return lut[raw_data.astype(np.int64) - int(self.raw_range[0])]
+        return self._window_values(raw_data, window, level)
+
+    def render_slice_windowed(self, axis: str, index: int, window: int, level: int) -> np.ndarray:
+        """
+        在原始HU数据上按窗宽窗位渲染切片, 结果按(轴, 索引, 窗宽, 窗位)缓存
+
+        Args:
+            axis: 'x', 'y', 或 'z'
+            index: 切片索引
+            window: 窗宽(HU)
+            level: 窗位(HU)
+
+        Returns:
+            已旋转的2D uint8数组
+        """
+        if not self.has_raw:
+            raise ValueError("未保留原始数据, 无法进行窗宽窗位渲染")
+
+        window = max(1, int(round(window)))
+        level = int(round(level))
+        key = (axis, index, window, level)
+        with self._render_lock:
+            rendered = self._rendered_slices.get(key)
+            if rendered is not None:
+                self._rendered_slices.move_to_end(key)
+                return rendered
+
+        raw_slice = self._rotate_slice(self._take_slice(self.raw_volume, axis, index), axis)
+        rendered = self.apply_window(raw_slice, window, level)
+
+        with self._render_lock:
+            self._rendered_slices[key] = rendered
+            while len(self._rendered_slices) > MAX_RENDERED_SLICES:
+                self._rendered_slices.popitem(last=False)
+        return rendered
+
+    def get_display_slice(self, axis: str, index: int, pyramid_level: int = 0,
+                          window_level: Optional[Tuple[float, float]] = None) -> np.ndarray:
+        """
+        获取用于显示的切片: 可选窗宽窗位渲染, 可选金字塔层级(块平均降采样, 用于快速预览)
+
+        Args:
+            axis: 'x', 'y', 或 'z'
+            index: 切片索引(原分辨率)
+            pyramid_level: 金字塔层级, 0为原分辨率, 第L层每边缩小 2^L 倍
+            window_level: (窗宽, 窗位), None表示使用标准化后的数据
+
+        Returns:
+            已旋转的2D uint8数组
+        """
+        pyramid_level = max(0, min(int(pyramid_level), MAX_PYRAMID_LEVEL))
+        if window_level is not None:
+            window_level = (max(1, int(round(window_level[0]))), int(round(window_level[1])))
+
+        def full_slice():
+            if window_level is not None:
+                return self.render_slice_windowed(axis, index, *window_level)
+            return self.get_slice_with_rotation(axis, index)
+
+        if pyramid_level == 0:
+            return full_slice()
+
+        key = (axis, index, pyramid_level, window_level)
+        with self._render_lock:
+            cached = self._pyramid_slices.get(key)
+            if cached is not None:
+                self._pyramid_slices.move_to_end(key)
+                return cached
+
+        base = full_slice()
+        # 降采样后每边至少保留1个像素
+        factor = min(2 ** pyramid_level, max(base.shape))
+        result = downsample_block_mean(np.asarray(base), factor)
+
+        with self._render_lock:
+            self._pyramid_slices[key] = result
+            while len(self._pyramid_slices) > MAX_PYRAMID_SLICES:
+                self._pyramid_slices.popitem(last=False)
+        return result
+
+    def get_viewport_slice(self, axis: str, index: int, region: Tuple[float, float, float, float],
+                           width: int, height: int,
+                           window_level: Optional[Tuple[float, float]] = None) -> np.ndarray:
+        """
+        获取切片中可见区域(视口)按输出尺寸重采样后的图像, 用于放大显示
+
+        区域缩小显示(每个输出像素覆盖多个源像素)时先取对应的金字塔层级再采样
+
+        Args:
+            axis: 'x', 'y', 或 'z'
+            index: 切片索引
+            region: 可见区域 (x0, y0, x1, y1), 原分辨率切片(已旋转)的像素坐标, 可超出切片范围
+            width: 输出宽度
+            height: 输出高度
+            window_level: (窗宽, 窗位), None表示使用标准化后的数据
+
+        Returns:
+            height × width 的uint8数组, 切片外的部分为0
+        """
+        x0, y0, x1, y1 = (float(v) for v in region)
+        if not (x1 > x0 and y1 > y0):
+            raise ValueError(f"无效的视口区域: {region}")
+        if not (1 <= width <= MAX_VIEWPORT_SIZE and 1 <= height <= MAX_VIEWPORT_SIZE):
+            raise ValueError(f"视口输出尺寸超出范围(1-{MAX_VIEWPORT_SIZE}): {width}x{height}")
+
+        full_height, full_width = geometry_info(self.shape, self.spacing)['slice_shapes'][axis]
+        ratio = min((x1 - x0) / width, (y1 - y0) / height)
+        pyramid_level = min(int(np.log2(ratio)), MAX_PYRAMID_LEVEL) if ratio >= 2 else 0
+
+        base = self.get_display_slice(axis, index, pyramid_level, window_level)
+        # 与get_display_slice中的降采样倍数一致
+        factor = min(2 ** pyramid_level, max(full_height, full_width)) if pyramid_level else 1
+        return crop_resample(np.asarray(base), (x0 / factor, y0 / factor, x1 / factor, y1 / factor),
+                             width, height)
+
+    def render_z_slab_windowed(self, z_start: int, z_end: int, window: int, level: int) -> np.ndarray:
+        """
+        在原始HU数据上按窗宽窗位渲染一段连续的Z轴切片
+
+        Args:
+            z_start: 起始Z索引(包含)
+            z_end: 结束Z索引(不包含)
+            window: 窗宽(HU)
+            level: 窗位(HU)
+
+        Returns:
+            3D uint8数组 (z_end - z_start, Y, X)
+        """
+        if not self.has_raw:
+            raise ValueError("未保留原始数据, 无法进行窗宽窗位渲染")
+
+        window = max(1, int(round(window)))
+        return self.apply_window(self.raw_volume[z_start:z_end], window, int(round(level)))
+
+    def slice_to_base64(self, slice_data: np.ndarray, codec: str = 'png') -> str:
         """
-        将切片数据转换为base64编码的PNG图像
+        将切片数据转换为base64编码的图像(data URL)
 
         Args:
             slice_data: 2D numpy array
+            codec: 图像编码器描述, 如 'png'、'png:1'、'webp'
 
         Returns:
             base64编码的图像字符串
         """
-        # 确保数据是uint8
-        if slice_data.dtype != np.uint8:
-            slice_data = slice_data.astype(np.uint8)
+        slice_codec, level = parse_codec_spec(codec)
+        if not slice_codec.is_image:
+            raise ValueError(f"编码器 {slice_codec.name} 不是图像格式, 无法生成data URL")
 
-        # 创建PIL图像
-        img = Image.fromarray(slice_data, mode='L')
+        # 编码并转换为base64
+        img_str = base64.b64encode(slice_codec.encode(slice_data, level)).decode()
 
-        # 转换为PNG并编码为base64
-        buffer = BytesIO()
-        img.save(buffer, format='PNG')
-        img_str = base64.b64encode(buffer.getvalue()).decode()
+        return f"data:{slice_codec.mimetype};base64,{img_str}"
 
-        return f"data:image/png;base64,{img_str}"
+    def get_z_slab(self, z_start: int, z_end: int) -> np.ndarray:
+        """
+        获取一段连续的Z轴切片(Z轴视图不旋转)
+
+        Args:
+            z_start: 起始Z索引(包含)
+            z_end: 结束Z索引(不包含)
+
+        Returns:
+            3D numpy array (z_end - z_start, Y, X)
+        """
+        return self.volume[z_start:z_end, :, :]
 
     def get_info(self) -> Dict[str, Any]:
         """
@@ -204,33 +930,16 @@ class NRRDLoader:
         Returns:
             包含数据集信息的字典
         """
-        nz, ny, nx = self.shape
-        sz, sy, sx = self.spacing
-
-        return {
+        info = geometry_info(self.shape, self.spacing)
+        info.update({
             'filename': os.path.basename(self.file_path),
-            'shape': {
-                'z': int(nz),
-                'y': int(ny),
-                'x': int(nx)
-            },
-            'spacing': {
-                'z': float(sz),
-                'y': float(sy),
-                'x': float(sx)
-            },
-            'center': {
-                'x': int(self.center_x),
-                'y': int(self.center_y),
-                'z': int(nz // 2)
-            },
-            'need_rotate': bool(self.need_rotate),
-            'physical_size': {
-                'z': float(nz * sz),
-                'y': float(ny * sy),
-                'x': float(nx * sx)
-            }
-        }
+            'volume_id': self.volume_id,
+            'has_raw': self.has_raw,
+            'raw_range': [float(v) for v in self.raw_range] if self.raw_range else None,
+            'window_presets': {name: {'window': w, 'level': l}
+                               for name, (w, l) in WINDOW_PRESETS.items()}
+        })
+        return info
 
     def get_z_slice_range(self, z_start: int, z_end: int) -> Tuple[int, int]:
         """
@@ -253,24 +962,100 @@ class NRRDLoader:
         return z_start, z_end
 
 
-def scan_nrrd_files(directory: str) -> list:
+def geometry_info(shape, spacing) -> Dict[str, Any]:
+    """
+    根据体数据形状和间距计算显示相关的几何信息(与NRRDLoader的方向约定一致)
+
+    Args:
+        shape: (Z, Y, X)
+        spacing: (Z, Y, X)
+
+    Returns:
+        包含 shape / spacing / center / need_rotate / slice_shapes / physical_size 的字典
+    """
+    nz, ny, nx = (int(v) for v in shape)
+    sz, sy, sx = (float(v) for v in spacing)
+    # X > Y 时X/Y视图顺时针旋转90度, 让长边竖直
+    need_rotate = nx > ny
+
+    return {
+        'shape': {'z': nz, 'y': ny, 'x': nx},
+        'spacing': {'z': sz, 'y': sy, 'x': sx},
+        'center': {'x': nx // 2, 'y': ny // 2, 'z': nz // 2},
+        'need_rotate': need_rotate,
+        # 各轴视图(旋转后)的切片尺寸 [高, 宽]
+        'slice_shapes': {
+            'x': [ny, nz] if need_rotate else [nz, ny],
+            'y': [nx, nz] if need_rotate else [nz, nx],
+            'z': [ny, nx]
+        },
+        'physical_size': {'z': nz * sz, 'y': ny * sy, 'x': nx * sx}
+    }
+
+
+def _parse_nrrd_text_header(file_path: str, max_bytes: int = 65536) -> Tuple[Tuple[int, ...], Tuple[float, ...], str]:
+    """
+    解析NRRD文本头(读到第一个空行为止)
+
+    Returns:
+        ((X, Y, Z)尺寸, (X, Y, Z)间距, 数据类型)
     """
-    扫描目录中的所有NRRD文件
+    fields = {}
+    with open(file_path, 'rb') as f:
+        magic = f.readline()
+        if not magic.startswith(b'NRRD'):
+            raise ValueError(f"不是NRRD文件: {file_path}")
+        while f.tell() < max_bytes:
+            line = f.readline().decode('latin-1').strip()
+            if not line:
+                break
+            if line.startswith('#') or ':' not in line:
+                continue
+            key, _, value = line.partition(':')
+            fields[key.strip().lower()] = value.lstrip('=').strip()
+
+    sizes = tuple(int(v) for v in fields['sizes'].split())
+    if 'space directions' in fields:
+        # 每个轴一个方向向量(非空间轴为none), 间距为向量长度
+        vectors = re.findall(r'none|\([^)]*\)', fields['space directions'])
+        spacing = tuple(
+            1.0 if v == 'none' else float(np.linalg.norm([float(c) for c in v.strip('()').split(',')]))
+            for v in vectors
+        )
+    elif 'spacings' in fields:
+        spacing = tuple(float(v) if v.lower() != 'nan' else 1.0 for v in fields['spacings'].split())
+    else:
+        spacing = (1.0,) * len(sizes)
+    return sizes, spacing, fields.get('type', '')
+
+
+def probe_nrrd_header(file_path: str) -> Dict[str, Any]:
+    """
+    只读取NRRD文件头获取尺寸和间距, 不读取体素数据
 
     Args:
-        directory: 目录路径
+        file_path: NRRD文件路径
 
     Returns:
-        NRRD文件路径列表
+        geometry_info 的结果, 另含 pixel_type
     """
-    if not os.path.exists(directory):
-        return []
+    normalized_path = os.path.abspath(file_path)
+
+    if os.name == 'nt' and not normalized_path.isascii():
+        # SimpleITK在Windows上无法处理Unicode路径, 直接解析文本头(避免复制整个文件)
+        size, spacing, pixel_type = _parse_nrrd_text_header(normalized_path)
+    else:
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(normalized_path.replace('\\', '/') if os.name == 'nt' else normalized_path)
+        reader.ReadImageInformation()
+        size = reader.GetSize()
+        spacing = reader.GetSpacing()
+        pixel_type = sitk.GetPixelIDValueAsString(reader.GetPixelID())
 
-    nrrd_files = []
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith('.nrrd'):
-                full_path = os.path.join(root, file)
-                nrrd_files.append(full_path)
+    if len(size) != 3:
+        raise ValueError(f"不支持的维度: {len(size)}")
 
-    return sorted(nrrd_files)
+    # SimpleITK为(X, Y, Z)顺序, 体数据数组为(Z, Y, X)
+    info = geometry_info(size[::-1], spacing[::-1])
+    info['pixel_type'] = pixel_type
+    return info
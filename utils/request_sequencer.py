@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+请求序号管理工具
+记录每个客户端每个通道最新的请求序号, 用于跳过已被新请求取代的切片编码工作
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+
+class RequestTicket:
+    """单个请求的序号凭据"""
+
+    def __init__(self, key: Optional[Tuple[str, str]], seq: int):
+        self.key = key
+        self.seq = seq
+
+
+class RequestSequencer:
+    """按(客户端, 通道)记录最新请求, 判断旧请求是否已过期"""
+
+    def __init__(self, max_clients: int = 1024):
+        """
+        初始化
+
+        Args:
+            max_clients: 最多记录的(客户端, 通道)数量, 超出时淘汰最久未活动的
+        """
+        self.max_clients = max_clients
+        # (client_id, channel) -> (最新序号, 有效窗口[lo, hi) 或 None)
+        self._latest: 'OrderedDict[Tuple[str, str], Tuple[int, Optional[Tuple[int, int]]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.skipped = 0
+
+    def register(self, client_id: Optional[str], channel: str, seq: Any,
+                 window: Optional[Tuple[int, int]] = None) -> RequestTicket:
+        """
+        登记一个请求
+
+        Args:
+            client_id: 客户端ID, 为空时不做过期判断
+            channel: 通道名, 如 'slice-z'、'slab'
+            seq: 客户端递增的请求序号
+            window: 可选的有效范围[lo, hi), 新请求登记后旧请求只要位置仍在窗口内就不算过期
+
+        Returns:
+            请求凭据
+        """
+        if not client_id or seq is None:
+            return RequestTicket(None, 0)
+
+        key = (str(client_id), channel)
+        seq = int(seq)
+        with self._lock:
+            latest = self._latest.get(key)
+            if latest is None or seq >= latest[0]:
+                self._latest[key] = (seq, tuple(window) if window else None)
+            self._latest.move_to_end(key)
+            while len(self._latest) > self.max_clients:
+                self._latest.popitem(last=False)
+        return RequestTicket(key, seq)
+
+    def is_stale(self, ticket: RequestTicket, position: Optional[int] = None) -> bool:
+        """
+        判断请求是否已被同一客户端同一通道的新请求取代
+
+        Args:
+            ticket: register返回的凭据
+            position: 请求位置(如slab起始Z), 配合窗口判断
+
+        Returns:
+            是否过期(过期时调用方应跳过编码直接返回)
+        """
+        if ticket.key is None:
+            return False
+
+        with self._lock:
+            latest = self._latest.get(ticket.key)
+            if latest is None or latest[0] <= ticket.seq:
+                return False
+
+            seq, window = latest
+            if window is not None and position is not None and \
+               window[0] <= position < window[1]:
+                return False
+
+            self.skipped += 1
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        with self._lock:
+            return {'tracked': len(self._latest), 'skipped': self.skipped}
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+共享内存体数据加载工具
+在独立的加载进程中读取和标准化NRRD文件(不占用服务进程的GIL), 体数据数组写入
+multiprocessing.shared_memory 后只传回段名, 服务进程直接映射使用, 不复制数据
+
+段的生命周期: 加载进程创建并写入后关闭自己的映射; 服务进程映射后由loader持有,
+loader被回收(被缓存淘汰且没有会话在使用)时删除段名, 映射随最后一个数组视图释放;
+进程异常退出时由multiprocessing的resource_tracker删除遗留的段
+
+从sidecar只读映射(np.memmap)的数组不复制到共享内存, 只传回文件位置由服务进程重新映射,
+继续共享操作系统页缓存
+"""
+import os
+import mmap
+import uuid
+import threading
+import weakref
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Any, List, Optional
+
+import numpy as np
+
+from nrrd_loader import NRRDLoader, LoadCancelled
+
+# 共享内存段名前缀
+SEGMENT_PREFIX = 'cpr_'
+# 等待加载进程时检查取消请求的间隔(秒)
+CANCEL_POLL_INTERVAL = 0.2
+
+
+class SharedArrayRef:
+    """共享内存中数组的引用(可序列化, 在进程间传递)"""
+
+    def __init__(self, name: str, shape, dtype: str):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = dtype
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+
+class MappedArrayRef:
+    """只读映射文件中数组的引用(可序列化, 服务进程按文件位置重新映射)"""
+
+    def __init__(self, filename: str, offset: int, shape, dtype: str, fortran_order: bool):
+        self.filename = filename
+        self.offset = offset
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.fortran_order = fortran_order
+
+    def open(self) -> np.memmap:
+        """以只读方式重新映射"""
+        return np.memmap(self.filename, dtype=np.dtype(self.dtype), mode='r', offset=self.offset,
+                         shape=self.shape, order='F' if self.fortran_order else 'C')
+
+
+def _mapped_ref(array: np.ndarray) -> Optional[MappedArrayRef]:
+    """整块映射文件的只读memmap返回其引用, 其他数组(包括memmap的切片视图)返回None"""
+    if not isinstance(array, np.memmap) or array.filename is None or array.flags.writeable:
+        return None
+    if not (array.flags.c_contiguous or array.flags.f_contiguous):
+        return None
+    if not isinstance(array.base, mmap.mmap):
+        return None
+    fortran_order = array.flags.f_contiguous and not array.flags.c_contiguous
+    return MappedArrayRef(array.filename, array.offset, array.shape, array.dtype.str, fortran_order)
+
+
+class _AttachedSegment(shared_memory.SharedMemory):
+    """
+    服务进程映射的段: 映射由数组视图持有, 对象回收时不主动关闭(否则与仍存活的视图冲突);
+    映射建立后即关闭文件描述符(映射不依赖它), 否则每个段都会占用一个描述符直到进程退出
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name=name)
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __del__(self):
+        pass
+
+
+def _publish_array(array: Any, created: List[str]) -> Any:
+    """将numpy数组复制到新的共享内存段, 返回引用(只读映射文件的数组返回文件引用, 其他类型原样返回)"""
+    if not isinstance(array, np.ndarray) or array.size == 0:
+        return array
+    mapped = _mapped_ref(array)
+    if mapped is not None:
+        return mapped
+
+    segment = shared_memory.SharedMemory(
+        create=True, size=array.nbytes, name=f"{SEGMENT_PREFIX}{uuid.uuid4().hex[:20]}")
+    created.append(segment.name)
+    target = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)
+    target[...] = array
+    del target
+    segment.close()
+    return SharedArrayRef(segment.name, array.shape, array.dtype.str)
+
+
+def _unlink(names: List[str]):
+    """删除共享内存段(段已不存在时忽略)"""
+    for name in names:
+        try:
+            segment = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+        segment.close()
+        segment.unlink()
+
+
+def load_and_publish(file_path: str, loader_kwargs: Dict[str, Any]) -> NRRDLoader:
+    """
+    加载文件并把体数据数组放入共享内存(在加载进程中运行)
+
+    Args:
+        file_path: NRRD文件路径
+        loader_kwargs: NRRDLoader的其他参数
+
+    Returns:
+        数组已替换为SharedArrayRef的loader(随后被序列化传回服务进程)
+    """
+    created: List[str] = []
+    try:
+        loader = NRRDLoader(file_path, **loader_kwargs)
+        loader.map_arrays(lambda array: _publish_array(array, created))
+        return loader
+    except BaseException:
+        _unlink(created)
+        raise
+
+
+class SharedVolumeLoader:
+    """在进程池中加载体数据, 通过共享内存交给服务进程"""
+
+    def __init__(self, max_workers: int = 2):
+        """
+        初始化
+
+        Args:
+            max_workers: 加载进程数
+        """
+        self.max_workers = max(1, int(max_workers))
+        # spawn方式启动: 服务进程有多个线程, fork不安全; 与Windows行为一致
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        # 当前映射中的段: 段名 -> 字节数
+        self._segments: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.discarded = 0
+
+    def load(self, file_path: str, loader_kwargs: Dict[str, Any],
+             progress_callback: Optional[Callable[[str, float], None]] = None) -> NRRDLoader:
+        """
+        在加载进程中加载文件, 返回映射共享内存的loader
+
+        加载进程内的进度无法逐块回传, 只报告开始和完成; 等待期间progress_callback抛出
+        LoadCancelled时立即返回, 加载进程完成后其共享内存段被删除
+
+        Args:
+            file_path: NRRD文件路径
+            loader_kwargs: NRRDLoader的其他参数(不含progress_callback)
+            progress_callback: 进度回调
+
+        Returns:
+            NRRDLoader
+        """
+        future = self._executor.submit(load_and_publish, file_path, loader_kwargs)
+        try:
+            while True:
+                if progress_callback is not None:
+                    progress_callback('read', 0.05)
+                try:
+                    loader = future.result(timeout=CANCEL_POLL_INTERVAL)
+                    break
+                except FutureTimeoutError:
+                    continue
+        except LoadCancelled:
+            future.add_done_callback(self._discard)
+            raise
+
+        loader = self.attach(loader)
+        with self._lock:
+            self.loads += 1
+        return loader
+
+    def attach(self, loader: NRRDLoader) -> NRRDLoader:
+        """映射loader引用的共享内存段, 并在loader被回收时删除这些段"""
+        segments: List[_AttachedSegment] = []
+
+        def resolve(ref):
+            if isinstance(ref, MappedArrayRef):
+                return ref.open()
+            if not isinstance(ref, SharedArrayRef):
+                return ref
+            segment = _AttachedSegment(name=ref.name)
+            segments.append(segment)
+            array = np.ndarray(ref.shape, dtype=np.dtype(ref.dtype), buffer=segment.buf)
+            array.flags.writeable = False
+            return array
+
+        try:
+            loader.map_arrays(resolve)
+        except BaseException:
+            self._release_segments(segments)
+            raise
+
+        with self._lock:
+            for segment in segments:
+                self._segments[segment.name] = segment.size
+        weakref.finalize(loader, self._release_segments, segments)
+        return loader
+
+    def _release_segments(self, segments: List[_AttachedSegment]):
+        """删除段名(已映射的数组在最后一个视图释放后解除映射)"""
+        for segment in segments:
+            with self._lock:
+                self._segments.pop(segment.name, None)
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _discard(self, future: Future):
+        """已取消的加载完成后删除其共享内存段"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        names = []
+        future.result().map_arrays(
+            lambda ref: names.append(ref.name) if isinstance(ref, SharedArrayRef) else None)
+        _unlink(names)
+        with self._lock:
+            self.discarded += 1
+
+    def shutdown(self):
+        """关闭加载进程池"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'loads': self.loads,
+                'discarded': self.discarded,
+                'segments': len(self._segments),
+                'shared_bytes': sum(self._segments.values())
+            }
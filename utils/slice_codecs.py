@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+切片编码工具
+提供可插拔的切片编码器(PNG/WebP无损/原始字节/zlib/lz4), 可按部署或按请求选择
+"""
+import zlib
+from io import BytesIO
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from PIL import Image, features
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+class SliceCodec:
+    """切片编码器"""
+
+    def __init__(self, name: str, mimetype: str,
+                 encoder: Callable[[np.ndarray, Optional[int]], bytes],
+                 default_level: Optional[int] = None,
+                 description: str = ''):
+        """
+        初始化编码器
+
+        Args:
+            name: 编码器名称
+            mimetype: 编码结果的MIME类型
+            encoder: 编码函数, 接收(uint8切片, 压缩级别)返回字节
+            default_level: 默认压缩级别(无级别概念时为None)
+            description: 说明
+        """
+        self.name = name
+        self.mimetype = mimetype
+        self.encoder = encoder
+        self.default_level = default_level
+        self.description = description
+
+    @property
+    def is_image(self) -> bool:
+        """编码结果是否为浏览器可直接显示的图像"""
+        return self.mimetype.startswith('image/')
+
+    def encode(self, slice_data: np.ndarray, level: Optional[int] = None) -> bytes:
+        """
+        编码切片
+
+        Args:
+            slice_data: 2D numpy array
+            level: 压缩级别, None时使用默认级别
+
+        Returns:
+            编码后的字节
+        """
+        slice_data = np.ascontiguousarray(slice_data, dtype=np.uint8)
+        return self.encoder(slice_data, self.default_level if level is None else level)
+
+
+_CODECS: Dict[str, SliceCodec] = {}
+
+
+def register_codec(codec: SliceCodec):
+    """注册编码器(同名覆盖)"""
+    _CODECS[codec.name] = codec
+
+
+def available_codecs() -> List[str]:
+    """获取当前环境可用的编码器名称"""
+    return list(_CODECS)
+
+
+def parse_codec_spec(spec: str):
+    """
+    解析编码器描述, 格式为 "名称" 或 "名称:压缩级别", 如 "png:1"
+
+    Returns:
+        (SliceCodec, 压缩级别或None)
+    """
+    name, _, level = (spec or '').partition(':')
+    codec = _CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"未知或不可用的编码器: {spec} (可用: {', '.join(available_codecs())})")
+    return codec, (int(level) if level else None)
+
+
+def _encode_png(slice_data: np.ndarray, level: Optional[int]) -> bytes:
+    buffer = BytesIO()
+    Image.fromarray(slice_data, mode='L').save(buffer, format='PNG', compress_level=level)
+    return buffer.getvalue()
+
+
+def _encode_webp(slice_data: np.ndarray, level: Optional[int]) -> bytes:
+    # 无损模式下quality表示压缩力度(0最快, 100最小)
+    buffer = BytesIO()
+    Image.fromarray(slice_data, mode='L').save(buffer, format='WEBP', lossless=True,
+                                               quality=level, method=0 if level < 50 else 4)
+    return buffer.getvalue()
+
+
+def _encode_raw(slice_data: np.ndarray, level: Optional[int]) -> bytes:
+    return slice_data.tobytes()
+
+
+def _encode_zlib(slice_data: np.ndarray, level: Optional[int]) -> bytes:
+    return zlib.compress(slice_data.tobytes(), level)
+
+
+def _encode_lz4(slice_data: np.ndarray, level: Optional[int]) -> bytes:
+    return lz4_frame.compress(slice_data.tobytes(), compression_level=level)
+
+
+register_codec(SliceCodec('png', 'image/png', _encode_png, default_level=6,
+                          description='PNG, 压缩级别0-9 (PIL默认6)'))
+register_codec(SliceCodec('raw', 'application/octet-stream', _encode_raw,
+                          description='原始uint8字节, 无压缩'))
+register_codec(SliceCodec('zlib', 'application/octet-stream', _encode_zlib, default_level=1,
+                          description='原始字节 + zlib(deflate), 压缩级别0-9'))
+
+if features.check('webp'):
+    register_codec(SliceCodec('webp', 'image/webp', _encode_webp, default_level=0,
+                              description='无损WebP, 压缩力度0-100'))
+
+if lz4_frame is not None:
+    register_codec(SliceCodec('lz4', 'application/octet-stream', _encode_lz4, default_level=0,
+                              description='原始字节 + LZ4 frame'))
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+体数据缓存工具
+按内存预算(字节)缓存最近加载的NRRDLoader,避免切换文件时重复读取和标准化;
+正在被会话使用的体数据按引用计数固定在缓存中, 多个会话打开同一文件时共享同一份数据
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Optional, Tuple
+
+# 等待其他调用加载同一文件时检查取消请求的间隔(秒)
+CANCEL_POLL_INTERVAL = 0.2
+
+
+def get_file_signature(file_path: str) -> Tuple[str, int, int]:
+    """
+    获取文件签名(绝对路径 + mtime + 大小),用作缓存键
+
+    Args:
+        file_path: 文件路径
+
+    Returns:
+        (绝对路径, mtime纳秒, 文件大小)
+    """
+    stat = os.stat(file_path)
+    return (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+
+class VolumeCache:
+    """基于字节预算的LRU体数据缓存(兼作会话间共享的体数据池)"""
+
+    def __init__(self, max_bytes: int):
+        """
+        初始化缓存
+
+        Args:
+            max_bytes: 缓存可占用的最大字节数, 0表示禁用缓存
+        """
+        self.max_bytes = max(0, int(max_bytes))
+        self.current_bytes = 0
+        # 绝对路径 -> (文件签名, loader, 字节数), 按最近使用排序
+        self._entries: 'OrderedDict[str, Tuple[Tuple[str, int, int], Any, int]]' = OrderedDict()
+        # 绝对路径 -> 引用计数; 计数大于0的条目不会被淘汰(可超出预算)
+        self._refs: Dict[str, int] = {}
+        # 正在加载的文件: 绝对路径 -> 完成事件, 同一文件只加载一次
+        self._loading: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+        # 统计计数, 用于评估预算大小
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def resize(self, max_bytes: int):
+        """调整内存预算,超出部分立即淘汰"""
+        with self._lock:
+            self.max_bytes = max(0, int(max_bytes))
+            self._evict_locked()
+
+    def get(self, file_path: str) -> Optional[Any]:
+        """
+        获取缓存的loader
+
+        Args:
+            file_path: NRRD文件路径
+
+        Returns:
+            命中时返回loader, 否则返回None
+        """
+        signature = get_file_signature(file_path)
+        with self._lock:
+            entry = self._entries.get(signature[0])
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # 文件已被修改, 旧数据失效
+            if entry[0] != signature:
+                self._drop_locked(signature[0])
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(signature[0])
+            self.hits += 1
+            return entry[1]
+
+    def contains(self, file_path: str) -> bool:
+        """检查文件是否已在缓存中(不影响统计和LRU顺序)"""
+        try:
+            signature = get_file_signature(file_path)
+        except OSError:
+            return False
+        with self._lock:
+            entry = self._entries.get(signature[0])
+            return entry is not None and entry[0] == signature
+
+    def find_by_id(self, volume_id: str) -> Optional[Any]:
+        """
+        按体数据指纹查找缓存的loader(不影响统计和LRU顺序)
+
+        Args:
+            volume_id: loader.volume_id
+
+        Returns:
+            找到时返回loader, 否则返回None
+        """
+        with self._lock:
+            for _, loader, _ in self._entries.values():
+                if getattr(loader, 'volume_id', None) == volume_id:
+                    return loader
+        return None
+
+    def put(self, file_path: str, loader: Any) -> bool:
+        """
+        放入缓存
+
+        Args:
+            file_path: NRRD文件路径
+            loader: 已加载的NRRDLoader
+
+        Returns:
+            是否被缓存(单个体数据超出预算或该文件正在通过acquire加载时不缓存)
+        """
+        signature = get_file_signature(file_path)
+        nbytes = int(loader.nbytes)
+
+        with self._lock:
+            # 正在加载的文件由acquire放入, 避免被覆盖后其引用计数丢失
+            if signature[0] in self._loading:
+                return False
+            # 正在被会话使用的条目不替换
+            if self._refs.get(signature[0]):
+                return self._entries[signature[0]][0] == signature
+            if signature[0] in self._entries:
+                self._drop_locked(signature[0])
+
+            if nbytes > self.max_bytes:
+                return False
+
+            self._entries[signature[0]] = (signature, loader, nbytes)
+            self.current_bytes += nbytes
+            self._evict_locked()
+            return True
+
+    def acquire(self, file_path: str, loader_factory: Callable[[str], Any],
+                progress_callback: Optional[Callable[[str, float], None]] = None) -> Any:
+        """
+        获取体数据并增加引用计数(使用完毕后调用release)
+
+        未命中时调用loader_factory加载; 其他会话正在加载同一文件时等待其完成后共享结果,
+        对方加载失败或被取消时由当前调用重新加载
+
+        Args:
+            file_path: NRRD文件路径
+            loader_factory: 加载函数, 接收文件路径返回loader
+            progress_callback: 等待其他调用加载时定期调用, 抛出LoadCancelled等异常时停止等待
+
+        Returns:
+            loader
+        """
+        while True:
+            signature = get_file_signature(file_path)
+            path = signature[0]
+            with self._lock:
+                entry = self._entries.get(path)
+                if entry is not None and entry[0] != signature:
+                    self._drop_locked(path)
+                    self.invalidations += 1
+                    entry = None
+                if entry is not None:
+                    self._entries.move_to_end(path)
+                    self._refs[path] = self._refs.get(path, 0) + 1
+                    self.hits += 1
+                    return entry[1]
+
+                pending = self._loading.get(path)
+                if pending is None:
+                    pending = self._loading[path] = threading.Event()
+                    self.misses += 1
+                    break
+
+            if progress_callback is None:
+                pending.wait()
+            else:
+                while not pending.wait(CANCEL_POLL_INTERVAL):
+                    progress_callback('read', 0.0)
+
+        try:
+            loader = loader_factory(file_path)
+            with self._lock:
+                entry = self._entries.get(path)
+                if entry is not None and entry[0] == signature:
+                    # 加载期间已有相同版本的条目: 共享该条目, 不替换(否则其引用计数丢失)
+                    self._entries.move_to_end(path)
+                    self._refs[path] = self._refs.get(path, 0) + 1
+                    return entry[1]
+                if entry is not None:
+                    self._drop_locked(path)
+                self._entries[path] = (signature, loader, int(loader.nbytes))
+                self.current_bytes += int(loader.nbytes)
+                self._refs[path] = 1
+                self._evict_locked()
+            return loader
+        finally:
+            with self._lock:
+                self._loading.pop(path).set()
+
+    def release(self, loader: Any):
+        """
+        减少体数据的引用计数, 计数归零后作为普通缓存条目参与LRU淘汰
+
+        Args:
+            loader: acquire返回的loader(已被新版本替换的旧loader直接忽略)
+        """
+        with self._lock:
+            for path, entry in self._entries.items():
+                if entry[1] is loader:
+                    break
+            else:
+                return
+
+            refs = self._refs.get(path, 0) - 1
+            if refs > 0:
+                self._refs[path] = refs
+            else:
+                self._refs.pop(path, None)
+                self._evict_locked()
+
+    def clear(self):
+        """清空未被使用的缓存条目"""
+        with self._lock:
+            for path in [path for path in self._entries if not self._refs.get(path)]:
+                self._drop_locked(path)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': (self.hits / total) if total else 0.0,
+                'files': [os.path.basename(path) for path in self._entries],
+                'pinned': {os.path.basename(path): refs for path, refs in self._refs.items()},
+                'loading': len(self._loading)
+            }
+
+    def _drop_locked(self, path: str):
+        """移除条目(调用方需持有锁; 持有旧loader的会话不受影响, 之后的release会被忽略)"""
+        _, _, nbytes = self._entries.pop(path)
+        self._refs.pop(path, None)
+        self.current_bytes -= nbytes
+
+    def _evict_locked(self):
+        """淘汰最久未使用且未被引用的条目直到满足预算(调用方需持有锁)"""
+        for path in list(self._entries):
+            if self.current_bytes <= self.max_bytes:
+                break
+            if self._refs.get(path):
+                continue
+            self._drop_locked(path)
+            self.evictions += 1
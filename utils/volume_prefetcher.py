@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+体数据预取工具
+在后台线程中提前加载文件列表中当前文件前后相邻的NRRD文件(每个会话有各自的文件列表)
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Any, List, Optional
+
+from nrrd_loader import LoadCancelled
+from volume_cache import CANCEL_POLL_INTERVAL
+
+
+class _PrefetchTask:
+    """单个预取任务: 取消标志在下一个进度回调时检查, 最近的进度供等待该任务的请求转报"""
+
+    def __init__(self):
+        self.future: Optional[Future] = None
+        self.cancel_event = threading.Event()
+        self.stage = 'read'
+        self.progress = 0.0
+
+
+class VolumePrefetcher:
+    """按文件列表顺序预取相邻体数据"""
+
+    def __init__(self, cache, loader_factory: Callable[[str, Callable[[str, float], None]], Any],
+                 radius: int = 1, max_workers: int = 1):
+        """
+        初始化预取器
+
+        Args:
+            cache: VolumeCache实例, 预取通过其acquire加载(与请求共用同一次加载), 结果留在该缓存
+            loader_factory: 加载函数, 接收文件路径和进度回调返回loader(回调抛出LoadCancelled时中止加载)
+            radius: 预取当前文件前后各多少个文件, 0表示禁用
+            max_workers: 同时进行的最大预取数
+        """
+        self.cache = cache
+        self.loader_factory = loader_factory
+        self.radius = max(0, int(radius))
+        self.max_workers = max(1, int(max_workers))
+
+        # 会话ID -> 有序文件列表 / 路径到序号的映射 / 当前预取目标
+        self._file_lists: Dict[Optional[str], List[str]] = {}
+        self._file_indexes: Dict[Optional[str], Dict[str, int]] = {}
+        self._targets: Dict[Optional[str], set] = {}
+        # 路径 -> 预取任务
+        self._futures: Dict[str, _PrefetchTask] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+        # 统计计数
+        self.submitted = 0
+        self.cancelled = 0
+        self.used = 0
+
+    def configure(self, radius: int, max_workers: int):
+        """调整预取范围和并发数(重建线程池)"""
+        with self._lock:
+            self._cancel_locked(set())
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            self.radius = max(0, int(radius))
+            self.max_workers = max(1, int(max_workers))
+
+    def set_file_list(self, file_list: List[str], owner: Optional[str] = None):
+        """
+        设置会话当前扫描到的文件列表, 并取消该会话不再需要的预取
+
+        Args:
+            file_list: 有序的NRRD文件路径列表
+            owner: 会话ID
+        """
+        paths = [os.path.abspath(f) for f in file_list]
+        with self._lock:
+            self._file_lists[owner] = paths
+            self._file_indexes[owner] = {path: i for i, path in enumerate(paths)}
+            self._targets.pop(owner, None)
+            self._cancel_locked(self._all_targets_locked())
+
+    def forget(self, owner: Optional[str]):
+        """移除会话的文件列表并取消其不再需要的预取"""
+        with self._lock:
+            self._file_lists.pop(owner, None)
+            self._file_indexes.pop(owner, None)
+            self._targets.pop(owner, None)
+            self._cancel_locked(self._all_targets_locked())
+
+    def prefetch_around(self, file_path: str, owner: Optional[str] = None):
+        """
+        预取指定文件前后的相邻文件, 该会话不再相邻(且其他会话也不需要)的预取任务会被取消
+
+        Args:
+            file_path: 当前打开的文件路径
+            owner: 会话ID
+        """
+        if self.radius == 0:
+            return
+
+        path = os.path.abspath(file_path)
+        with self._lock:
+            file_list = self._file_lists.get(owner, [])
+            index = self._file_indexes.get(owner, {}).get(path)
+            if index is None:
+                return
+
+            # 按距离由近到远排列, 优先下一个文件
+            targets = []
+            for offset in range(1, self.radius + 1):
+                for i in (index + offset, index - offset):
+                    if 0 <= i < len(file_list):
+                        targets.append(file_list[i])
+
+            # 读者跳到别处时, 取消不再需要的预取
+            self._targets[owner] = set(targets)
+            self._cancel_locked(self._all_targets_locked())
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='prefetch')
+
+            for target in targets:
+                if target in self._futures or self.cache.contains(target):
+                    continue
+                task = _PrefetchTask()
+                task.future = self._executor.submit(self._load, target, task)
+                self._futures[target] = task
+                self.submitted += 1
+
+    def take(self, file_path: str,
+             progress_callback: Optional[Callable[[str, float], None]] = None) -> Optional[Any]:
+        """
+        获取已经在预取的文件, 如果仍在加载则等待其完成
+
+        等待期间定期把预取的进度转报给progress_callback; 回调抛出LoadCancelled时停止等待并向上抛出,
+        预取本身继续进行, 完成后结果仍留在缓存中
+
+        Args:
+            file_path: 文件路径
+            progress_callback: 调用方的进度回调
+
+        Returns:
+            预取得到的loader, 没有对应预取任务或预取失败时返回None
+        """
+        path = os.path.abspath(file_path)
+        with self._lock:
+            task = self._futures.pop(path, None)
+
+        if task is None or task.future.cancelled():
+            return None
+
+        while True:
+            if progress_callback is not None:
+                progress_callback(task.stage, task.progress)
+            try:
+                loader = task.future.result(timeout=CANCEL_POLL_INTERVAL)
+                break
+            except FutureTimeoutError:
+                continue
+            except Exception as e:
+                print(f"预取失败: {path}: {e}")
+                return None
+
+        if loader is not None:
+            self.used += 1
+        return loader
+
+    def stats(self) -> Dict[str, Any]:
+        """获取预取统计信息"""
+        with self._lock:
+            return {
+                'sessions': len(self._file_lists),
+                'radius': self.radius,
+                'max_workers': self.max_workers,
+                'pending': sum(1 for task in self._futures.values() if not task.future.done()),
+                'submitted': self.submitted,
+                'cancelled': self.cancelled,
+                'used': self.used
+            }
+
+    def _load(self, path: str, task: _PrefetchTask) -> Optional[Any]:
+        """后台加载文件并放入缓存(取消标志被设置时在下一个进度检查点中止)"""
+        def check_cancelled(stage: str, progress: float):
+            if task.cancel_event.is_set():
+                raise LoadCancelled(path)
+            task.stage, task.progress = stage, progress
+
+        if not os.path.exists(path):
+            return None
+        try:
+            loader = self.cache.acquire(path, lambda p: self.loader_factory(p, check_cancelled))
+        except LoadCancelled:
+            with self._lock:
+                self.cancelled += 1
+            return None
+        # 不固定: 作为普通缓存条目参与LRU淘汰
+        self.cache.release(loader)
+        return loader
+
+    def _all_targets_locked(self) -> set:
+        """所有会话的预取目标(调用方需持有锁)"""
+        return set().union(*self._targets.values())
+
+    def _cancel_locked(self, keep: set):
+        """取消不在keep中的预取任务(调用方需持有锁)"""
+        for path in list(self._futures):
+            if path in keep:
+                continue
+            task = self._futures.pop(path)
+            if task.future.cancel():
+                self.cancelled += 1
+            else:
+                # 已经开始的任务在下一个进度回调时中止(加载已完成时结果仍会进入缓存)
+                task.cancel_event.set()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+会话工作区工具
+每个阅片会话(浏览器cookie)拥有独立的医生、数据目录、当前文件和标注状态,
+体数据从共享的体数据池(VolumeCache)按引用计数获取, 多名医生打开同一文件时只占用一份内存;
+标注管理器同样按标注文件共享(AnnotationRegistry), 同一标注文件只有一个日志写入者
+"""
+import time
+import uuid
+import threading
+from typing import Callable, Dict, Any, List, Optional
+
+from annotation_manager import AnnotationRegistry
+
+
+class Workspace:
+    """单个会话的工作区"""
+
+    def __init__(self, workspace_id: str):
+        self.workspace_id = workspace_id
+        self.doctor_name = ""
+        self.data_directory = ""
+        self.loader = None
+        self.annotation_manager = None
+        self.last_seen = time.monotonic()
+        # 切换当前文件、修改标注时持有(同一会话可能有多个并发请求)
+        self.lock = threading.RLock()
+
+    @property
+    def file_path(self) -> Optional[str]:
+        """当前打开的文件"""
+        return self.loader.file_path if self.loader is not None else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化工作区状态"""
+        return {
+            'workspace_id': self.workspace_id,
+            'doctor_name': self.doctor_name,
+            'directory': self.data_directory,
+            'file': self.file_path,
+            'idle_seconds': time.monotonic() - self.last_seen
+        }
+
+
+class WorkspaceManager:
+    """会话工作区管理: 创建、切换当前文件、回收长时间未活动的工作区"""
+
+    def __init__(self, pool, idle_timeout: float = 8 * 3600,
+                 on_expire: Optional[Callable[[Workspace], None]] = None,
+                 expire_interval: float = 60.0,
+                 annotations: Optional[AnnotationRegistry] = None):
+        """
+        初始化
+
+        Args:
+            pool: 共享体数据池(提供 release(loader) 的VolumeCache)
+            idle_timeout: 工作区超过该时间(秒)未活动时释放其体数据并移除
+            on_expire: 工作区被移除时的回调(用于清理预取列表等)
+            expire_interval: 请求中检查过期工作区的最小间隔(秒)
+            annotations: 共享的标注管理器(提供 release(manager)), None时新建
+        """
+        self.pool = pool
+        self.annotations = annotations if annotations is not None else AnnotationRegistry()
+        self.idle_timeout = idle_timeout
+        self.on_expire = on_expire
+        self.expire_interval = expire_interval
+        self._workspaces: Dict[str, Workspace] = {}
+        self._next_expiry = time.monotonic() + expire_interval
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_id() -> str:
+        """生成新的工作区ID"""
+        return uuid.uuid4().hex
+
+    def get(self, workspace_id: str) -> Workspace:
+        """
+        获取工作区(不存在时创建), 并更新活动时间;
+        距上次检查超过 expire_interval 秒时顺带回收超时的工作区(避免每个切片请求都遍历)
+
+        Args:
+            workspace_id: 工作区ID
+
+        Returns:
+            Workspace
+        """
+        with self._lock:
+            workspace = self._workspaces.get(workspace_id)
+            if workspace is None:
+                workspace = self._workspaces[workspace_id] = Workspace(workspace_id)
+            workspace.last_seen = time.monotonic()
+            expire_due = workspace.last_seen >= self._next_expiry
+
+        if expire_due:
+            self.expire_idle()
+        return workspace
+
+    def open_file(self, workspace: Workspace, loader, annotation_manager,
+                  check: Optional[Callable[[], None]] = None):
+        """
+        切换工作区的当前文件, 释放之前文件的引用并关闭其标注管理器
+
+        Args:
+            workspace: 工作区
+            loader: 已从体数据池acquire的loader(引用归工作区所有)
+            annotation_manager: 已从annotations acquire的标注管理器(引用归工作区所有)
+            check: 切换前在工作区锁内调用的检查函数(如任务已取消时抛出异常), 抛出时释放loader和标注管理器
+        """
+        with workspace.lock:
+            try:
+                if check is not None:
+                    check()
+            except BaseException:
+                if annotation_manager is not None:
+                    self.annotations.release(annotation_manager)
+                self.pool.release(loader)
+                raise
+            previous = workspace.loader
+            previous_manager = workspace.annotation_manager
+            workspace.loader = loader
+            workspace.annotation_manager = annotation_manager
+
+        # 重新打开同一文件时管理器相同, 引用计数已在acquire时增加, 同样释放一次
+        if previous_manager is not None:
+            self.annotations.release(previous_manager)
+        if previous is not None:
+            self.pool.release(previous)
+
+    def close(self, workspace_id: str):
+        """移除工作区并释放其体数据"""
+        with self._lock:
+            workspace = self._workspaces.pop(workspace_id, None)
+        if workspace is not None:
+            self._dispose(workspace)
+
+    def expire_idle(self) -> int:
+        """
+        回收超时未活动的工作区
+
+        Returns:
+            回收数量
+        """
+        with self._lock:
+            expired = self._pop_expired_locked()
+        for workspace in expired:
+            self._dispose(workspace)
+        return len(expired)
+
+    def _pop_expired_locked(self) -> List[Workspace]:
+        """取出超时的工作区(调用方需持有锁)"""
+        now = time.monotonic()
+        self._next_expiry = now + self.expire_interval
+        deadline = now - self.idle_timeout
+        expired = [ws for ws in self._workspaces.values() if ws.last_seen < deadline]
+        for workspace in expired:
+            del self._workspaces[workspace.workspace_id]
+        return expired
+
+    def _dispose(self, workspace: Workspace):
+        """释放工作区持有的体数据"""
+        with workspace.lock:
+            loader = workspace.loader
+            annotation_manager = workspace.annotation_manager
+            workspace.loader = None
+            workspace.annotation_manager = None
+        if annotation_manager is not None:
+            self.annotations.release(annotation_manager)
+        if loader is not None:
+            self.pool.release(loader)
+        if self.on_expire is not None:
+            self.on_expire(workspace)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        with self._lock:
+            workspaces = list(self._workspaces.values())
+        return {
+            'count': len(workspaces),
+            'idle_timeout': self.idle_timeout,
+            'annotations': self.annotations.stats(),
+            'workspaces': [ws.to_dict() for ws in workspaces]
+        }